@@ -107,7 +107,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ConcreteUserJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     )
@@ -131,9 +131,80 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=60),
     'ROTATE_REFRESH_TOKENS': True,
-    'BLACKLIST_AFTER_ROTATION': True
+    'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_REFRESH_SERIALIZER': 'users.authentication.ClaimsTokenRefreshSerializer',
 }
 
+# Restaurant and menu payloads are cached in Redis when CACHE_REDIS_URL is set, otherwise in each process.
+# Changes clear the cache of the process that made them; other processes catch up after PAYLOAD_CACHE_SECONDS,
+# so without Redis entries are only kept for a few seconds.
+if os.environ.get('CACHE_REDIS_URL'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.environ['CACHE_REDIS_URL']}}
+    PAYLOAD_CACHE_SECONDS = int(os.environ.get('PAYLOAD_CACHE_SECONDS', 60))
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'OPTIONS': {'MAX_ENTRIES': 10000}}}
+    PAYLOAD_CACHE_SECONDS = int(os.environ.get('PAYLOAD_CACHE_SECONDS', 5))
+
+# Nearby restaurant search
+NEARBY_RESTAURANTS_RADIUS_MILES = float(os.environ.get('NEARBY_RESTAURANTS_RADIUS_MILES', 5))
+NEARBY_RESTAURANTS_MAX_RADIUS_MILES = float(os.environ.get('NEARBY_RESTAURANTS_MAX_RADIUS_MILES', 50))
+NEARBY_RESTAURANTS_LIMIT = 50
+NEARBY_RESTAURANTS_MAX_LIMIT = 200
+RESTAURANT_LOCATION_CACHE_SECONDS = int(os.environ.get('RESTAURANT_LOCATION_CACHE_SECONDS', 60))
+
+# Geocoding of restaurant addresses: 'mapbox', or 'stub' to work offline
+GEOCODER = os.environ.get('GEOCODER', 'mapbox')
+MAPBOX_API_KEY = os.environ.get('MAPBOX_API_KEY')
+GEOCODE_TIMEOUT = 5
+GEOCODE_CACHE_SIZE = 1024
+# Save address changes right away and fill in new coordinates from a background task
+GEOCODE_IN_BACKGROUND = os.environ.get('GEOCODE_IN_BACKGROUND') == 'true'
+
+# Upper bound on hashed contacts accepted by match-contacts/, and how often each customer can call it
+MATCH_CONTACTS_MAX_HASHES = 10000
+MATCH_CONTACTS_RATE = os.environ.get('MATCH_CONTACTS_RATE', '20/day')
+
+# Append scans to a PointDelta ledger instead of updating balances, for promotions with very busy restaurants
+POINTS_BUFFERED_SCANS = os.environ.get('POINTS_BUFFERED_SCANS') == 'true'
+POINTS_COMPACT_DELAY_SECONDS = 1
+POINTS_COMPACT_BATCH_SIZE = 1000
+
+# New customers get SIGNUP_BONUS_POINTS at this restaurant
+SIGNUP_BONUS_RESTAURANT_ID = int(os.environ.get('SIGNUP_BONUS_RESTAURANT_ID', 115))
+SIGNUP_BONUS_POINTS = 3
+
+# Ledger snapshots leave out entries this recent, in case an earlier entry is still being committed
+LEDGER_SNAPSHOT_LAG_SECONDS = 5 * 60
+
+# Transactions are rolled up into RestaurantStats once they are this old; newer ones are counted live
+RESTAURANT_STATS_LAG_SECONDS = 60
+RESTAURANT_STATS_BATCH_SIZE = 10000
+RESTAURANT_STATS_MAX_HOURS = 7 * 24
+
+# Background tasks run in a thread of each web process; set to run them inline instead
+TASKS_ALWAYS_EAGER = os.environ.get('TASKS_ALWAYS_EAGER') == 'true'
+
+# Expo push notifications
+EXPO_PUSH_TOKEN = os.environ.get('EXPO_PUSH_TOKEN')
+EXPO_PUSH_URL = os.environ.get('EXPO_PUSH_URL', 'https://exp.host/--/api/v2/push/send')
+EXPO_RECEIPTS_URL = os.environ.get('EXPO_RECEIPTS_URL', 'https://exp.host/--/api/v2/push/getReceipts')
+PUSH_BATCH_WINDOW_SECONDS = 0.1
+PUSH_REQUEST_TIMEOUT = 10
+PUSH_RECEIPT_DELAY_SECONDS = 15 * 60
+PUSH_RECEIPT_MAX_POLLS = 3
+
+# How often the run_worker command looks for due outbound messages
+WORKER_POLL_SECONDS = 5
+
+# Retries for outbound text messages, emails and push notifications
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BACKOFF_SECONDS = 30
+OUTBOX_SENDING_TIMEOUT_SECONDS = 5 * 60
+
+# Outbound text messages
+SMS_RATE_PER_SECOND = float(os.environ.get('SMS_RATE_PER_SECOND', 1))
+TWILIO_STATUS_CALLBACK_URL = os.environ.get('TWILIO_STATUS_CALLBACK_URL')
+
 # Email details
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -24,10 +24,12 @@ from users.function_views import get_customer, update_customer, delete_customer,
 from users.function_views import get_manager, update_manager, delete_manager, delete_manager_request, update_restaurant, create_item
 from users.function_views import  update_item, delete_item, generate_qr, get_qr, validate_redemption, generate_ws_access_token, set_push_token
 from users.function_views import add_friend, send_point_twilio, has_accounts, send_point, create_referral, use_referral
-from users.function_views import send_point_push_notification, send_friend_request_push_notification
+from users.function_views import send_point_push_notification, send_friend_request_push_notification, match_contacts
+from users.function_views import send_push_notification, twilio_status_callback
 from users.get_function_views import get_customer_points, get_customer_points_list, get_customer_points_manager_view
 from users.get_function_views import get_items_by_restaurant, get_restaurant, get_customer_manager_view, get_all_restaurants
 from users.get_function_views import get_friends, get_push_tokens, get_transactions_by_customer, get_restaurants_by_location, dummy
+from users.get_function_views import export_transactions, get_restaurant_stats
 
 from rest_framework.routers import DefaultRouter
 
@@ -90,6 +92,8 @@ urlpatterns = [
     path('get-qr', get_qr),
     path('validate-redemption/', validate_redemption), 
     path('get-transactions-by-customer/<int:customer_id>', get_transactions_by_customer),
+    path('export-transactions/<str:file_format>', export_transactions),
+    path('get-restaurant-stats', get_restaurant_stats),
 
     # GET ENDPOINTS
     path('get-restaurant/<int:restaurant_id>', get_restaurant), 
@@ -105,9 +109,12 @@ urlpatterns = [
 
     # PUSH NOTIFICATION
     path('has-accounts/', has_accounts),
+    path('match-contacts/', match_contacts),
     path('send-point-push-notification/', send_point_push_notification),
     path('send-friend-request-push-notification/', send_friend_request_push_notification),
+    path('send-push-notification/', send_push_notification),
     path('generate-ws-access-token/', generate_ws_access_token),
+    path('twilio-status-callback/', twilio_status_callback),
 
     path('dummy/', dummy),
 
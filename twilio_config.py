@@ -1,6 +1,8 @@
 """ Configures Twilio module """
 import os
+from uuid import uuid4
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
 
 environment = os.getenv('ENVIRONMENT')
 
@@ -17,13 +19,26 @@ class TwilioTestClientMessages:
 
     created = []
 
-    def create(self, to, from_, body):
+    def create(self, to, from_, body, status_callback=None):
         """ Adds text message to message list """
+        message = TwilioTestMessage(to, from_, body)
         self.created.append({
             'to': to,
             'from_': from_,
-            'body': body
+            'body': body,
+            'sid': message.sid,
         })
+        return message
+
+class TwilioTestMessage:
+    """ Message returned by the testing client """
+
+    def __init__(self, to, from_, body):
+        self.sid = 'SM' + uuid4().hex
+        self.status = 'queued'
+        self.to = to
+        self.from_ = from_
+        self.body = body
 
 account_sid = os.environ.get('TWILIO_ACCOUNT_SID')
 auth_token = os.environ.get('TWILIO_AUTH_TOKEN')
@@ -32,4 +47,5 @@ twilio_phone_number = os.environ.get('TWILIO_PHONE_NUMBER')
 if environment == 'local' or not account_sid or not auth_token:
     twilio_client = TwilioTestClient(account_sid, auth_token)
 else:
-    twilio_client = Client(account_sid, auth_token)
+    # One HTTP client (and connection pool) shared by every send in this process
+    twilio_client = Client(account_sid, auth_token, http_client=TwilioHttpClient(pool_connections=True, timeout=10))
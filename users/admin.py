@@ -2,6 +2,7 @@ from django.contrib import admin
 
 from users.models import Customer, Manager, Restaurant, Item, CustomerPoints, ItemRedemption, RestaurantQR
 from users.models import PhoneAuthentication, EmailAuthentication, Friendship, Referral, PushToken, Transaction
+from users.models import OutboundSMS, SMSSendSlot, OutboundEmail, OutboundPush, GeocodeCache, PointDelta, LedgerEntry, LedgerSnapshot, RestaurantStats
 
 # Register your models here.
 
@@ -18,3 +19,12 @@ admin.site.register(Friendship)
 admin.site.register(Referral)
 admin.site.register(PushToken)
 admin.site.register(Transaction)
+admin.site.register(OutboundSMS)
+admin.site.register(SMSSendSlot)
+admin.site.register(OutboundEmail)
+admin.site.register(OutboundPush)
+admin.site.register(GeocodeCache)
+admin.site.register(PointDelta)
+admin.site.register(LedgerEntry)
+admin.site.register(LedgerSnapshot)
+admin.site.register(RestaurantStats)
@@ -0,0 +1,155 @@
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from users.models import User, Customer, Manager
+
+class ConcreteUserJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that sets request.user to the Customer or Manager itself.
+
+    The user, its subclass row and a manager's restaurant are loaded in one query, so
+    views don't need to look the customer or manager up again.
+    """
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        try:
+            user = User.objects.select_related('customer', 'manager__restaurant').get(**{api_settings.USER_ID_FIELD: user_id})
+        except User.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return concrete_user(user)
+
+class ClaimsUser(TokenUser):
+    """
+    A user built from the claims added by tokens_for_user, without a database lookup.
+    """
+    @cached_property
+    def role(self):
+        return self.token['role']
+
+    @cached_property
+    def is_active(self):
+        return self.token['is_active']
+
+    @cached_property
+    def customer_id(self):
+        return self.token.get('customer_id')
+
+    @cached_property
+    def restaurant_id(self):
+        return self.token.get('restaurant_id')
+
+class ClaimsJWTAuthentication(ConcreteUserJWTAuthentication):
+    """
+    Authenticates from the token's claims alone, for read-only views that only need the role.
+
+    Tokens minted before the claims were added fall back to loading the user. Refreshing
+    reloads the claims (see ClaimsTokenRefreshSerializer), so a deactivated user keeps access
+    to these views until their current access token expires.
+    """
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        if 'role' not in validated_token or 'is_active' not in validated_token:
+            return super().get_user(validated_token)
+
+        user = ClaimsUser(validated_token)
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Refreshes with the user's current claims instead of the ones in the refresh token,
+    and refuses users that were deleted or deactivated since it was minted.
+    """
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        try:
+            user_id = refresh[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        try:
+            user = User.objects.select_related('customer', 'manager__restaurant').get(**{api_settings.USER_ID_FIELD: user_id})
+        except User.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        add_claims(refresh, concrete_user(user))
+        return super().validate({'refresh': str(refresh)})
+
+def add_claims(token, user):
+    """
+    Set the claims ClaimsJWTAuthentication reads on token.
+    """
+    token['role'] = user.role
+    token['is_active'] = user.is_active
+
+    if isinstance(user, Customer):
+        token['customer_id'] = user.id
+    elif isinstance(user, Manager):
+        try:
+            token['restaurant_id'] = user.restaurant.id
+        except ObjectDoesNotExist:
+            token['restaurant_id'] = None
+
+def tokens_for_user(user):
+    """
+    Mint a refresh/access token pair carrying the claims ClaimsJWTAuthentication reads.
+    """
+    refresh = RefreshToken.for_user(user)
+    add_claims(refresh, user)
+
+    return {
+        'refresh': str(refresh),
+        'access': str(refresh.access_token),
+    }
+
+def concrete_user(user):
+    """
+    The Customer or Manager row of user if it was select_related, otherwise user.
+    """
+    for related_name in ('customer', 'manager'):
+        child = User._meta.get_field(related_name).get_cached_value(user, default=None)
+        if child is not None:
+            return child
+    return user
+
+def request_customer(request):
+    """
+    The authenticated customer. Raises Customer.DoesNotExist like Customer.objects.get.
+    """
+    if isinstance(request.user, Customer):
+        return request.user
+    return Customer.objects.get(username=request.user.username)
+
+def request_manager(request):
+    """
+    The authenticated manager. Raises Manager.DoesNotExist like Manager.objects.get.
+    """
+    if isinstance(request.user, Manager):
+        return request.user
+    return Manager.objects.select_related('restaurant').get(username=request.user.username)
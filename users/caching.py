@@ -0,0 +1,95 @@
+import hashlib, json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils.http import http_date
+
+from users.models import Restaurant, Item
+from users.views import RestaurantSerializer, ItemSerializer
+
+def restaurant_key(restaurant_id):
+    return f'restaurant:{restaurant_id}'
+
+def items_key(restaurant_id):
+    return f'items:{restaurant_id}'
+
+def payload_etag(payload):
+    body = json.dumps(payload, cls=DjangoJSONEncoder, sort_keys=True, separators=(',', ':'))
+    return '"' + hashlib.md5(body.encode()).hexdigest() + '"'
+
+def version_etag(*version):
+    """
+    ETag for a representation that is fully determined by version, e.g. the result of an
+    aggregate over the rows it is built from, so it can be checked without building it.
+    """
+    # str() keeps full microsecond precision, which DjangoJSONEncoder truncates
+    body = json.dumps(list(version), default=str, separators=(',', ':'))
+    return '"' + hashlib.md5(body.encode()).hexdigest() + '"'
+
+def cached_payload(key, build):
+    """
+    Return (payload, etag, last_modified) for key from the cache, building and caching them on a miss.
+    build returns (payload, last_modified), or None when there is nothing to cache.
+    """
+    entry = cache.get(key)
+    if entry is None:
+        built = build()
+        if built is None:
+            return None, None, None
+        payload, last_modified = built
+        entry = (payload, payload_etag(payload), last_modified)
+        cache.set(key, entry, settings.PAYLOAD_CACHE_SECONDS)
+    return entry
+
+def restaurant_payload(restaurant_id):
+    def build():
+        restaurant = Restaurant.objects.filter(id=restaurant_id).first()
+        return (RestaurantSerializer(restaurant).data, None) if restaurant else None
+    return cached_payload(restaurant_key(restaurant_id), build)
+
+def items_payload(restaurant_id):
+    def build():
+        items = list(Item.objects.filter(restaurant=restaurant_id))
+        return ItemSerializer(items, many=True).data, max((item.updated_at for item in items), default=None)
+    return cached_payload(items_key(restaurant_id), build)
+
+def etag_matches(request, etag):
+    """
+    Whether the request's If-None-Match header names etag, so it can be answered with a 304.
+    """
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+def validator_headers(etag, last_modified=None):
+    """
+    ETag and Last-Modified headers for a response.
+
+    Last-Modified is the newest change the version aggregate can see; it cannot see deleted
+    rows, so 304s are only ever answered from If-None-Match.
+    """
+    headers = {'ETag': etag}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified.timestamp())
+    return headers
+
+def invalidate(*keys):
+    cache.delete_many(keys)
+    # A request reading between now and the commit could cache the old rows again
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def restaurant_cache_receiver(sender, instance, **kwargs):
+    invalidate(restaurant_key(instance.id), items_key(instance.id))
+
+@receiver(post_save, sender=Item)
+@receiver(post_delete, sender=Item)
+def item_cache_receiver(sender, instance, **kwargs):
+    invalidate(items_key(instance.restaurant_id))
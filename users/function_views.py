@@ -1,4 +1,4 @@
-import datetime, jwt, uuid, os, requests, json
+import datetime, jwt, uuid, os, json
 from datetime import timedelta
 from uuid import uuid4
 
@@ -6,41 +6,42 @@ from rest_framework.decorators import api_view
 
 from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.decorators import permission_classes
+from rest_framework.decorators import permission_classes, throttle_classes
+from django.db.models import Q
 from django.dispatch import receiver
 from django.utils import timezone
-from django.core.mail import send_mail
-
-from geopy.geocoders import MapBox
+from django.conf import settings
 
 from users.models import Customer, Manager, Item, ItemRedemption, RestaurantQR, CustomerPoints
-from users.models import Friendship, Restaurant, Referral, PushToken, Transaction, restaurant_signal
+from users.models import Friendship, Restaurant, Referral, PushToken, restaurant_signal
 from users.views import CustomerSerializer, ManagerSerializer, ItemSerializer, RestaurantSerializer
 from users.views import ItemRedemptionSerializer, RestaurantQRSerializer, FriendshipSerializer, ReferralSerializer
 from users.views import PushTokenSerializer
 from users.permissions import CustomerPermissions, ManagerPermissions, IsAuthenticatedAndActive
-
-from twilio_config import twilio_client, twilio_phone_number
-from twilio.base.exceptions import TwilioException
+from users.throttling import ContactMatchThrottle
+from users.authentication import request_customer, request_manager
+from users import ledger
+from users.tasks import defer
+from users.phone import normalize_phone_number
+from users.caching import invalidate, items_key
+from users.geocoding import set_restaurant_address, geocode_restaurant_later
+from users.mail import queue_email
+from users.sms import queue_sms, update_delivery_status
+from users.push import queue_push, notify_customer, point_gift_message, friend_request_message
+
+from twilio_config import twilio_client, auth_token, TwilioTestClient
+from twilio.request_validator import RequestValidator
 
 @receiver(restaurant_signal)
 def restaurant_signal_receiver(sender, restaurant_id, **kwargs):
-    generate_new_qr_code(sender)
-
-def geocode_address(address_str, access_token=os.environ.get('MAPBOX_API_KEY')):
-    geolocator = MapBox(api_key=access_token)
-    location = geolocator.geocode(address_str)
-
-    if location is None:
-        return None
-
-    return (location.latitude, location.longitude)
+    # Rotate the QR code after the response; a burst of scans produces one rotation
+    defer(f"rotate-qr:{restaurant_id}", generate_new_qr_code, sender)
 
 @api_view(['GET'])
 @permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
 def get_customer(request):
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
         return Response("Customer not found. Please log in as a customer.", status=404)
     
@@ -51,7 +52,7 @@ def get_customer(request):
 @permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
 def update_customer(request):
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
         return Response("Customer not found. Please log in as a customer.", status=404)
     
@@ -91,7 +92,7 @@ def delete_customer(request):
 @permission_classes([ManagerPermissions, IsAuthenticatedAndActive])
 def get_manager(request):
     try:
-        manager = Manager.objects.get(username=request.user.username)
+        manager = request_manager(request)
     except Manager.DoesNotExist:
         return Response("Manager not found. Please log in as a manager.", status=404)
     
@@ -102,7 +103,7 @@ def get_manager(request):
 @permission_classes([ManagerPermissions, IsAuthenticatedAndActive])
 def update_manager(request):
     try:
-        manager = Manager.objects.get(username=request.user.username)
+        manager = request_manager(request)
     except Manager.DoesNotExist:
         return Response("Manager not found. Please log in as a manager.", status=404)
     
@@ -116,17 +117,16 @@ def update_manager(request):
     # Update the manager instance with the validated data
     for attr, value in validated_data.items():
         if attr == "restaurant":
+            geocode_pending = False
             for restaurant_attr, restaurant_value in value.items():
                 if restaurant_attr == 'address':
-                    location = geocode_address(restaurant_value)
-                    if location:
-                        manager.restaurant.latitude, manager.restaurant.longitude = location
-                    else:
-                        manager.restaurant.latitude = None
-                        manager.restaurant.longitude = None
-                setattr(manager.restaurant, restaurant_attr, restaurant_value)
+                    geocode_pending = set_restaurant_address(manager.restaurant, restaurant_value)
+                else:
+                    setattr(manager.restaurant, restaurant_attr, restaurant_value)
             # Save the updated restaurant object
             manager.restaurant.save()
+            if geocode_pending:
+                geocode_restaurant_later(manager.restaurant)
         else:
             setattr(manager, attr, value)
 
@@ -151,17 +151,12 @@ def delete_manager(request):
 @permission_classes([ManagerPermissions, IsAuthenticatedAndActive])
 def delete_manager_request(request):
     manager = request.user
-    try:
-        send_mail(
-            subject="Delete Manager Request",
-            message=f"{manager.first_name} {manager.last_name} would like to delete their account. Account ID: {manager.id}",
-            from_email=os.environ.get('EMAIL_HOST_USER'),
-            recipient_list=['dutchpay@dutchpay.co']
-        )
-    except Exception as e:
-        # Log the error or handle it as appropriate for your application
-        print(f"An error occurred while sending email: {e}")
-        return Response(status=400)
+    queue_email(
+        subject="Delete Manager Request",
+        message=f"{manager.first_name} {manager.last_name} would like to delete their account. Account ID: {manager.id}",
+        from_email=os.environ.get('EMAIL_HOST_USER'),
+        recipient_list=['dutchpay@dutchpay.co']
+    )
     
     return Response(status=200)
 
@@ -169,7 +164,7 @@ def delete_manager_request(request):
 @permission_classes([ManagerPermissions, IsAuthenticatedAndActive])
 def update_restaurant(request):
     try:
-        manager = Manager.objects.get(username=request.user.username)
+        manager = request_manager(request)
     except Manager.DoesNotExist:
         return Response("Manager not found. Please log in as a manager.", status=404)
     
@@ -188,22 +183,19 @@ def update_restaurant(request):
     validated_data = serializer.validated_data
 
     # Update the customer instance with the validated data
+    geocode_pending = False
     for attr, value in validated_data.items():
         if attr == 'address':
             # Geocode the new address to get latitude and longitude
-            location = geocode_address(value)
-            if location:
-                restaurant.latitude, restaurant.longitude = location
-            else:
-                restaurant.latitude = None
-                restaurant.longitude = None
-            restaurant.address = value
+            geocode_pending = set_restaurant_address(restaurant, value)
             print(restaurant.address)
         else:
             setattr(restaurant, attr, value)
 
     # Save the customer instance
     restaurant.save()
+    if geocode_pending:
+        geocode_restaurant_later(restaurant)
 
     # Retrieve the updated customer instance from the database
     instance = Restaurant.objects.get(id=restaurant.id)
@@ -219,7 +211,7 @@ def create_item(request):
     num_points = request.data.get('num_points')
 
     try:
-        manager = Manager.objects.get(username=request.user.username)
+        manager = request_manager(request)
     except Manager.DoesNotExist:
         return Response("Manager not found. Please log in as a manager.", status=404)
 
@@ -247,7 +239,10 @@ def update_item(request):
 
     serializer = ItemSerializer(item, data=request.data, partial=True)
     if serializer.is_valid():
+        previous_restaurant_id = item.restaurant_id
         serializer.save()
+        if item.restaurant_id != previous_restaurant_id:
+            invalidate(items_key(previous_restaurant_id))
         return Response(serializer.data, status=200)
     else:
         return Response(serializer.errors, status=400)
@@ -273,7 +268,7 @@ def create_redemption(request):
     item_id = request.data.get('item_id')
 
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
         return Response("Customer account not found. Please log in as a customer.", status=404)
 
@@ -283,11 +278,8 @@ def create_redemption(request):
         return Response("Item not found", status=404)
     
     # Check if customer has enough points
-    try:
-        customer_points = CustomerPoints.objects.get(restaurant=item.restaurant, customer=customer)
-        if customer_points.num_points < item.num_points:
-            return Response("You do not have enough points.", status=404)
-    except CustomerPoints.DoesNotExist:
+    customer_points = ledger.current_balances(CustomerPoints.objects.filter(restaurant=item.restaurant, customer=customer))
+    if not customer_points or customer_points[0].num_points < item.num_points:
         return Response("You do not have enough points.", status=404)
 
     item_redemption = ItemRedemption.objects.create(
@@ -335,7 +327,7 @@ def generate_new_qr_code(restaurant):
 @permission_classes([ManagerPermissions, IsAuthenticatedAndActive])
 def generate_qr(request): 
     try:
-        manager = Manager.objects.get(username=request.user.username)
+        manager = request_manager(request)
     except Manager.DoesNotExist:
         return Response("Manager not found. Please log in as a manager.", status=404)
     
@@ -347,7 +339,7 @@ def generate_qr(request):
 @permission_classes([ManagerPermissions, IsAuthenticatedAndActive])
 def get_qr(request): 
     try:
-        manager = Manager.objects.get(username=request.user.username)
+        manager = request_manager(request)
     except Manager.DoesNotExist:
         return Response("Manager not found. Please log in as a manager.", status=404)
     
@@ -364,7 +356,7 @@ def award_point(request):
     code = request.data.get('code')
 
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
         return Response("Customer not found. Please log in as a customer.", status=404)
 
@@ -379,35 +371,13 @@ def award_point(request):
         return Response("Invalid QR. Please generate another.", status=404)
     
     restaurant = restaurant_qr.restaurant
-    
-    try:
-        customer_points = CustomerPoints.objects.get(restaurant=restaurant, customer=customer)
-        # time_elapsed = timezone.now() - customer_points.timestamp
-        # if time_elapsed < timedelta(minutes=10) and not customer.username in ["+13103872336", "+13103438777"]:
-        #     return Response("You can only earn one point every 10 minutes.", status=400)
-        customer_points.num_points += 1
-        customer_points.timestamp = timezone.now()
-        customer_points.give_point_eligible = True
-        customer_points.save()
-    except CustomerPoints.DoesNotExist:
-        customer_points = CustomerPoints(customer=customer, restaurant=restaurant, num_points=1, timestamp=timezone.now(), give_point_eligible=True)
-        customer_points.save()
 
-    restaurant_signal.send(sender=restaurant, restaurant_id=restaurant.id)
+    # time_elapsed = timezone.now() - customer_points.timestamp
+    # if time_elapsed < timedelta(minutes=10) and not customer.username in ["+13103872336", "+13103438777"]:
+    #     return Response("You can only earn one point every 10 minutes.", status=400)
+    ledger.award_point(customer, restaurant)
 
-    customer_dict = {
-        "first_name": customer.first_name,
-        "last_name": customer.last_name,
-        "id": customer.id,
-    }
-
-    transaction = Transaction(
-        restaurant=restaurant, 
-        customer_string=json.dumps(customer_dict),
-        transaction_type="point",
-        num_points=1,
-    )
-    transaction.save()
+    restaurant_signal.send(sender=restaurant, restaurant_id=restaurant.id)
 
     return Response({"message": "Point awarded successfully.",
                      "restaurant_id": restaurant.id}, status=200)
@@ -422,7 +392,7 @@ def send_point(request):
         return Response("Missing information", status=400)
     
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
         return Response("Customer not found. Please log in as a customer.", status=404)
 
@@ -440,39 +410,9 @@ def send_point(request):
         return Response("Restaurant not found.", status=404)
 
     # Check if user is eligible to give a point
-    try:
-        customer_points = CustomerPoints.objects.get(customer=customer, restaurant=restaurant)
-    except CustomerPoints.DoesNotExist:
-        return Response("You do not have any points at this restaurant.", status=404)
-    
-    if customer_points.give_point_eligible:
-        try:
-            friend_points = CustomerPoints.objects.get(customer=friend, restaurant=restaurant)
-            friend_points.num_points += 1
-            friend_points.timestamp = timezone.now()
-            friend_points.save()
-        except CustomerPoints.DoesNotExist:
-            friend_points = CustomerPoints(customer=friend, restaurant=restaurant, num_points=1, timestamp=timezone.now())
-            friend_points.save()
-        finally:
-            customer_dict = {
-                "first_name": friend.first_name,
-                "last_name": friend.last_name,
-                "id": friend.id,
-            }
-
-            transaction = Transaction(
-                restaurant=restaurant, 
-                customer_string=json.dumps(customer_dict),
-                transaction_type="gift",
-                transaction_reward=customer.first_name,
-                num_points=1,
-            )
-            transaction.save()
-
-            customer_points.give_point_eligible = False
-            customer_points.save()
-    else:
+    if not ledger.gift_point(customer, friend, restaurant):
+        if not CustomerPoints.objects.filter(customer=customer, restaurant=restaurant).exists():
+            return Response("You do not have any points at this restaurant.", status=404)
         return Response({"message": "You are not eligible to give a point."}, status=400)
 
     return Response({"message": "Point given successfully."}, status=200)
@@ -494,45 +434,17 @@ def validate_redemption(request):
 
     if item_redemption.item.restaurant.manager.username != request.user.username:
         return Response("Invalid. Please log in as the manager of this restaurant.", status=403)
-    
-    num_points = item_redemption.item.num_points
-    restaurant = item_redemption.item.restaurant
-    customer = item_redemption.customer
-    
-    # Use customer points
-    try:
-        customer_points = CustomerPoints.objects.get(restaurant=restaurant, customer=customer)
-        if customer_points.num_points >= num_points:
-            customer_points.num_points -= num_points
-            customer_points.save()
-        else:
-            return Response("Customer does not have enough points.", status=400)
-    except CustomerPoints.DoesNotExist:
-        return Response("Customer does not have enough points.", status=400)
-    
-    # Delete item redemption object
-    item_redemption.delete()
-
-    customer_dict = {
-        "first_name": customer.first_name,
-        "last_name": customer.last_name,
-        "id": customer.id,
-    }
 
-    transaction = Transaction(
-        restaurant=restaurant, 
-        customer_string=json.dumps(customer_dict),
-        transaction_type="reward",
-        transaction_reward=item_redemption.item.name,
-        num_points=num_points,
-    )
-    transaction.save()
+    # Use customer points and delete the item redemption object
+    updated_points = ledger.redeem_item(item_redemption)
+    if updated_points is None:
+        return Response("Customer does not have enough points.", status=400)
 
     item_serializer = ItemSerializer(item_redemption.item)
     return Response({"message": "Item redemption used successfully", 
                      "item": item_serializer.data,
-                     "customer_id": customer.id,
-                     "updated_points": customer_points.num_points}, status=200)
+                     "customer_id": item_redemption.customer.id,
+                     "updated_points": updated_points}, status=200)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticatedAndActive])
@@ -554,8 +466,11 @@ def generate_ws_access_token(request):
     try:
         # Encode the JWT token using the SECRET_KEY_WS
         token = jwt.encode(payload, os.environ.get("SECRET_KEY_WS"), algorithm="HS256")
+        # PyJWT 1.x returns bytes, 2.x a str
+        if isinstance(token, bytes):
+            token = token.decode("utf-8")
 
-        return Response({"token": token.decode("utf-8")}, status=200)
+        return Response({"token": token}, status=200)
     except Exception as e:
         return Response(str(e), status=500)
     
@@ -568,11 +483,12 @@ def add_friend(request):
         return Response("Missing information.", status=400)
 
     try:
+        customer = request_customer(request)
         friend = Customer.objects.get(username=username)
     except Customer.DoesNotExist:
         return Response("Customer not found", status=404)
     
-    friendship = Friendship.objects.create(customer=request.user.customer, friend=friend)
+    friendship = Friendship.objects.create(customer=customer, friend=friend)
 
     serializer = FriendshipSerializer(friendship)
 
@@ -585,8 +501,13 @@ def send_point_twilio(request):
     friend_name = request.data.get("name")
     restaurant_id = request.data.get("restaurant_id")
 
-    first_name = request.user.customer.first_name
-    last_name = request.user.customer.last_name
+    try:
+        customer = request_customer(request)
+    except Customer.DoesNotExist:
+        return Response("Customer not found. Please log in as a customer.", status=404)
+
+    first_name = customer.first_name
+    last_name = customer.last_name
 
     if not phone_number or not friend_name or not restaurant_id:
         return Response("Missing information.", status=400)
@@ -596,16 +517,12 @@ def send_point_twilio(request):
     except Restaurant.DoesNotExist:
         return Response("Restaurant not found.", status=404)
 
-    try:
-        twilio_client.messages.create(
-            body=f"Hey {friend_name}! \n\n" +
-            f"{first_name} {last_name} gave you a free point at {restaurant.name} on PunchMe, the #1 social loyalty points program for free food, boba, and more! \n\n" +
-            f"Download the app here to redeem your point :) https://apps.apple.com/us/app/punchme/id6447275121?itsct=apps_box_link&itscg=30200",
-            from_=twilio_phone_number,
-            to=str(phone_number),
-        )
-    except TwilioException as e:
-        return Response({'error': 'Failed to send message'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    queue_sms(
+        to=phone_number,
+        body=f"Hey {friend_name}! \n\n" +
+        f"{first_name} {last_name} gave you a free point at {restaurant.name} on PunchMe, the #1 social loyalty points program for free food, boba, and more! \n\n" +
+        f"Download the app here to redeem your point :) https://apps.apple.com/us/app/punchme/id6447275121?itsct=apps_box_link&itscg=30200",
+    )
 
     return Response("message sent", status=200)
 
@@ -619,7 +536,7 @@ def create_referral(request):
         return Response("Missing information.", status=400)
     
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
         return Response("Customer not found. Please log in as a customer.", status=404)
     
@@ -646,7 +563,7 @@ def create_referral(request):
 @permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
 def use_referral(request):
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
         return Response("Customer not found. Please log in as a customer.", status=404)
     
@@ -665,25 +582,7 @@ def use_referral(request):
     except Restaurant.DoesNotExist:
         return Response("Restaurant not found.", status=404)
     
-    customer_points = CustomerPoints(customer=customer, restaurant=restaurant, num_points=1, timestamp=timezone.now())
-    customer_points.save()
-    
-    referral.delete()
-
-    customer_dict = {
-        "first_name": customer.first_name,
-        "last_name": customer.last_name,
-        "id": customer.id,
-    }
-
-    transaction = Transaction(
-        restaurant=restaurant, 
-        customer_string=json.dumps(customer_dict),
-        transaction_type="gift",
-        transaction_reward=friend.first_name,
-        num_points=1,
-    )
-    transaction.save()
+    ledger.use_referral(referral, customer)
 
     return Response({"message": "Referral used successfully.",
                         "first_name": friend.first_name,
@@ -697,31 +596,78 @@ def has_accounts(request):
     account_list = []
     no_account_list = []
 
+    if not isinstance(contacts, list):
+        return Response("Missing information.", status=400)
+
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
         return Response("Customer not found. Please log in as a customer.", status=404)
-    
+
+    # Normalize every number of every contact in one pass, skipping entries that aren't shaped like contacts
+    contact_numbers = []
     for contact in contacts:
-        if "phoneNumbers" in contact:
-            phone_number = contact["phoneNumbers"][0]["digits"]
-            
-            if not phone_number.startswith("+1"):
-                phone_number = "+1" + phone_number
-            
-            try:
-                friend = Customer.objects.get(username=phone_number)
-                if(friend != customer):
-                    try:
-                        Friendship.objects.get(customer=customer, friend=friend)
-                    except Friendship.DoesNotExist:
-                        account_list.append(contact)
-            except Customer.DoesNotExist:
-                no_account_list.append(contact)
+        if not isinstance(contact, dict) or not isinstance(contact.get("phoneNumbers"), list):
+            continue
+        numbers = []
+        for entry in contact["phoneNumbers"]:
+            if not isinstance(entry, dict):
+                continue
+            raw_number = entry.get("digits") or entry.get("number")
+            phone_number = normalize_phone_number(raw_number) if isinstance(raw_number, str) else None
+            if phone_number:
+                numbers.append(phone_number)
+        if numbers:
+            contact_numbers.append((contact, numbers))
+
+    # Resolve all numbers and existing friendships with one query each
+    all_numbers = {phone_number for _, numbers in contact_numbers for phone_number in numbers}
+    account_ids = dict(Customer.objects.filter(phone_e164__in=all_numbers).values_list('phone_e164', 'id'))
+    friend_ids = set(Friendship.objects.filter(customer=customer, friend__in=account_ids.values()).values_list('friend_id', flat=True))
+
+    for contact, numbers in contact_numbers:
+        matches = {account_ids[phone_number] for phone_number in numbers if phone_number in account_ids}
+        if not matches:
+            no_account_list.append(contact)
+        elif matches - friend_ids - {customer.id}:
+            account_list.append(contact)
 
     return Response({"account_list": account_list,
                      "no_account_list": no_account_list}, status=200)
 
+@api_view(['POST'])
+@permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
+@throttle_classes([ContactMatchThrottle])
+def match_contacts(request):
+    hashes = request.data.get("hashes")
+
+    if not isinstance(hashes, list):
+        return Response("Missing information.", status=400)
+
+    if len(hashes) > settings.MATCH_CONTACTS_MAX_HASHES:
+        return Response(f"At most {settings.MATCH_CONTACTS_MAX_HASHES} contacts can be matched at once.", status=400)
+
+    try:
+        customer = request_customer(request)
+    except Customer.DoesNotExist:
+        return Response("Customer not found. Please log in as a customer.", status=404)
+
+    hashes = {str(phone_hash).lower() for phone_hash in hashes}
+    accounts = Customer.objects.filter(phone_hash__in=hashes).exclude(id=customer.id).only('id', 'first_name', 'last_name', 'phone_hash', 'profile_picture')
+    friend_ids = set(Friendship.objects.filter(customer=customer, friend__in=accounts).values_list('friend_id', flat=True))
+
+    matches = []
+    for account in accounts:
+        match = {"hash": account.phone_hash, "id": account.id, "is_friend": account.id in friend_ids}
+        # Only friends see who is behind a number
+        if match["is_friend"]:
+            match["first_name"] = account.first_name
+            match["last_name"] = account.last_name
+            match["profile_picture"] = account.profile_picture.url if account.profile_picture else None
+        matches.append(match)
+
+    return Response({"matches": matches}, status=200)
+
 @api_view(['POST'])
 @permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
 def set_push_token(request):
@@ -731,7 +677,7 @@ def set_push_token(request):
         return Response("Missing information.", status=400)
 
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
         return Response("Customer not found. Please log in as a customer.", status=404)
     
@@ -746,12 +692,10 @@ def set_push_token(request):
     )
     return Response({"message": "push token created successfully"}, status=201)
 
-from rest_framework.response import Response
-
 @api_view(['POST'])
 @permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
 def send_point_push_notification(request):
-    # Retrieve the push notification message and Expo push notification token from the request
+    # Retrieve the Expo push notification token from the request
     expo_token = request.data.get('push_token')
     restaurant_id = request.data.get('restaurant_id')
 
@@ -759,104 +703,87 @@ def send_point_push_notification(request):
         return Response("Missing information.", status=400)
     
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
-        return response("Customer not found. Please log in as a customer.", status=404)
+        return Response("Customer not found. Please log in as a customer.", status=404)
     
     try:
         restaurant = Restaurant.objects.get(id=restaurant_id)
     except Restaurant.DoesNotExist:
-        return response("Restaurant not found.", status=404)
-
-    # Set up the API request headers
-    headers = {
-        'accept': 'application/json',
-        'accept-encoding': 'gzip, deflate',
-        'content-type': 'application/json',
-        'host': 'exp.host',
-        'accept-language': 'en-US,en;q=0.9',
-        'Authorization': 'Bearer ' + os.environ.get('EXPO_PUSH_TOKEN')
-    }
-
-    restaurant_dict = {
-        'id': restaurant.id,
-        'name': restaurant.name,
-        'address': restaurant.address,
-        'restaurant_image': restaurant.restaurant_image.url if restaurant.restaurant_image else None
-    }
-
-    customer_dict = {
-        'first_name': customer.first_name,
-        'last_name': customer.last_name,
-    }
-
-
-    # Set up the API request body
-    data = {
-        'to': expo_token,
-        'title': 'PunchMe',
-        'body': f'{customer.first_name} {customer.last_name} sent you a gift!',
-        'data': {
-            'screen': 'Rewards',
-            'restaurant': json.dumps(restaurant_dict),
-            'sender': json.dumps(customer_dict)
-        },
-    }
-
-    # Send the push notification API request to Expo
-    response = requests.post('https://exp.host/--/api/v2/push/send', headers=headers, json=data)
-
-    # Check the response status code and handle any errors
-    if response.status_code == 200:
-        return Response('Push notification sent successfully.', status=200)
-    else:
-        return Response('Error sending push notification: ' + response.text, status=500)
+        return Response("Restaurant not found.", status=404)
+
+    # Queue the push notification; it is sent to Expo in the background
+    queue_push(point_gift_message(expo_token, customer, restaurant))
+
+    return Response('Push notification queued.', status=200)
 
 @api_view(['POST'])
 @permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
 def send_friend_request_push_notification(request):
-    # Retrieve the push notification message and Expo push notification token from the request
+    # Retrieve the Expo push notification token from the request
     expo_token = request.data.get('push_token')
 
     if not expo_token:
         return Response("Missing information.", status=400)
     
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
+    except Customer.DoesNotExist:
+        return Response("Customer not found. Please log in as a customer.", status=404)
+
+    # Queue the push notification; it is sent to Expo in the background
+    queue_push(friend_request_message(expo_token, customer))
+
+    return Response('Push notification queued.', status=200)
+
+@api_view(['POST'])
+@permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
+def send_push_notification(request):
+    recipient_id = request.data.get('customer_id')
+    event = request.data.get('event')
+    restaurant_id = request.data.get('restaurant_id')
+
+    if not recipient_id or event not in ('point_gift', 'friend_request'):
+        return Response("Missing information.", status=400)
+
+    if event == 'point_gift' and not restaurant_id:
+        return Response("Missing information.", status=400)
+
+    try:
+        customer = request_customer(request)
     except Customer.DoesNotExist:
-        return response("Customer not found. Please log in as a customer.", status=404)
-
-    # Set up the API request headers
-    headers = {
-        'accept': 'application/json',
-        'accept-encoding': 'gzip, deflate',
-        'content-type': 'application/json',
-        'host': 'exp.host',
-        'accept-language': 'en-US,en;q=0.9',
-        'Authorization': 'Bearer ' + os.environ.get('EXPO_PUSH_TOKEN')
-    }
-
-    customer_dict = {
-        'first_name': customer.first_name,
-        'last_name': customer.last_name,
-    }
-
-    # Set up the API request body
-    data = {
-        'to': expo_token,
-        'title': 'PunchMe',
-        'body': f'{customer.first_name} {customer.last_name} friended you!',
-        'data': {
-            'screen': 'Friends',
-            'sender': json.dumps(customer_dict)
-        },
-    }
-
-    # Send the push notification API request to Expo
-    response = requests.post('https://exp.host/--/api/v2/push/send', headers=headers, json=data)
-
-    # Check the response status code and handle any errors
-    if response.status_code == 200:
-        return Response('Push notification sent successfully.', status=200)
+        return Response("Customer not found. Please log in as a customer.", status=404)
+
+    # Only friends can notify each other, so the endpoint can't be used to message anyone
+    if not Friendship.objects.filter(Q(customer=customer, friend_id=recipient_id) | Q(customer_id=recipient_id, friend=customer)).exists():
+        return Response("You can only notify your friends.", status=403)
+
+    if event == 'point_gift':
+        try:
+            restaurant = Restaurant.objects.get(id=restaurant_id)
+        except Restaurant.DoesNotExist:
+            return Response("Restaurant not found.", status=404)
+        devices = notify_customer(recipient_id, lambda token: point_gift_message(token, customer, restaurant))
     else:
-        return Response('Error sending push notification: ' + response.text, status=500)
+        devices = notify_customer(recipient_id, lambda token: friend_request_message(token, customer))
+
+    return Response({"message": "Push notification queued.", "devices": devices}, status=200)
+
+@api_view(['POST'])
+def twilio_status_callback(request):
+    # Twilio reports delivery progress for messages sent with a status callback
+    if not isinstance(twilio_client, TwilioTestClient) and not RequestValidator(auth_token).validate(
+        request.build_absolute_uri(),
+        request.POST.dict(),
+        request.META.get('HTTP_X_TWILIO_SIGNATURE', ''),
+    ):
+        return Response("Invalid signature.", status=403)
+
+    sid = request.data.get('MessageSid')
+    message_status = request.data.get('MessageStatus')
+
+    if not sid or not message_status:
+        return Response("Missing information.", status=400)
+
+    update_delivery_status(sid, message_status)
+    return Response(status=204)
@@ -0,0 +1,110 @@
+import threading, time
+from math import radians, sin, cos, sqrt, atan2
+
+import numpy as np
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from users.models import Restaurant
+
+# Earth's radius in miles
+EARTH_RADIUS_MILES = 3958.8
+
+def distance_in_miles(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Calculate the distance between two points in miles given their latitude and longitude.
+    """
+    # Convert latitudes and longitudes to radians
+    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
+
+    # Calculate differences in latitude and longitude
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    # Apply Haversine formula
+    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
+    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    distance = EARTH_RADIUS_MILES * c
+
+    return distance
+
+def distances_in_miles(latitude: float, longitude: float, latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """
+    Vectorized haversine distance from one point to arrays of points given in radians.
+    """
+    lat1, lon1 = radians(latitude), radians(longitude)
+
+    a = np.sin((latitudes - lat1) / 2)**2 + cos(lat1) * np.cos(latitudes) * np.sin((longitudes - lon1) / 2)**2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+class RestaurantLocationIndex:
+    """
+    Process-level arrays of restaurant coordinates used for nearby searches.
+
+    The arrays are dropped whenever a restaurant is saved or deleted in this process and
+    are reloaded after RESTAURANT_LOCATION_CACHE_SECONDS so other workers pick up changes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._arrays = None
+        self._loaded_at = 0.0
+
+    def invalidate(self):
+        self._arrays = None
+
+    def _load(self):
+        rows = list(Restaurant.objects.filter(latitude__isnull=False, longitude__isnull=False).values_list('id', 'latitude', 'longitude'))
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        latitudes = np.radians(np.array([float(row[1]) for row in rows], dtype=np.float64))
+        longitudes = np.radians(np.array([float(row[2]) for row in rows], dtype=np.float64))
+        return ids, latitudes, longitudes
+
+    def arrays(self):
+        arrays = self._arrays
+        if arrays is not None and time.monotonic() - self._loaded_at < settings.RESTAURANT_LOCATION_CACHE_SECONDS:
+            return arrays
+
+        with self._lock:
+            if self._arrays is None or time.monotonic() - self._loaded_at >= settings.RESTAURANT_LOCATION_CACHE_SECONDS:
+                self._arrays = self._load()
+                self._loaded_at = time.monotonic()
+            return self._arrays
+
+    def nearest(self, latitude: float, longitude: float, radius: float, limit: int, exclude_ids=()) -> list:
+        """
+        Return up to limit (restaurant id, distance) pairs within radius miles, nearest first.
+        """
+        ids, latitudes, longitudes = self.arrays()
+
+        distances = distances_in_miles(latitude, longitude, latitudes, longitudes)
+        mask = distances <= radius
+        if exclude_ids:
+            mask &= ~np.isin(ids, np.fromiter(exclude_ids, dtype=np.int64))
+
+        candidates = np.flatnonzero(mask)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(distances[candidates], limit - 1)[:limit]]
+        candidates = candidates[np.argsort(distances[candidates], kind='stable')]
+
+        return [(int(ids[i]), float(distances[i])) for i in candidates]
+
+restaurant_locations = RestaurantLocationIndex()
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def restaurant_location_receiver(sender, **kwargs):
+    restaurant_locations.invalidate()
+
+def restaurants_near(latitude: float, longitude: float, radius: float, limit: int, exclude_ids=()) -> list:
+    """
+    Return up to limit (restaurant, distance) pairs within radius miles, nearest first.
+
+    Distances are computed in one vectorized pass over the cached coordinates, so the only
+    database query is the one loading the selected restaurants.
+    """
+    nearest = restaurant_locations.nearest(latitude, longitude, radius, limit, exclude_ids)
+    restaurants = Restaurant.objects.in_bulk([restaurant_id for restaurant_id, _ in nearest])
+
+    return [(restaurants[restaurant_id], distance) for restaurant_id, distance in nearest if restaurant_id in restaurants]
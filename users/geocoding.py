@@ -0,0 +1,166 @@
+import hashlib, logging, re, threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from geopy.exc import GeopyError
+from geopy.geocoders import MapBox
+
+from users.caching import invalidate, restaurant_key
+from users.geo import restaurant_locations
+from users.models import GeocodeCache, Restaurant
+from users.tasks import defer
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+def normalize_address(address):
+    """
+    Cache key for an address: lower case, single spaces, no stray punctuation around commas.
+    """
+    address = re.sub(r'\s+', ' ', address.strip().lower())
+    address = re.sub(r'\s*,\s*', ', ', address)
+    return address.strip(' ,.')
+
+class AddressCache:
+    """
+    Bounded in-process LRU of normalized address -> (latitude, longitude) or None.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return _MISSING
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, location):
+        with self._lock:
+            self._entries[key] = location
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.GEOCODE_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+address_cache = AddressCache()
+
+class MapBoxGeocoder:
+    def __init__(self):
+        self._geolocator = None
+
+    def geocode(self, address):
+        if self._geolocator is None:
+            self._geolocator = MapBox(api_key=settings.MAPBOX_API_KEY, timeout=settings.GEOCODE_TIMEOUT)
+        location = self._geolocator.geocode(address)
+
+        if location is None:
+            return None
+
+        return (location.latitude, location.longitude)
+
+class StubGeocoder:
+    """
+    Offline geocoder that places every address at a fixed point derived from its text.
+    """
+    def geocode(self, address):
+        digest = hashlib.sha256(normalize_address(address).encode()).digest()
+        latitude = int.from_bytes(digest[:4], 'big') / 2 ** 32 * 120 - 60
+        longitude = int.from_bytes(digest[4:8], 'big') / 2 ** 32 * 360 - 180
+        return (round(latitude, 6), round(longitude, 6))
+
+GEOCODERS = {
+    'mapbox': MapBoxGeocoder,
+    'stub': StubGeocoder,
+}
+
+_geocoders = {}
+
+def get_geocoder():
+    name = settings.GEOCODER
+    if name not in _geocoders:
+        _geocoders[name] = GEOCODERS[name]()
+    return _geocoders[name]
+
+def cached_location(address):
+    """
+    The cached location of address, None if it is known not to geocode, or _MISSING.
+    """
+    key = normalize_address(address)
+    location = address_cache.get(key)
+    if location is not _MISSING:
+        return location
+
+    row = GeocodeCache.objects.filter(address=key).values_list('latitude', 'longitude').first()
+    if row is None:
+        return _MISSING
+
+    location = (float(row[0]), float(row[1])) if row[0] is not None else None
+    address_cache.set(key, location)
+    return location
+
+def geocode_address(address):
+    """
+    Return (latitude, longitude) for address, or None if it cannot be geocoded.
+    Results are cached in memory and in the GeocodeCache table.
+    """
+    location = cached_location(address)
+    if location is not _MISSING:
+        return location
+
+    try:
+        location = get_geocoder().geocode(address)
+    except GeopyError:
+        # Not cached, so the address is tried again next time
+        logger.exception("Geocoding %r failed", address)
+        return None
+
+    key = normalize_address(address)
+    latitude, longitude = location if location else (None, None)
+    GeocodeCache.objects.update_or_create(address=key, defaults={'latitude': latitude, 'longitude': longitude})
+    address_cache.set(key, location)
+    return location
+
+def set_restaurant_address(restaurant, address):
+    """
+    Set the address and coordinates of an unsaved restaurant change.
+
+    Returns True when the coordinates are left empty for geocode_restaurant_later, which
+    happens for uncached addresses when GEOCODE_IN_BACKGROUND is set.
+    """
+    restaurant.address = address
+
+    if settings.GEOCODE_IN_BACKGROUND:
+        location = cached_location(address)
+        pending = location is _MISSING
+        if pending:
+            location = None
+    else:
+        location = geocode_address(address)
+        pending = False
+
+    restaurant.latitude, restaurant.longitude = location if location else (None, None)
+    return pending
+
+def geocode_restaurant_later(restaurant):
+    """
+    Fill in the restaurant's coordinates in the background once it has been saved.
+    """
+    defer(f"geocode:{restaurant.id}", geocode_restaurant, restaurant.id, restaurant.address)
+
+def geocode_restaurant(restaurant_id, address):
+    location = geocode_address(address)
+    if location is None:
+        return
+
+    # Skip the update if the address changed again in the meantime
+    latitude, longitude = location
+    if Restaurant.objects.filter(id=restaurant_id, address=address).update(latitude=latitude, longitude=longitude):
+        restaurant_locations.invalidate()
+        invalidate(restaurant_key(restaurant_id))
@@ -1,19 +1,35 @@
-import json, os
+import csv, itertools, json, os
+from datetime import datetime, time, timedelta
 
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from rest_framework.decorators import permission_classes
-from math import radians, sin, cos, sqrt, atan2
+from rest_framework.decorators import permission_classes, authentication_classes
+from django.conf import settings
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
-from users.models import Customer, Manager, CustomerPoints, Item, Restaurant, Friendship, PushToken, Transaction
-from users.views import CustomerPointsSerializer, ItemSerializer, RestaurantSerializer, CustomerSerializer, PushTokenSerializer, TransactionSerializer
+from users.models import Customer, Manager, CustomerPoints, Restaurant, Friendship, PushToken, Transaction, RestaurantStats
+from users.views import CustomerPointsSerializer, RestaurantSerializer, CustomerPublicSerializer, PushTokenSerializer, TransactionSerializer
 from users.permissions import CustomerPermissions, ManagerPermissions, IsAuthenticatedAndActive
+from users.authentication import ClaimsJWTAuthentication, request_customer, request_manager
+from users.caching import restaurant_payload, items_payload, etag_matches, validator_headers, version_etag
+from users.geo import restaurants_near
+from users.ledger import balances_version, current_balances
+from users.pagination import FriendshipPagination, RestaurantPagination, TransactionPagination
+from users.stats import restaurant_stats
+
+TRANSACTION_EXPORT_FIELDS = ['id', 'transaction_date', 'transaction_type', 'transaction_reward', 'num_points', 'customer_id', 'customer_string']
+TRANSACTION_EXPORT_CHUNK_SIZE = 2000
 
 @api_view(['GET'])
 @permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
 def get_customer_points(request, restaurant_id):
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
         return Response("Customer not found. Please log in as a customer.", status=404)
     
@@ -22,126 +38,128 @@ def get_customer_points(request, restaurant_id):
     except Restaurant.DoesNotExist:
         return Response("Restaurant not found.", status=404)
     
-    try:
-        customer_points = CustomerPoints.objects.get(customer=customer, restaurant=restaurant)
-    except CustomerPoints.DoesNotExist:
+    customer_points = current_balances(CustomerPoints.objects.filter(customer=customer, restaurant=restaurant))
+    if not customer_points:
         return Response("Customer does not have points at this restaurant", status=404)
     
-    serializer = CustomerPointsSerializer(customer_points)
+    serializer = CustomerPointsSerializer(customer_points[0])
     return Response(serializer.data, status=200)
 
 @api_view(['GET'])
 @permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
 def get_customer_points_list(request):
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
         return Response("Customer not found. Please log in as a customer.", status=404)
     
-    customer_points_list = CustomerPoints.objects.filter(customer=customer)
+    version = balances_version(customer)
+    etag = version_etag(customer.id, *version.values())
+    headers = validator_headers(etag, max(filter(None, (version['points_updated_at'], version['pending_at'])), default=None))
+    if etag_matches(request, etag):
+        return Response(status=304, headers=headers)
+
+    customer_points_list = current_balances(CustomerPoints.objects.filter(customer=customer))
     
     serializer = CustomerPointsSerializer(customer_points_list, many=True)
-    return Response(serializer.data, status=200)
+    return Response(serializer.data, status=200, headers=headers)
 
 @api_view(['GET'])
 @permission_classes([ManagerPermissions, IsAuthenticatedAndActive])
 def get_customer_points_manager_view(request):
     try:
-        manager = Manager.objects.get(username=request.user.username)
+        manager = request_manager(request)
     except Manager.DoesNotExist:
         return Response("Manager not found. Please log in as a manager.", status=404)
     
-    customer_points_list = CustomerPoints.objects.filter(restaurant=manager.restaurant)
+    customer_points_list = current_balances(CustomerPoints.objects.filter(restaurant=manager.restaurant))
     
     serializer = CustomerPointsSerializer(customer_points_list, many=True)
     return Response(serializer.data, status=200)
 
 @api_view(['GET'])
+@authentication_classes([ClaimsJWTAuthentication])
 @permission_classes([IsAuthenticatedAndActive])
 def get_items_by_restaurant(request, restaurant_id):
-    items_list = Item.objects.filter(restaurant=restaurant_id)
-    
-    serializer = ItemSerializer(items_list, many=True)
-    return Response(serializer.data, status=200)
+    items, etag, last_modified = items_payload(restaurant_id)
+    headers = validator_headers(etag, last_modified)
+    if etag_matches(request, etag):
+        return Response(status=304, headers=headers)
+
+    return Response(items, status=200, headers=headers)
 
 @api_view(['GET'])
+@authentication_classes([ClaimsJWTAuthentication])
 @permission_classes([IsAuthenticatedAndActive])
 def get_restaurant(request, restaurant_id):
-    try:
-        restaurant = Restaurant.objects.get(id=restaurant_id)
-    except Restaurant.DoesNotExist:
+    restaurant, etag, _ = restaurant_payload(restaurant_id)
+    if restaurant is None:
         return Response("Restaurant not found", status=404)
-    
-    serializer = RestaurantSerializer(restaurant)
-    return Response(serializer.data, status=200)
+    if etag_matches(request, etag):
+        return Response(status=304, headers={'ETag': etag})
+
+    return Response(restaurant, status=200, headers={'ETag': etag})
 
 @api_view(['GET'])
 @permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
 def get_all_restaurants(request):
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
         return Response("Customer not found. Please log in as a customer", status=404)
     
-    restaurants = Restaurant.objects.all()
+    joined_restaurants = CustomerPoints.objects.filter(customer=customer).values('restaurant')
+    restaurants = Restaurant.objects.exclude(id__in=Subquery(joined_restaurants)).order_by('id')
 
-    customer_points = CustomerPoints.objects.filter(customer=customer)
-    restaurants = [restaurant for restaurant in restaurants if restaurant not in [point.restaurant for point in customer_points]]
+    paginator = RestaurantPagination()
+    page = paginator.paginate_queryset(restaurants, request)
+    if page is not None:
+        serializer = RestaurantSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
             
     serializer = RestaurantSerializer(restaurants, many=True)
     return Response(serializer.data, status=200)
 
-def distance_in_miles(lat1: int, lon1: int, lat2: int, lon2: int) -> float:
-    """
-    Calculate the distance between two points in miles given their latitude and longitude.
-    """
-    # Earth's radius in miles
-    R = 3958.8
-
-    # Convert latitudes and longitudes to radians
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-
-    # Calculate differences in latitude and longitude
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-
-    # Apply Haversine formula
-    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    distance = R * c
-
-    return distance
-
-
 @api_view(['POST'])
 @permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
 def get_restaurants_by_location(request):
     latitude = request.data.get('latitude')
     longitude = request.data.get('longitude')
+    radius = request.data.get('radius', settings.NEARBY_RESTAURANTS_RADIUS_MILES)
+    limit = request.data.get('limit', settings.NEARBY_RESTAURANTS_LIMIT)
 
-    if not latitude or not longitude:
+    if latitude is None or longitude is None:
         return Response('Missing information', status=400)
+
+    try:
+        latitude, longitude, radius = float(latitude), float(longitude), float(radius)
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return Response('Invalid search parameters', status=400)
+
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        return Response('Invalid location', status=400)
+
+    if radius <= 0 or radius > settings.NEARBY_RESTAURANTS_MAX_RADIUS_MILES:
+        return Response(f'Radius must be between 0 and {settings.NEARBY_RESTAURANTS_MAX_RADIUS_MILES} miles', status=400)
+
+    if limit <= 0 or limit > settings.NEARBY_RESTAURANTS_MAX_LIMIT:
+        return Response(f'Limit must be between 1 and {settings.NEARBY_RESTAURANTS_MAX_LIMIT}', status=400)
     
     try:
-        customer = Customer.objects.get(username=request.user.username)
+        customer = request_customer(request)
     except Customer.DoesNotExist:
         return Response("Customer not found. Please log in as a customer", status=404)
 
-    restaurants = []
-    for restaurant in Restaurant.objects.all():
-        restaurant_latitude = restaurant.latitude
-        restaurant_longitude = restaurant.longitude
-        if restaurant_latitude is None or restaurant_longitude is None:
-            continue
-        distance = distance_in_miles(latitude, longitude, restaurant_latitude, restaurant_longitude)
-        if distance <= 5:
-            restaurants.append(restaurant)
-
-    customer_points = CustomerPoints.objects.filter(customer=customer)
-    restaurants = [restaurant for restaurant in restaurants if restaurant not in [point.restaurant for point in customer_points]]
-            
-    serializer = RestaurantSerializer(restaurants, many=True)
-    return Response(serializer.data, status=200)
+    joined_restaurant_ids = set(CustomerPoints.objects.filter(customer=customer).values_list('restaurant_id', flat=True))
+    nearby = restaurants_near(latitude, longitude, radius, limit, exclude_ids=joined_restaurant_ids)
+
+    serializer = RestaurantSerializer([restaurant for restaurant, _ in nearby], many=True)
+    data = serializer.data
+    for restaurant_data, (_, distance) in zip(data, nearby):
+        restaurant_data['distance'] = round(distance, 2)
+
+    return Response(data, status=200)
 
 @api_view(['GET'])
 @permission_classes([ManagerPermissions, IsAuthenticatedAndActive])
@@ -152,7 +170,7 @@ def get_customer_manager_view(request, customer_id):
         return Response("Customer not found", status=404)
     
     try:
-        manager = Manager.objects.get(username=request.user.username)
+        manager = request_manager(request)
     except Manager.DoesNotExist:
         return Response("Manager not found. Please log in as a manager", status=404)
     
@@ -161,10 +179,8 @@ def get_customer_manager_view(request, customer_id):
     except CustomerPoints.DoesNotExist:
         return Response("Customer does not have data with your restaurant", status=404)
     
-    serializer = CustomerSerializer(customer)
-    data = serializer.data.copy()
-    data.pop('token', None)
-    return Response(data, status=200)
+    serializer = CustomerPublicSerializer(customer)
+    return Response(serializer.data, status=200)
 
 @api_view(['GET'])
 @permission_classes([ManagerPermissions, IsAuthenticatedAndActive])
@@ -175,36 +191,172 @@ def get_transactions_by_customer(request, customer_id):
         return Response("Customer not found", status=404)
     
     try:
-        manager = Manager.objects.get(username=request.user.username)
+        manager = request_manager(request)
     except Manager.DoesNotExist:
         return Response("Manager not found. Please log in as a manager", status=404)
     
-    transactions = Transaction.objects.filter(restaurant=manager.restaurant)
-    customer_transactions = []
+    # The whole list stays oldest first as it always was; pages come newest first
+    transactions = Transaction.objects.filter(restaurant=manager.restaurant, customer=customer).order_by('transaction_date', 'id')
 
-    for transaction in transactions:
-        transaction_customer_id = json.loads(transaction.customer_string)['id']
-        if transaction_customer_id == customer_id:
-            customer_transactions.append(transaction)
+    paginator = TransactionPagination()
+    page = paginator.paginate_queryset(transactions, request)
+    if page is not None:
+        serializer = TransactionSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
-    serializer = TransactionSerializer(customer_transactions, many=True)
+    serializer = TransactionSerializer(transactions, many=True)
     return Response(serializer.data, status=200)
 
+@api_view(['GET'])
+@permission_classes([ManagerPermissions, IsAuthenticatedAndActive])
+def get_restaurant_stats(request):
+    try:
+        manager = request_manager(request)
+    except Manager.DoesNotExist:
+        return Response("Manager not found. Please log in as a manager", status=404)
+
+    period = request.query_params.get('period', 'day').upper()
+    if period not in RestaurantStats.Period.values:
+        return Response("Period must be day or hour.", status=400)
+
+    try:
+        since = parse_export_bound(request.query_params.get('since'))
+        until = parse_export_bound(request.query_params.get('until')) or timezone.now()
+    except ValueError:
+        return Response("Invalid date. Use YYYY-MM-DD or an ISO 8601 datetime.", status=400)
+
+    if period == RestaurantStats.Period.HOUR:
+        since = since or until - timedelta(days=1)
+        if until - since > timedelta(hours=settings.RESTAURANT_STATS_MAX_HOURS):
+            return Response(f"Hourly stats cover at most {settings.RESTAURANT_STATS_MAX_HOURS} hours.", status=400)
+    else:
+        since = since or until - timedelta(days=30)
+
+    stats = restaurant_stats(manager.restaurant, period, since, until)
+    return Response({'period': period.lower(), 'since': since, 'until': until, 'stats': stats}, status=200)
+
+class Echo:
+    """
+    File-like object whose write returns the value, so csv.writer rows can be streamed.
+    """
+    def write(self, value):
+        return value
+
+def parse_export_bound(value):
+    if value is None:
+        return None
+    bound = parse_datetime(value)
+    if bound is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        bound = datetime.combine(day, time.min)
+    if timezone.is_naive(bound):
+        bound = timezone.make_aware(bound)
+    return bound
+
+@api_view(['GET'])
+@permission_classes([ManagerPermissions, IsAuthenticatedAndActive])
+def export_transactions(request, file_format):
+    if file_format not in ('csv', 'ndjson'):
+        return Response("Format must be csv or ndjson.", status=400)
+
+    try:
+        manager = request_manager(request)
+    except Manager.DoesNotExist:
+        return Response("Manager not found. Please log in as a manager", status=404)
+
+    try:
+        since = parse_export_bound(request.query_params.get('since'))
+        until = parse_export_bound(request.query_params.get('until'))
+    except ValueError:
+        return Response("Invalid date. Use YYYY-MM-DD or an ISO 8601 datetime.", status=400)
+
+    customer_id = request.query_params.get('customer_id')
+    if customer_id is not None and not customer_id.isdigit():
+        return Response("Invalid customer id.", status=400)
+
+    transactions = Transaction.objects.filter(restaurant=manager.restaurant)
+    if customer_id:
+        transactions = transactions.filter(customer_id=customer_id)
+    if since:
+        transactions = transactions.filter(transaction_date__gte=since)
+    if until:
+        transactions = transactions.filter(transaction_date__lt=until)
+
+    rows = transactions.order_by('transaction_date', 'id').values(*TRANSACTION_EXPORT_FIELDS).iterator(chunk_size=TRANSACTION_EXPORT_CHUNK_SIZE)
+
+    if file_format == 'csv':
+        writer = csv.writer(Echo())
+        lines = itertools.chain(
+            [writer.writerow(TRANSACTION_EXPORT_FIELDS)],
+            (writer.writerow([row[field] for field in TRANSACTION_EXPORT_FIELDS]) for row in rows),
+        )
+        content_type = 'text/csv'
+    else:
+        lines = (json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows)
+        content_type = 'application/x-ndjson'
+
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="transactions.{file_format}"'
+    return response
+
 @api_view(['GET'])
 @permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
 def get_friends(request):
+    friendships = (
+        Friendship.objects
+        .filter(customer_id=request.user.id)
+        .select_related('friend')
+        .only('id', 'last_interaction_at', *('friend__' + field for field in CustomerPublicSerializer.Meta.fields))
+        .order_by(*FriendshipPagination.ordering)
+    )
 
-    friendships = Friendship.objects.filter(customer=request.user)
+    # ?mutual_restaurants=true adds how many of the caller's restaurants each friend also has points at
+    include_mutual = request.query_params.get('mutual_restaurants') == 'true'
 
-    friends = [friendship.friend for friendship in friendships]
-    
-    serializer = CustomerSerializer(friends, many=True)
-    data = serializer.data.copy()
-    
-    for friend in data:
-        friend.pop('token', None)
-    
-    return Response(data, status=200)
+    # Mutual counts change with other customers' points, which the version does not cover
+    headers = {}
+    if not include_mutual:
+        # Each friendship's timestamps rather than their maximum: a change that commits after
+        # another can carry an older timestamp and leave the maximum where it was
+        version = list(
+            Friendship.objects
+            .filter(customer_id=request.user.id)
+            .order_by('id')
+            .values_list('id', 'last_interaction_at', 'friend__updated_at')
+        )
+        # The cursor and page size pick the page
+        etag = version_etag(request.user.id, request.GET.urlencode(), version)
+        headers = validator_headers(etag, max(filter(None, (moment for _, *moments in version for moment in moments)), default=None))
+        if etag_matches(request, etag):
+            return Response(status=304, headers=headers)
+
+    if include_mutual:
+        mutual = (
+            CustomerPoints.objects
+            .filter(customer=OuterRef('friend'), restaurant__in=CustomerPoints.objects.filter(customer_id=request.user.id).values('restaurant'))
+            .values('customer')
+            .annotate(count=Count('id'))
+            .values('count')
+        )
+        friendships = friendships.annotate(mutual_restaurants=Coalesce(Subquery(mutual), 0))
+
+    paginator = FriendshipPagination()
+    page = paginator.paginate_queryset(friendships, request)
+    rows = page if page is not None else list(friendships)
+
+    data = CustomerPublicSerializer([friendship.friend for friendship in rows], many=True).data
+    if include_mutual:
+        for friend, friendship in zip(data, rows):
+            friend['mutual_restaurants'] = friendship.mutual_restaurants
+
+    if page is not None:
+        response = paginator.get_paginated_response(data)
+        for header, value in headers.items():
+            response[header] = value
+        return response
+    return Response(data, status=200, headers=headers)
 
 @api_view(['GET'])
 @permission_classes([CustomerPermissions, IsAuthenticatedAndActive])
@@ -0,0 +1,312 @@
+import heapq, json
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from users.models import Customer, Restaurant, CustomerPoints, PointDelta, Friendship, Transaction
+from users.models import LedgerEntry, LedgerSnapshot
+from users.stats import roll_up_transactions
+from users.tasks import defer
+
+def record_transaction(restaurant, customer, transaction_type, num_points, transaction_reward=None):
+    customer_dict = {
+        "first_name": customer.first_name,
+        "last_name": customer.last_name,
+        "id": customer.id,
+    }
+
+    recorded = Transaction.objects.create(
+        restaurant=restaurant,
+        customer=customer,
+        customer_string=json.dumps(customer_dict),
+        transaction_type=transaction_type,
+        transaction_reward=transaction_reward,
+        num_points=num_points,
+    )
+
+    # Rolled up into RestaurantStats once it is old enough that earlier ids have committed
+    defer("stats:rollup", roll_up_transactions, delay=settings.RESTAURANT_STATS_LAG_SECONDS)
+    return recorded
+
+def append_entry(customer, restaurant, delta, kind, transaction=None):
+    return LedgerEntry.objects.create(customer=customer, restaurant=restaurant, delta=delta, kind=kind, transaction=transaction)
+
+def credit_points(customer, restaurant, num_points, **fields):
+    """
+    Add num_points to a customer's balance at a restaurant with a single UPDATE,
+    creating the CustomerPoints row on the first credit. Queryset updates skip auto_now,
+    so every update here sets updated_at itself.
+    """
+    now = timezone.now()
+    points = CustomerPoints.objects.filter(customer=customer, restaurant=restaurant)
+
+    if points.update(num_points=F('num_points') + num_points, timestamp=now, updated_at=now, **fields):
+        return
+
+    try:
+        with transaction.atomic():
+            CustomerPoints.objects.create(customer=customer, restaurant=restaurant, num_points=num_points, timestamp=now, **fields)
+    except IntegrityError:
+        # A concurrent request created the row first
+        points.update(num_points=F('num_points') + num_points, timestamp=now, updated_at=now, **fields)
+
+def award_point(customer, restaurant):
+    if settings.POINTS_BUFFERED_SCANS:
+        buffer_point(customer, restaurant)
+    else:
+        credit_point(customer, restaurant)
+
+def credit_point(customer, restaurant):
+    with transaction.atomic():
+        credit_points(customer, restaurant, 1, give_point_eligible=True)
+        append_entry(customer, restaurant, 1, LedgerEntry.Kind.POINT, record_transaction(restaurant, customer, "point", 1))
+
+def buffer_point(customer, restaurant):
+    """
+    Award a scan's point without updating any rows: the point is appended as a PointDelta
+    and folded into CustomerPoints later by compact_point_deltas.
+    """
+    with transaction.atomic():
+        # Reads add pending deltas to the balance row, so make sure there is one
+        CustomerPoints.objects.bulk_create([CustomerPoints(customer=customer, restaurant=restaurant)], ignore_conflicts=True)
+        PointDelta.objects.create(customer=customer, restaurant=restaurant, delta=1, give_point_eligible=True)
+        # The ledger is append-only too, so it records the point right away
+        append_entry(customer, restaurant, 1, LedgerEntry.Kind.POINT, record_transaction(restaurant, customer, "point", 1))
+
+    defer("points:compact", compact_point_deltas, delay=settings.POINTS_COMPACT_DELAY_SECONDS)
+
+def compact_point_deltas(limit=None, **filters):
+    """
+    Fold buffered PointDeltas into CustomerPoints with one UPDATE per customer and restaurant.
+    Returns the number of deltas folded in.
+    """
+    limit = limit or settings.POINTS_COMPACT_BATCH_SIZE
+    # Joins the caller's transaction when there is one, so gifts and redemptions can compact first cheaply
+    with transaction.atomic(savepoint=False):
+        deltas = PointDelta.objects.filter(**filters).order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            # Concurrent compactors take disjoint batches
+            deltas = deltas.select_for_update(skip_locked=True)
+        deltas = list(deltas.values_list('id', 'customer_id', 'restaurant_id', 'delta', 'give_point_eligible')[:limit])
+
+        totals = {}
+        for _, customer_id, restaurant_id, delta, give_point_eligible in deltas:
+            total, eligible = totals.get((customer_id, restaurant_id), (0, False))
+            totals[(customer_id, restaurant_id)] = (total + delta, eligible or give_point_eligible)
+
+        for (customer_id, restaurant_id), (total, eligible) in totals.items():
+            fields = {'give_point_eligible': True} if eligible else {}
+            credit_points(Customer(pk=customer_id), Restaurant(pk=restaurant_id), total, **fields)
+
+        PointDelta.objects.filter(id__in=[delta[0] for delta in deltas]).delete()
+
+    if len(deltas) == limit and not filters:
+        defer("points:compact", compact_point_deltas)
+    return len(deltas)
+
+def with_pending_points(queryset):
+    """
+    Annotate CustomerPoints with the deltas that have not been compacted yet.
+    """
+    deltas = PointDelta.objects.filter(customer=OuterRef('customer'), restaurant=OuterRef('restaurant'))
+    return queryset.annotate(
+        pending_points=Coalesce(Subquery(deltas.values('customer').annotate(total=Sum('delta')).values('total')), 0),
+        pending_eligible=Exists(deltas.filter(give_point_eligible=True)),
+    )
+
+def current_balances(queryset):
+    """
+    Evaluate CustomerPoints with num_points and give_point_eligible including pending deltas.
+    """
+    points_list = list(with_pending_points(queryset))
+    for points in points_list:
+        points.num_points += points.pending_points
+        points.give_point_eligible = points.give_point_eligible or points.pending_eligible
+    return points_list
+
+def balances_version(customer):
+    """
+    A version of the customer's balances that changes whenever current_balances would:
+    the row count, the newest update, and the pending deltas on top. One query, with
+    each subquery answered from the customer's index.
+
+    The newest update alone can miss a change: a transaction that commits after another
+    can carry an older updated_at. The point totals, eligible rows and ledger and delta
+    counts move with every change however the commits interleave.
+    """
+    points = CustomerPoints.objects.filter(customer=OuterRef('pk')).order_by().values('customer')
+    deltas = PointDelta.objects.filter(customer=OuterRef('pk')).order_by().values('customer')
+    entries = LedgerEntry.objects.filter(customer=OuterRef('pk')).order_by().values('customer')
+    return Customer.objects.filter(pk=customer.pk).values(
+        count=Subquery(points.annotate(count=Count('id')).values('count')),
+        points=Subquery(points.annotate(total=Sum('num_points')).values('total')),
+        eligible=Subquery(points.annotate(eligible=Count('id', filter=Q(give_point_eligible=True))).values('eligible')),
+        points_updated_at=Subquery(points.annotate(latest=Max('updated_at')).values('latest')),
+        entries=Subquery(entries.annotate(count=Count('id')).values('count')),
+        pending_points=Subquery(deltas.annotate(total=Sum('delta')).values('total')),
+        pending_deltas=Subquery(deltas.annotate(count=Count('id')).values('count')),
+        pending_at=Subquery(deltas.annotate(latest=Max('created_at')).values('latest')),
+    ).get()
+
+def gift_point(customer, friend, restaurant):
+    """
+    Move the customer's give-point eligibility into a point for friend.
+    Returns False when the customer is not eligible.
+    """
+    with transaction.atomic():
+        compact_point_deltas(customer=customer, restaurant=restaurant)
+
+        claimed = CustomerPoints.objects.filter(
+            customer=customer,
+            restaurant=restaurant,
+            give_point_eligible=True,
+        ).update(give_point_eligible=False, updated_at=timezone.now())
+
+        if not claimed:
+            return False
+
+        credit_points(friend, restaurant, 1)
+        gift = record_transaction(restaurant, friend, "gift", 1, transaction_reward=customer.first_name)
+        append_entry(friend, restaurant, 1, LedgerEntry.Kind.GIFT, gift)
+
+        # Moves the pair to the top of both friend lists
+        Friendship.objects.filter(
+            Q(customer=customer, friend=friend) | Q(customer=friend, friend=customer)
+        ).update(last_interaction_at=timezone.now())
+
+    return True
+
+def use_referral(referral, customer):
+    with transaction.atomic():
+        credit_points(customer, referral.restaurant, 1)
+        gift = record_transaction(referral.restaurant, customer, "gift", 1, transaction_reward=referral.customer.first_name)
+        append_entry(customer, referral.restaurant, 1, LedgerEntry.Kind.REFERRAL, gift)
+        referral.delete()
+
+def grant_bonus(customer, restaurant, num_points):
+    """
+    Open a new customer's balance at a restaurant with num_points.
+    """
+    with transaction.atomic():
+        CustomerPoints.objects.create(customer=customer, restaurant=restaurant, num_points=num_points)
+        append_entry(customer, restaurant, num_points, LedgerEntry.Kind.BONUS)
+
+def redeem_item(item_redemption):
+    """
+    Spend the points for a redemption and delete it.
+    Returns the remaining balance, or None when the customer does not have enough points.
+    """
+    item = item_redemption.item
+    customer = item_redemption.customer
+
+    with transaction.atomic():
+        compact_point_deltas(customer=customer, restaurant=item.restaurant)
+
+        points = CustomerPoints.objects.filter(customer=customer, restaurant=item.restaurant)
+
+        if not points.filter(num_points__gte=item.num_points).update(num_points=F('num_points') - item.num_points, updated_at=timezone.now()):
+            return None
+
+        item_redemption.delete()
+        reward = record_transaction(item.restaurant, customer, "reward", item.num_points, transaction_reward=item.name)
+        append_entry(customer, item.restaurant, -item.num_points, LedgerEntry.Kind.REWARD, reward)
+
+        return points.values_list('num_points', flat=True).get()
+
+def latest_snapshot_entry_id():
+    return LedgerSnapshot.objects.aggregate(entry_id=Max('entry_id'))['entry_id'] or 0
+
+def ledger_balance(customer, restaurant):
+    """
+    Replay a balance from the latest snapshot plus the ledger entries after it.
+    """
+    entry_id = latest_snapshot_entry_id()
+    snapshot = LedgerSnapshot.objects.filter(entry_id=entry_id, customer=customer, restaurant=restaurant).values_list('balance', flat=True).first()
+    tail = LedgerEntry.objects.filter(customer=customer, restaurant=restaurant, id__gt=entry_id).aggregate(total=Sum('delta'))['total']
+    return (snapshot or 0) + (tail or 0)
+
+def replayed_balances(since_entry_id=0, until_entry_id=None, chunk_size=2000):
+    """
+    Stream ((customer id, restaurant id), balance) in pair order, replayed from the snapshot
+    taken at since_entry_id plus the entries after it (up to until_entry_id).
+    """
+    snapshots = LedgerSnapshot.objects.filter(entry_id=since_entry_id).order_by('customer', 'restaurant')
+    entries = LedgerEntry.objects.filter(id__gt=since_entry_id)
+    if until_entry_id is not None:
+        entries = entries.filter(id__lte=until_entry_id)
+    tails = entries.values('customer', 'restaurant').annotate(total=Sum('delta')).order_by('customer', 'restaurant')
+
+    merged = heapq.merge(
+        (
+            ((customer_id, restaurant_id), balance)
+            for customer_id, restaurant_id, balance in snapshots.values_list('customer_id', 'restaurant_id', 'balance').iterator(chunk_size)
+        ),
+        (((row['customer'], row['restaurant']), row['total']) for row in tails.iterator(chunk_size)),
+    )
+    for pair, balances in groupby(merged, key=lambda balance: balance[0]):
+        yield pair, sum(balance for _, balance in balances)
+
+def stored_balances(chunk_size=2000):
+    """
+    Stream ((customer id, restaurant id), balance) from CustomerPoints and pending deltas in pair order.
+    """
+    points = with_pending_points(CustomerPoints.objects.order_by('customer', 'restaurant'))
+    for customer_id, restaurant_id, num_points, pending_points in points.values_list('customer_id', 'restaurant_id', 'num_points', 'pending_points').iterator(chunk_size):
+        yield (customer_id, restaurant_id), num_points + pending_points
+
+def reconcile(replayed, stored):
+    """
+    Merge two pair-ordered balance streams and yield (pair, replayed, stored) where they differ.
+    A pair missing from one side counts as a balance of 0 there.
+    """
+    replayed, stored = iter(replayed), iter(stored)
+    done = ((float('inf'),), None)
+    left, right = next(replayed, done), next(stored, done)
+    while left is not done or right is not done:
+        if left[0] == right[0]:
+            if left[1] != right[1]:
+                yield left[0], left[1], right[1]
+            left, right = next(replayed, done), next(stored, done)
+        elif left[0] < right[0]:
+            if left[1]:
+                yield left[0], left[1], 0
+            left = next(replayed, done)
+        else:
+            if right[1]:
+                yield right[0], 0, right[1]
+            right = next(stored, done)
+
+def snapshot_watermark():
+    """
+    The newest entry a snapshot may include. Entries younger than LEDGER_SNAPSHOT_LAG_SECONDS
+    are left to the tail, since an earlier id can still be committing.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.LEDGER_SNAPSHOT_LAG_SECONDS)
+    return LedgerEntry.objects.filter(created_at__lte=cutoff).aggregate(entry_id=Max('id'))['entry_id'] or 0
+
+def take_snapshot(chunk_size=2000):
+    """
+    Snapshot every balance up to the watermark and drop older snapshots.
+    Returns the snapshot's entry id.
+    """
+    since_entry_id = latest_snapshot_entry_id()
+    entry_id = snapshot_watermark()
+    if entry_id <= since_entry_id:
+        return since_entry_id
+
+    with transaction.atomic():
+        batch = []
+        for (customer_id, restaurant_id), balance in replayed_balances(since_entry_id, entry_id, chunk_size):
+            batch.append(LedgerSnapshot(customer_id=customer_id, restaurant_id=restaurant_id, balance=balance, entry_id=entry_id))
+            if len(batch) >= chunk_size:
+                LedgerSnapshot.objects.bulk_create(batch)
+                batch = []
+        LedgerSnapshot.objects.bulk_create(batch)
+        LedgerSnapshot.objects.filter(entry_id__lt=entry_id).delete()
+
+    return entry_id
@@ -7,17 +7,18 @@ from rest_framework.generics import CreateAPIView, UpdateAPIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework import viewsets
 from rest_framework.serializers import EmailField, CharField, ModelSerializer, BooleanField, SerializerMethodField
-from users.models import Customer, Manager, PhoneAuthentication, EmailAuthentication, Restaurant, RestaurantQR, CustomerPoints
-from users.views import CustomerSerializer, ManagerSerializer
+from users.models import Customer, Manager, PhoneAuthentication, EmailAuthentication, Restaurant, RestaurantQR
+from users.views import CustomerAuthSerializer, ManagerAuthSerializer
 
+from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.db import IntegrityError, transaction
 from django.core.exceptions import ObjectDoesNotExist
-from django.core.mail import send_mail
 from django.shortcuts import get_object_or_404
 
-from twilio_config import twilio_client, twilio_phone_number
-from twilio.base.exceptions import TwilioException
+from users.mail import queue_email
+from users.sms import queue_sms
+from users import ledger
 
 class SendPhoneCodeSerializer(ModelSerializer):
     is_register = BooleanField()
@@ -61,15 +62,10 @@ class SendPhoneCode(CreateAPIView):
                 phone_number=phone_number,
             )
         
-        try:
-            twilio_client.messages.create(
-                body=f"Your code for Punchme is {phone_auth.code}",
-                from_=twilio_phone_number,
-                to=str(phone_number),
-            )
-        except TwilioException as e:
-            return Response({'error': 'Failed to send message'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
+        queue_sms(
+            to=phone_number,
+            body=f"Your code for Punchme is {phone_auth.code}",
+        )
 
         return Response(
             code_request.data,
@@ -134,14 +130,11 @@ class RegisterVerifyPhoneCode(UpdateAPIView):
 
         # give customer points to User
         customer =  Customer.objects.get(username=phone_number)
-        restaurant = Restaurant.objects.get(id=115)
-        CustomerPoints.objects.create(
-            customer=customer,
-            restaurant=restaurant,
-            num_points=3,
-        )
+        restaurant = Restaurant.objects.filter(id=settings.SIGNUP_BONUS_RESTAURANT_ID).first()
+        if restaurant is not None:
+            ledger.grant_bonus(customer, restaurant, settings.SIGNUP_BONUS_POINTS)
 
-        user_serializer = CustomerSerializer(user)
+        user_serializer = CustomerAuthSerializer(user)
 
         return Response(
             {
@@ -196,7 +189,7 @@ class LoginVerifyPhoneCode(UpdateAPIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
-        customer_serializer = CustomerSerializer(customer)
+        customer_serializer = CustomerAuthSerializer(customer)
         return Response(
             {
                 'message': 'Login successful.',
@@ -256,16 +249,12 @@ class SendEmailCode(CreateAPIView):
                     email=email,
                 )
         
-        try:
-            send_mail(
-                subject="Here's your code",
-                message=f"Your code for Punchme is {email_auth.code}",
-                from_email=os.environ.get('EMAIL_HOST_USER'),
-                recipient_list=[email_auth.email]
-            )
-        except Exception as e:
-            # Log the error or handle it as appropriate for your application
-            print(f"An error occurred while sending email: {e}")
+        queue_email(
+            subject="Here's your code",
+            message=f"Your code for Punchme is {email_auth.code}",
+            from_email=os.environ.get('EMAIL_HOST_USER'),
+            recipient_list=[email_auth.email]
+        )
 
         return Response(
             code_request.data,
@@ -339,7 +328,7 @@ class RegisterVerifyEmailCode(UpdateAPIView):
                 },
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        user_serializer = ManagerSerializer(user)
+        user_serializer = ManagerAuthSerializer(user)
 
         return Response(
             {
@@ -380,7 +369,7 @@ class LoginVerifyEmailCode(UpdateAPIView):
             if code == employee_code and employee_code != '0':
                 email_auths.update(is_verified=True)
                 EmailAuthentication.objects.filter(email=email).delete()
-                manager_serializer = ManagerSerializer(manager)
+                manager_serializer = ManagerAuthSerializer(manager)
                 employee = manager_serializer.data
                 employee.pop('employee_code', None)
                 return Response(
@@ -410,7 +399,7 @@ class LoginVerifyEmailCode(UpdateAPIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR,
             )
 
-        manager_serializer = ManagerSerializer(manager)
+        manager_serializer = ManagerAuthSerializer(manager)
         return Response(
             {
                 'message': 'Login successful.',
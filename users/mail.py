@@ -0,0 +1,64 @@
+import logging
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from users.models import OutboundEmail
+from users.outbox import due_messages, claim, mark_sent, mark_failed, schedule_retries
+from users.tasks import defer
+
+logger = logging.getLogger(__name__)
+
+def queue_email(subject, message, recipient_list, from_email=None):
+    """
+    Store an email and send it from the background worker once the request commits.
+    """
+    email = OutboundEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or settings.EMAIL_HOST_USER or '',
+        recipients=list(recipient_list),
+    )
+    defer("email:send", send_pending_emails)
+    return email
+
+def send_pending_emails(limit=100):
+    """
+    Send due emails over a single SMTP connection. Returns the number of emails sent.
+    """
+    emails = [email for email in due_messages(OutboundEmail, limit) if claim(email)]
+    if not emails:
+        schedule_retries(OutboundEmail, "email:send", send_pending_emails)
+        return 0
+
+    sent = 0
+    handled = 0
+    connection = get_connection()
+    try:
+        connection.open()
+        for email in emails:
+            message = EmailMessage(
+                subject=email.subject,
+                body=email.body,
+                from_email=email.from_email or None,
+                to=email.recipients,
+                connection=connection,
+            )
+            try:
+                connection.send_messages([message])
+            except Exception as e:
+                mark_failed(email, e)
+            else:
+                mark_sent(email)
+                sent += 1
+            handled += 1
+    except Exception as e:
+        # The connection could not be opened or broke down; retry the emails not handled yet
+        logger.exception("Email connection failed")
+        for email in emails[handled:]:
+            mark_failed(email, e)
+    finally:
+        connection.close()
+
+    schedule_retries(OutboundEmail, "email:send", send_pending_emails)
+    return sent
@@ -0,0 +1,98 @@
+import random, statistics, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from users.function_views import has_accounts
+from users.models import User, Customer, Friendship
+from users.seeding import batches, seed_phone_number, seed_customers
+
+class QueryTimer:
+    """
+    Database execute wrapper that adds up the time spent in queries.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+
+class Command(BaseCommand):
+    help = "Measure has_accounts with a large address book against many customers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--contacts', type=int, default=10000, help="Contacts in the uploaded address book")
+        parser.add_argument('--customers', type=int, default=20000, help="Customers to seed for the contacts to match")
+        parser.add_argument('--friends', type=int, default=200, help="Matched contacts that are already friends")
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--offset', type=int, default=7000000, help="First index for the benchmark's seeded phone numbers")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark's customers afterwards")
+
+    def handle(self, *args, **options):
+        offset = options['offset']
+        if User.objects.filter(username=seed_phone_number(offset)).exists():
+            raise CommandError(f"Seed data at offset {offset} is already loaded; pass another --offset")
+
+        rng = random.Random(0)
+        # The first customer uploads the address book
+        customer_ids = seed_customers(rng, options['customers'] + 1, offset)
+
+        try:
+            customer = Customer.objects.get(id=customer_ids[0])
+            contacts = self.address_book(rng, options['contacts'], options['customers'], offset + 1)
+            Friendship.objects.bulk_create([
+                Friendship(customer=customer, friend_id=friend_id)
+                for friend_id in rng.sample(customer_ids[1:], min(options['friends'], options['customers']))
+            ])
+
+            request_factory = APIRequestFactory()
+            totals, db_times = [], []
+            for _ in range(options['runs']):
+                request = request_factory.post('/has-accounts/', {'contacts': contacts}, format='json')
+                force_authenticate(request, user=customer)
+
+                timer = QueryTimer()
+                started = time.perf_counter()
+                with connection.execute_wrapper(timer):
+                    response = has_accounts(request)
+                totals.append(time.perf_counter() - started)
+                db_times.append(timer.seconds)
+
+            if response.status_code != 200:
+                raise CommandError(f"has_accounts returned {response.status_code}: {response.data}")
+            self.stdout.write(
+                f"{len(contacts)} contacts, {len(response.data['account_list'])} with accounts, "
+                f"{len(response.data['no_account_list'])} without: {timer.queries} queries, "
+                f"median DB time {statistics.median(db_times) * 1000:.1f}ms, "
+                f"median total {statistics.median(totals) * 1000:.1f}ms"
+            )
+        finally:
+            if not options['keep']:
+                for batch in batches(customer_ids, 500):
+                    User.objects.filter(id__in=batch).delete()
+
+    def address_book(self, rng, count, customers, first_index):
+        """
+        Contacts like a phone sends them: numbers in mixed formats, some contacts with several,
+        about half of them belonging to seeded customers.
+        """
+        contacts = []
+        for i in range(count):
+            numbers = []
+            for _ in range(rng.choice([1, 1, 1, 2, 3])):
+                if rng.random() < 0.5:
+                    digits = seed_phone_number(first_index + rng.randrange(customers))[2:]
+                else:
+                    # 556 numbers are never seeded
+                    digits = f'556{rng.randrange(10 ** 7):07d}'
+                formatted = rng.choice([f'({digits[:3]}) {digits[3:6]}-{digits[6:]}', f'+1{digits}', f'1-{digits[:3]}-{digits[3:6]}-{digits[6:]}'])
+                numbers.append({'number': formatted})
+            contacts.append({'name': f'Contact {i}', 'phoneNumbers': numbers})
+        return contacts
@@ -0,0 +1,61 @@
+import random, time
+
+import numpy as np
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.geo import restaurant_locations, restaurants_near
+from users.models import User, Restaurant
+from users.seeding import METRO_AREAS, batches, seed_manager_email, seed_restaurants
+
+class Command(BaseCommand):
+    help = "Measure p50/p99 nearby-search latency as the number of restaurants grows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help="Restaurant counts to measure at, smallest first")
+        parser.add_argument('--searches', type=int, default=1000, help="Searches per size")
+        parser.add_argument('--radius', type=float, default=5)
+        parser.add_argument('--limit', type=int, default=50)
+        parser.add_argument('--offset', type=int, default=8000000, help="First index for the benchmark's seeded manager emails")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark's restaurants afterwards")
+
+    def handle(self, *args, **options):
+        offset = options['offset']
+        if User.objects.filter(username=seed_manager_email(offset)).exists():
+            raise CommandError(f"Seed data at offset {offset} is already loaded; pass another --offset")
+
+        rng = random.Random(0)
+        restaurant_ids = []
+        try:
+            for size in sorted(options['sizes']):
+                # Top up to size restaurants, counting the ones already in the database
+                missing = size - Restaurant.objects.count()
+                if missing > 0:
+                    restaurant_ids += seed_restaurants(rng, missing, offset + len(restaurant_ids), items_per_restaurant=0)
+                self.measure(rng, Restaurant.objects.count(), options)
+        finally:
+            if not options['keep']:
+                for batch in batches(restaurant_ids, 500):
+                    User.objects.filter(id__in=Restaurant.objects.filter(id__in=batch).values('manager_id')).delete()
+
+    def measure(self, rng, count, options):
+        restaurant_locations.invalidate()
+        started = time.perf_counter()
+        restaurant_locations.arrays()
+        load_ms = (time.perf_counter() - started) * 1000
+
+        latencies = []
+        found = 0
+        for _ in range(options['searches']):
+            latitude, longitude, spread = rng.choice(METRO_AREAS)
+            latitude, longitude = rng.gauss(latitude, spread), rng.gauss(longitude, spread)
+
+            started = time.perf_counter()
+            found += len(restaurants_near(latitude, longitude, options['radius'], options['limit']))
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        p50, p99 = np.percentile(latencies, [50, 99])
+        self.stdout.write(
+            f"{count} restaurants: p50 {p50:.2f}ms, p99 {p99:.2f}ms, "
+            f"{found / len(latencies):.1f} results per search, coordinates loaded in {load_ms:.0f}ms"
+        )
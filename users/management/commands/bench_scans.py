@@ -0,0 +1,70 @@
+import random, threading, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection
+
+from users import ledger
+from users.models import User, Customer, Restaurant, PointDelta
+from users.seeding import seed_manager_email, seed_phone_number, seed_restaurants, seed_customers
+
+class Command(BaseCommand):
+    help = "Measure scans per second at one restaurant for direct and buffered point awards"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scans', type=int, default=2000, help="Scans per mode")
+        parser.add_argument('--customers', type=int, default=500, help="Customers scanning at the restaurant")
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--offset', type=int, default=9000000, help="First index for the benchmark's seeded emails and phone numbers")
+        parser.add_argument('--keep', action='store_true', help="Keep the benchmark's restaurant and customers afterwards")
+
+    def handle(self, *args, **options):
+        offset = options['offset']
+        if User.objects.filter(username__in=[seed_manager_email(offset), seed_phone_number(offset)]).exists():
+            raise CommandError(f"Seed data at offset {offset} is already loaded; pass another --offset")
+
+        rng = random.Random(0)
+        restaurant_ids = seed_restaurants(rng, 1, offset)
+        customer_ids = seed_customers(rng, options['customers'], offset)
+        user_ids = list(Restaurant.objects.filter(id__in=restaurant_ids).values_list('manager_id', flat=True)) + customer_ids
+
+        try:
+            restaurant = Restaurant.objects.get(id=restaurant_ids[0])
+            customers = list(Customer.objects.filter(id__in=customer_ids))
+            scans = [rng.choice(customers) for _ in range(options['scans'])]
+
+            self.run('direct', ledger.credit_point, restaurant, scans, options['threads'])
+            self.run('buffered', ledger.buffer_point, restaurant, scans, options['threads'])
+
+            started = time.monotonic()
+            compacted = 0
+            while PointDelta.objects.filter(restaurant=restaurant).exists():
+                compacted += ledger.compact_point_deltas(restaurant=restaurant)
+            self.stdout.write(f"compaction: {compacted} deltas in {time.monotonic() - started:.2f}s")
+        finally:
+            if not options['keep']:
+                User.objects.filter(id__in=user_ids).delete()
+
+    def run(self, mode, award, restaurant, scans, threads):
+        chunks = [scans[start::threads] for start in range(threads)]
+        failures = []
+
+        def worker(chunk):
+            try:
+                for customer in chunk:
+                    try:
+                        award(customer, restaurant)
+                    except DatabaseError:
+                        failures.append(customer.id)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+        started = time.monotonic()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        awarded = len(scans) - len(failures)
+        self.stdout.write(f"{mode}: {awarded} scans in {elapsed:.2f}s, {awarded / elapsed:.0f} scans/s, {len(failures)} failed")
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.stats import rebuild_restaurant_stats, roll_up_transactions
+
+class Command(BaseCommand):
+    help = "Recompute the hourly and daily restaurant stats from all transactions"
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        last_id = rebuild_restaurant_stats()
+        self.stdout.write(f"Rolled up transactions up to {last_id} in {time.monotonic() - started:.1f}s")
+
+        # Catch up with transactions written during the rebuild
+        while True:
+            rolled_up = roll_up_transactions()
+            if not rolled_up:
+                break
+            self.stdout.write(f"Rolled up {rolled_up} more transactions")
@@ -0,0 +1,48 @@
+import logging, time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from users.ledger import compact_point_deltas
+from users.mail import send_pending_emails
+from users.push import send_pending_pushes, check_push_receipts
+from users.sms import send_pending_sms
+from users.stats import roll_up_transactions
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = "Deliver queued outbound messages, compact buffered points and roll up restaurant stats until stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain what is due and exit")
+
+    steps = [
+        (send_pending_sms, "Sent {} text messages"),
+        (send_pending_emails, "Sent {} emails"),
+        (send_pending_pushes, "Sent {} push notifications"),
+        (check_push_receipts, "Checked {} push receipts"),
+        (compact_point_deltas, "Compacted {} point deltas"),
+        (roll_up_transactions, "Rolled up {} transactions"),
+    ]
+
+    def handle(self, *args, **options):
+        while True:
+            self.run_once()
+            close_old_connections()
+            if options['once']:
+                break
+            time.sleep(settings.WORKER_POLL_SECONDS)
+
+    def run_once(self):
+        for step, report in self.steps:
+            try:
+                done = step()
+            except Exception:
+                # A failing step (e.g. the database restarting) must not stop the worker or the other steps
+                logger.exception("Worker step %s failed", step.__name__)
+                close_old_connections()
+                continue
+            if done:
+                self.stdout.write(report.format(done))
@@ -0,0 +1,54 @@
+import random, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from users.models import User
+from users.seeding import seed_manager_email, seed_phone_number, seed_restaurants, seed_customers
+from users.seeding import seed_friendships, seed_points, seed_transactions
+
+class Command(BaseCommand):
+    help = "Bulk-load synthetic restaurants, customers, friendships, points and transactions for benchmarking"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--managers', type=int, default=1000, help="Managers to create, each with one restaurant")
+        parser.add_argument('--customers', type=int, default=100000)
+        parser.add_argument('--transactions', type=int, default=1000000)
+        parser.add_argument('--years', type=float, default=3, help="How far back the transaction history goes")
+        parser.add_argument('--max-friends', type=int, default=300)
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed loads the same data")
+        parser.add_argument('--offset', type=int, default=0, help="First index for seeded emails and phone numbers, to load more data next to an earlier run")
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        offset = options['offset']
+        if User.objects.filter(username__in=[seed_manager_email(offset), seed_phone_number(offset)]).exists():
+            raise CommandError(f"Seed data at offset {offset} is already loaded; pass a larger --offset")
+
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+
+        with transaction.atomic():
+            started = time.monotonic()
+            restaurant_ids = seed_restaurants(rng, options['managers'], offset, batch_size)
+            self.report(f"{len(restaurant_ids)} restaurants", started)
+
+            started = time.monotonic()
+            customer_ids = seed_customers(rng, options['customers'], offset, batch_size)
+            self.report(f"{len(customer_ids)} customers", started)
+
+            started = time.monotonic()
+            friendships = seed_friendships(rng, customer_ids, options['max_friends'], batch_size)
+            self.report(f"{friendships} friendships", started)
+
+            started = time.monotonic()
+            pairs = seed_points(rng, customer_ids, restaurant_ids, batch_size=batch_size)
+            self.report(f"{len(pairs)} customer points", started)
+
+            if pairs:
+                started = time.monotonic()
+                seed_transactions(rng, pairs, options['transactions'], options['years'], batch_size)
+                self.report(f"{options['transactions']} transactions", started)
+
+    def report(self, created, started):
+        self.stdout.write(f"Created {created} in {time.monotonic() - started:.1f}s")
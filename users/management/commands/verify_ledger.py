@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
+
+from users import ledger
+from users.models import CustomerPoints, LedgerEntry
+
+class Command(BaseCommand):
+    help = "Replay the points ledger and reconcile it with CustomerPoints; run periodically with --snapshot"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Replay every entry instead of starting from the latest snapshot")
+        parser.add_argument('--snapshot', action='store_true', help="Snapshot the balances afterwards so later runs only replay the tail")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        since_entry_id = 0 if options['full'] else ledger.latest_snapshot_entry_id()
+
+        started = time.monotonic()
+        mismatches = []
+        replayed = ledger.replayed_balances(since_entry_id, chunk_size=chunk_size)
+        for pair, expected, stored in ledger.reconcile(self.count(replayed), ledger.stored_balances(chunk_size)):
+            # Writes made while streaming can show up on one side only, so look again
+            expected, stored = self.replay(pair, options['full']), self.stored(pair)
+            if expected != stored:
+                mismatches.append(pair)
+                self.stdout.write(f"Customer {pair[0]} at restaurant {pair[1]}: ledger {expected}, CustomerPoints {stored}")
+        self.stdout.write(f"Replayed {self.pairs} balances from entry {since_entry_id} in {time.monotonic() - started:.1f}s")
+
+        if options['snapshot']:
+            started = time.monotonic()
+            entry_id = ledger.take_snapshot(chunk_size)
+            self.stdout.write(f"Snapshot at entry {entry_id} in {time.monotonic() - started:.1f}s")
+
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} balances do not match the ledger")
+
+    def count(self, balances):
+        self.pairs = 0
+        for balance in balances:
+            self.pairs += 1
+            yield balance
+
+    def replay(self, pair, full):
+        customer_id, restaurant_id = pair
+        if full:
+            return LedgerEntry.objects.filter(customer_id=customer_id, restaurant_id=restaurant_id).aggregate(total=Sum('delta'))['total'] or 0
+        return ledger.ledger_balance(customer_id, restaurant_id)
+
+    def stored(self, pair):
+        customer_id, restaurant_id = pair
+        points = ledger.current_balances(CustomerPoints.objects.filter(customer_id=customer_id, restaurant_id=restaurant_id))
+        return points[0].num_points if points else 0
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0027_restaurant_latitude_restaurant_longitude'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='restaurant',
+            index=models.Index(fields=['latitude', 'longitude'], name='users_resta_latitud_dd8f40_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.1.13 on 2026-10-18 07:58
+
+import json
+
+from django.db import migrations
+
+BATCH_SIZE = 2000
+
+
+def backfill_transaction_customer(apps, schema_editor):
+    Transaction = apps.get_model('users', 'Transaction')
+    Customer = apps.get_model('users', 'Customer')
+
+    def flush(batch):
+        existing_ids = set(Customer.objects.filter(pk__in=[customer_id for _, customer_id in batch]).values_list('pk', flat=True))
+        updates = []
+        for transaction, customer_id in batch:
+            if customer_id in existing_ids:
+                transaction.customer_id = customer_id
+                updates.append(transaction)
+        Transaction.objects.bulk_update(updates, ['customer'])
+
+    batch = []
+    transactions = Transaction.objects.filter(customer__isnull=True).only('id', 'customer_string')
+    for transaction in transactions.iterator(chunk_size=BATCH_SIZE):
+        try:
+            customer_id = json.loads(transaction.customer_string)['id']
+        except (ValueError, KeyError, TypeError):
+            continue
+        batch.append((transaction, customer_id))
+        if len(batch) >= BATCH_SIZE:
+            flush(batch)
+            batch = []
+
+    if batch:
+        flush(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0029_transaction_customer'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_transaction_customer, migrations.RunPython.noop),
+    ]
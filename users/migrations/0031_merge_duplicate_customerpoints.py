@@ -0,0 +1,34 @@
+# Generated by Django 4.1.13 on 2026-10-18 08:00
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def merge_duplicate_customerpoints(apps, schema_editor):
+    CustomerPoints = apps.get_model('users', 'CustomerPoints')
+
+    duplicates = (
+        CustomerPoints.objects.values('customer', 'restaurant')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+
+    for duplicate in duplicates:
+        rows = list(CustomerPoints.objects.filter(customer=duplicate['customer'], restaurant=duplicate['restaurant']).order_by('id'))
+        kept = rows[0]
+        kept.num_points = sum(row.num_points for row in rows)
+        kept.timestamp = max(row.timestamp for row in rows)
+        kept.give_point_eligible = any(row.give_point_eligible for row in rows)
+        kept.save()
+        CustomerPoints.objects.filter(pk__in=[row.pk for row in rows[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0030_backfill_transaction_customer'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_customerpoints, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 08:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0031_merge_duplicate_customerpoints'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='customerpoints',
+            unique_together={('customer', 'restaurant')},
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.13 on 2026-10-18 08:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0032_customerpoints_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='phone_e164',
+            field=models.CharField(blank=True, db_index=True, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='phone_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
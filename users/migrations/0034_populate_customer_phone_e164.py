@@ -0,0 +1,34 @@
+# Generated by Django 4.1.13 on 2026-10-18 08:01
+
+from django.db import migrations
+
+from users.phone import normalize_phone_number, hash_phone_number
+
+BATCH_SIZE = 2000
+
+
+def populate_customer_phone_e164(apps, schema_editor):
+    Customer = apps.get_model('users', 'Customer')
+
+    batch = []
+    for customer in Customer.objects.only('pk', 'phone_number').iterator(chunk_size=BATCH_SIZE):
+        customer.phone_e164 = normalize_phone_number(customer.phone_number) or ''
+        customer.phone_hash = hash_phone_number(customer.phone_e164) if customer.phone_e164 else ''
+        batch.append(customer)
+        if len(batch) >= BATCH_SIZE:
+            Customer.objects.bulk_update(batch, ['phone_e164', 'phone_hash'])
+            batch = []
+
+    if batch:
+        Customer.objects.bulk_update(batch, ['phone_e164', 'phone_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0033_customer_phone_e164'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_customer_phone_e164, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.1.13 on 2026-10-18 08:04
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0034_populate_customer_phone_e164'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundSMS',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('SENDING', 'Sending'), ('SENT', 'Sent'), ('FAILED', 'Failed')], default='PENDING', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('to', models.CharField(max_length=17)),
+                ('from_number', models.CharField(max_length=17)),
+                ('body', models.TextField()),
+                ('sid', models.CharField(blank=True, db_index=True, max_length=64)),
+                ('delivery_status', models.CharField(blank=True, max_length=20)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outboundsms',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='users_outbo_status_adfbf5_idx'),
+        ),
+    ]
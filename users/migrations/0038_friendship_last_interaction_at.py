@@ -0,0 +1,30 @@
+# Generated by Django 4.1.13 on 2026-10-18 08:11
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def backfill_last_interaction_at(apps, schema_editor):
+    Friendship = apps.get_model('users', 'Friendship')
+    Friendship.objects.update(last_interaction_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0037_geocodecache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='friendship',
+            name='last_interaction_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_last_interaction_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['customer', '-last_interaction_at', '-id'], name='users_frien_custome_f9b5f1_idx'),
+        ),
+    ]
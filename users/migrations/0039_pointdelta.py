@@ -0,0 +1,30 @@
+# Generated by Django 4.1.13 on 2026-10-18 08:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0038_friendship_last_interaction_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PointDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('give_point_eligible', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='users.customer')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='users.restaurant')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pointdelta',
+            index=models.Index(fields=['customer', 'restaurant'], name='users_point_custome_db82b9_idx'),
+        ),
+    ]
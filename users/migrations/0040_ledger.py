@@ -0,0 +1,70 @@
+# Generated by Django 4.1.13 on 2026-10-18 08:28
+
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_opening_balances(apps, schema_editor):
+    CustomerPoints = apps.get_model('users', 'CustomerPoints')
+    PointDelta = apps.get_model('users', 'PointDelta')
+    LedgerEntry = apps.get_model('users', 'LedgerEntry')
+
+    pending = {
+        (row['customer'], row['restaurant']): row['total']
+        for row in PointDelta.objects.values('customer', 'restaurant').annotate(total=Sum('delta')).order_by()
+    }
+    batch = []
+    for customer_id, restaurant_id, num_points in CustomerPoints.objects.values_list('customer_id', 'restaurant_id', 'num_points').iterator(2000):
+        batch.append(LedgerEntry(
+            customer_id=customer_id,
+            restaurant_id=restaurant_id,
+            delta=num_points + pending.get((customer_id, restaurant_id), 0),
+            kind='OPENING',
+        ))
+        if len(batch) >= 2000:
+            LedgerEntry.objects.bulk_create(batch)
+            batch = []
+    LedgerEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0039_pointdelta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('kind', models.CharField(choices=[('OPENING', 'Opening balance'), ('POINT', 'Point'), ('GIFT', 'Gift'), ('REFERRAL', 'Referral'), ('REWARD', 'Reward'), ('BONUS', 'Registration bonus')], max_length=10)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='users.customer')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='users.restaurant')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='users.transaction')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LedgerSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.IntegerField()),
+                ('entry_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='users.customer')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='users.restaurant')),
+            ],
+            options={
+                'unique_together': {('entry_id', 'customer', 'restaurant')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['customer', 'restaurant', 'id'], name='users_ledge_custome_b46207_idx'),
+        ),
+        migrations.RunPython(backfill_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.1.13 on 2026-10-18 08:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0040_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestaurantCustomerDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RestaurantStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('HOUR', 'Hour'), ('DAY', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('transaction_type', models.CharField(max_length=6)),
+                ('transactions', models.PositiveIntegerField(default=0)),
+                ('points', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['restaurant', 'id'], name='users_trans_restaur_d7429e_idx'),
+        ),
+        migrations.AddField(
+            model_name='restaurantstats',
+            name='restaurant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='users.restaurant'),
+        ),
+        migrations.AddField(
+            model_name='restaurantcustomerday',
+            name='customer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='users.customer'),
+        ),
+        migrations.AddField(
+            model_name='restaurantcustomerday',
+            name='restaurant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='users.restaurant'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='restaurantstats',
+            unique_together={('restaurant', 'period', 'start', 'transaction_type')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='restaurantcustomerday',
+            unique_together={('restaurant', 'day', 'customer')},
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 08:51
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0042_updated_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='restaurant',
+            name='users_resta_latitud_dd8f40_idx',
+        ),
+    ]
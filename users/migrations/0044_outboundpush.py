@@ -0,0 +1,40 @@
+# Generated by Django 4.1.13 on 2026-10-18 09:01
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0043_remove_restaurant_location_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboundPush',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('SENDING', 'Sending'), ('SENT', 'Sent'), ('FAILED', 'Failed')], default='PENDING', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('token', models.CharField(max_length=255)),
+                ('message', models.JSONField()),
+                ('ticket_id', models.CharField(blank=True, max_length=64)),
+                ('receipt_status', models.CharField(blank=True, max_length=20)),
+                ('receipt_checks', models.PositiveIntegerField(default=0)),
+                ('receipt_check_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outboundpush',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='users_outbo_status_c18296_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='outboundpush',
+            index=models.Index(fields=['receipt_check_at'], name='users_outbo_receipt_f7e474_idx'),
+        ),
+    ]
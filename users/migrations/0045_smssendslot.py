@@ -0,0 +1,21 @@
+# Generated by Django 4.1.13 on 2026-10-18 09:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0044_outboundpush'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SMSSendSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_number', models.CharField(max_length=17, unique=True)),
+                ('next_send_at', models.DateTimeField()),
+            ],
+        ),
+    ]
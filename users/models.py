@@ -11,6 +11,8 @@ from django.core.files.storage import default_storage
 
 from uuid import uuid4
 
+from users.phone import normalize_phone_number, hash_phone_number
+
 restaurant_signal = django.dispatch.Signal()
 
 def random_code():
@@ -40,7 +42,10 @@ class Customer(User):
         message=_("Phone number must be entered in the format: '+999999999'. Up to 15 digits allowed.")
     )
     phone_number = models.CharField(validators=[phone_regex], max_length=17, unique=True)
+    phone_e164 = models.CharField(max_length=16, blank=True, db_index=True) # normalized phone number for contact matching
+    phone_hash = models.CharField(max_length=64, blank=True, db_index=True) # sha256 of phone_e164 for hashed contact uploads
     profile_picture = models.FileField(upload_to='profiles/', blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True) # versions friend lists for conditional GETs
 
     def save(self, *args, **kwargs):
         # check if the customer object already exists in the database
@@ -55,6 +60,8 @@ class Customer(User):
             if existing_obj.profile_picture and existing_obj.profile_picture != self.profile_picture:
                 default_storage.delete(existing_obj.profile_picture.name)
         self.username = self.phone_number
+        self.phone_e164 = normalize_phone_number(self.phone_number) or ''
+        self.phone_hash = hash_phone_number(self.phone_e164) if self.phone_e164 else ''
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
@@ -67,9 +74,13 @@ class Friendship(models.Model):
     customer = models.ForeignKey(Customer, related_name='friendship_creator_set', on_delete=models.CASCADE)
     friend = models.ForeignKey(Customer, related_name='friend_set', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    last_interaction_at = models.DateTimeField(default=timezone.now) # last point gifted either way, for sorting friend lists
 
     class Meta:
         unique_together = ('customer', 'friend')
+        indexes = [
+            models.Index(fields=['customer', '-last_interaction_at', '-id']),
+        ]
 
 class PushToken(models.Model):
     customer = models.ForeignKey(Customer, related_name='push_notifications', on_delete=models.CASCADE)
@@ -115,6 +126,7 @@ class Item(models.Model):
     name = models.CharField(max_length=255, blank=True)
     num_points = models.IntegerField(null=True)
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
     
 class CustomerPoints(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
@@ -122,10 +134,31 @@ class CustomerPoints(models.Model):
     num_points = models.IntegerField(default=0)
     timestamp = models.DateTimeField(default=timezone.now)
     give_point_eligible = models.BooleanField(default=False)  # to track if a customer has earned a point for friends feature
+    updated_at = models.DateTimeField(auto_now=True) # also set by every queryset update in users.ledger
+
+    class Meta:
+        unique_together = ('customer', 'restaurant')
 
     def __str__(self):
         return f"{self.customer.username} at {self.restaurant.name} ({self.num_points} points)"
     
+class PointDelta(models.Model):
+    """
+    A buffered change to a CustomerPoints balance, folded in by ledger.compact_point_deltas.
+
+    Rows are only ever inserted and deleted, so busy restaurants don't contend on row locks.
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE)
+    delta = models.IntegerField()
+    give_point_eligible = models.BooleanField(default=False) # scans make the customer eligible to give a point
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'restaurant']),
+        ]
+
 class ItemRedemption(models.Model):
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
@@ -146,11 +179,88 @@ class RestaurantQR(models.Model):
 
 class Transaction(models.Model):
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE)
+    customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
     customer_string = models.TextField()
     transaction_date = models.DateTimeField(default=timezone.now)
     transaction_type = models.CharField(max_length=6) # point or reward
     transaction_reward = models.CharField(max_length=255, null=True, blank=True) # item in transaction if reward
     num_points = models.IntegerField() # number of points involved in the transaction
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['restaurant', 'customer', 'transaction_date']),
+            models.Index(fields=['restaurant', 'id']), # transactions not rolled up into RestaurantStats yet
+        ]
+
+class RestaurantStats(models.Model):
+    """
+    Transactions of one type at a restaurant rolled up per hour or day by users.stats.
+    """
+    class Period(models.TextChoices):
+        HOUR = "HOUR", 'Hour'
+        DAY = "DAY", 'Day'
+
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE)
+    period = models.CharField(max_length=4, choices=Period.choices)
+    start = models.DateTimeField()
+    transaction_type = models.CharField(max_length=6)
+    transactions = models.PositiveIntegerField(default=0)
+    points = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('restaurant', 'period', 'start', 'transaction_type')
+
+class RestaurantCustomerDay(models.Model):
+    """
+    A day on which a customer had a transaction at a restaurant, for counting active customers.
+    """
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE)
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    day = models.DateField()
+
+    class Meta:
+        unique_together = ('restaurant', 'day', 'customer')
+
+class RollupWatermark(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0) # the newest row already rolled up
+
+class LedgerEntry(models.Model):
+    """
+    An append-only change to a customer's points at a restaurant; CustomerPoints is the running total.
+    """
+    class Kind(models.TextChoices):
+        OPENING = "OPENING", 'Opening balance'
+        POINT = "POINT", 'Point'
+        GIFT = "GIFT", 'Gift'
+        REFERRAL = "REFERRAL", 'Referral'
+        REWARD = "REWARD", 'Reward'
+        BONUS = "BONUS", 'Registration bonus'
+
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE)
+    delta = models.IntegerField()
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    transaction = models.ForeignKey(Transaction, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'restaurant', 'id']),
+        ]
+
+class LedgerSnapshot(models.Model):
+    """
+    A balance replayed from every LedgerEntry up to entry_id, so later balances only add the tail.
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE)
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE)
+    balance = models.IntegerField()
+    entry_id = models.BigIntegerField() # all snapshots taken together share the same entry_id
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('entry_id', 'customer', 'restaurant')
     
 class EmailAuthentication(models.Model):
     email = models.EmailField()
@@ -166,4 +276,74 @@ class PhoneAuthentication(models.Model):
     phone_number = models.CharField(validators=[phone_regex], max_length=17)
     code = models.CharField(max_length=6, default=random_code)
     is_verified = models.BooleanField(default=False)
-    proxy_uuid = models.UUIDField(default=uuid4)
\ No newline at end of file
+    proxy_uuid = models.UUIDField(default=uuid4)
+
+class GeocodeCache(models.Model):
+    address = models.CharField(max_length=255, unique=True) # normalized, see users.geocoding
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True) # null when the address has no match
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+class OutboxMessage(models.Model):
+    """
+    A message delivered by the background worker instead of inside a request.
+    """
+    class Status(models.TextChoices):
+        PENDING = "PENDING", 'Pending'
+        SENDING = "SENDING", 'Sending'
+        SENT = "SENT", 'Sent'
+        FAILED = "FAILED", 'Failed'
+
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+class OutboundSMS(OutboxMessage):
+    to = models.CharField(max_length=17)
+    from_number = models.CharField(max_length=17)
+    body = models.TextField()
+    sid = models.CharField(max_length=64, blank=True, db_index=True) # Twilio message SID once accepted
+    delivery_status = models.CharField(max_length=20, blank=True) # latest status reported by Twilio
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+class SMSSendSlot(models.Model):
+    """
+    When each sending number may send its next text message, shared by every process.
+    """
+    from_number = models.CharField(max_length=17, unique=True)
+    next_send_at = models.DateTimeField()
+
+class OutboundEmail(OutboxMessage):
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    recipients = models.JSONField(default=list)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+class OutboundPush(OutboxMessage):
+    token = models.CharField(max_length=255)
+    message = models.JSONField() # in Expo's push message format
+    ticket_id = models.CharField(max_length=64, blank=True) # Expo push ticket once accepted
+    receipt_status = models.CharField(max_length=20, blank=True) # 'ok' or 'error' from the push receipt
+    receipt_checks = models.PositiveIntegerField(default=0)
+    receipt_check_at = models.DateTimeField(null=True, blank=True) # when to ask for the receipt; None once settled
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+            models.Index(fields=['receipt_check_at']),
+        ]
@@ -0,0 +1,67 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from users.models import OutboxMessage
+from users.tasks import task_queue
+
+logger = logging.getLogger(__name__)
+
+def due_messages(model, limit):
+    """
+    Pending messages whose next attempt is due, plus SENDING rows whose send timed out.
+    """
+    return list(model.objects.filter(
+        Q(status=OutboxMessage.Status.PENDING) | Q(status=OutboxMessage.Status.SENDING),
+        next_attempt_at__lte=timezone.now(),
+    ).order_by('next_attempt_at', 'id')[:limit])
+
+def claim(message):
+    """
+    Mark a message as being sent. Returns False if another worker claimed it first.
+    """
+    return bool(type(message).objects.filter(pk=message.pk, status=message.status, attempts=message.attempts).update(
+        status=OutboxMessage.Status.SENDING,
+        attempts=F('attempts') + 1,
+        next_attempt_at=timezone.now() + timedelta(seconds=settings.OUTBOX_SENDING_TIMEOUT_SECONDS),
+    ))
+
+def mark_sent(message, **fields):
+    type(message).objects.filter(pk=message.pk).update(
+        status=OutboxMessage.Status.SENT,
+        sent_at=timezone.now(),
+        last_error='',
+        **fields,
+    )
+
+def mark_failed(message, error, retry=True):
+    """
+    Schedule a retry with exponential backoff, or give up after OUTBOX_MAX_ATTEMPTS
+    (or right away for errors that retrying cannot fix).
+    """
+    attempts = message.attempts + 1
+    if not retry or attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        status = OutboxMessage.Status.FAILED
+        logger.error("Giving up on %s %s: %s", type(message).__name__, message.pk, error)
+    else:
+        status = OutboxMessage.Status.PENDING
+
+    type(message).objects.filter(pk=message.pk).update(
+        status=status,
+        last_error=str(error),
+        next_attempt_at=timezone.now() + timedelta(seconds=settings.OUTBOX_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)),
+    )
+
+def schedule_retries(model, key, func):
+    """
+    Run func again in this process when the next retry of model is due.
+    """
+    if settings.TASKS_ALWAYS_EAGER:
+        return
+
+    retry_at = model.objects.filter(status=OutboxMessage.Status.PENDING).order_by('next_attempt_at').values_list('next_attempt_at', flat=True).first()
+    if retry_at is not None:
+        task_queue.enqueue(key, func, delay=max((retry_at - timezone.now()).total_seconds(), 0))
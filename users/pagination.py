@@ -0,0 +1,97 @@
+import base64, json, operator
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks past the last row of the previous page using the ordering fields.
+
+    The ordering must be unique (end it with 'id'). Pagination is opt-in: requests without a
+    cursor or page_size parameter get the whole list, so existing clients keep working.
+    """
+    ordering = ('id',)
+    page_size = 50
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.position_filter(self.decode_cursor(cursor, queryset.model)))
+
+        page = list(queryset[:self.page_size + 1])
+        self.next_position = self.get_position(page[self.page_size - 1]) if len(page) > self.page_size else None
+        return page[:self.page_size]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_position(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def position_filter(self, position):
+        """
+        Rows strictly after position: (a > x) OR (a = x AND b > y) OR ...
+        """
+        conditions = []
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = '__lt' if field.startswith('-') else '__gt'
+            equal = {ordering.lstrip('-'): value for ordering, value in zip(self.ordering[:i], position[:i])}
+            conditions.append(Q(**equal, **{name + lookup: position[i]}))
+        return reduce(operator.or_, conditions)
+
+    def encode_cursor(self, position):
+        # str() keeps full microsecond precision, which DjangoJSONEncoder truncates
+        data = json.dumps(position, default=str)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, cursor, model):
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(position) != len(self.ordering):
+                raise ValueError
+            return [model._meta.get_field(field.lstrip('-')).to_python(value) for field, value in zip(self.ordering, position)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+class RestaurantPagination(KeysetPagination):
+    ordering = ('id',)
+
+class TransactionPagination(KeysetPagination):
+    ordering = ('-transaction_date', '-id')
+
+class FriendshipPagination(KeysetPagination):
+    ordering = ('-last_interaction_at', '-id')
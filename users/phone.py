@@ -0,0 +1,37 @@
+import hashlib, re
+
+DEFAULT_COUNTRY_CODE = '1'
+
+def normalize_phone_number(phone_number: str, country_code: str = DEFAULT_COUNTRY_CODE):
+    """
+    Return the E.164 form of a phone number (e.g. '+13105551234'), or None if it cannot be one.
+    Numbers without a country code are assumed to be North American.
+    """
+    if not phone_number:
+        return None
+
+    phone_number = phone_number.strip()
+    digits = re.sub(r'\D', '', phone_number)
+
+    if phone_number.startswith('+'):
+        pass
+    elif digits.startswith('011'):
+        digits = digits[3:]
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif len(digits) == 10:
+        digits = country_code + digits
+    elif not (len(digits) == 11 and digits.startswith(country_code)):
+        return None
+
+    # E.164 numbers have at most 15 digits and never start with 0
+    if not 8 <= len(digits) <= 15 or digits.startswith('0'):
+        return None
+
+    return '+' + digits
+
+def hash_phone_number(e164: str) -> str:
+    """
+    SHA-256 hex digest of an E.164 number; clients hash contacts the same way before uploading.
+    """
+    return hashlib.sha256(e164.encode()).hexdigest()
@@ -0,0 +1,224 @@
+import json, logging, threading
+from datetime import timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from users.models import PushToken, OutboundPush
+from users.outbox import due_messages, claim, mark_sent, mark_failed, schedule_retries
+from users.tasks import defer, task_queue
+
+logger = logging.getLogger(__name__)
+
+# Expo accepts at most 100 messages per send request and 1000 ids per receipts request
+EXPO_SEND_BATCH_SIZE = 100
+EXPO_RECEIPTS_BATCH_SIZE = 1000
+
+class ExpoRetryableError(Exception):
+    pass
+
+_session = None
+_session_lock = threading.Lock()
+
+def expo_session():
+    """
+    One keep-alive session to Expo per process.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            session.headers.update({
+                'accept': 'application/json',
+                'accept-encoding': 'gzip, deflate',
+                'content-type': 'application/json',
+            })
+            if settings.EXPO_PUSH_TOKEN:
+                session.headers['Authorization'] = 'Bearer ' + settings.EXPO_PUSH_TOKEN
+            _session = session
+        return _session
+
+def post(url, payload):
+    """
+    Post to Expo once. Rate limiting and server errors raise ExpoRetryableError;
+    retries are scheduled by the outbox instead of waiting here.
+    """
+    response = expo_session().post(url, json=payload, timeout=settings.PUSH_REQUEST_TIMEOUT)
+    if response.status_code == 429 or response.status_code >= 500:
+        raise ExpoRetryableError(f"Expo responded {response.status_code}")
+    response.raise_for_status()
+    return response.json()['data']
+
+def queue_push(message):
+    """
+    Store an Expo push message and send it from the background worker once the request commits.
+    """
+    push = OutboundPush.objects.create(token=message['to'], message=message)
+    # Wait briefly so messages queued close together go out in one request
+    defer("push:send", send_pending_pushes, delay=settings.PUSH_BATCH_WINDOW_SECONDS)
+    return push
+
+def send_pending_pushes(limit=EXPO_SEND_BATCH_SIZE):
+    """
+    Send due push messages in batches of up to limit. Returns the number of messages Expo accepted.
+    """
+    sent = 0
+    while True:
+        batch = [push for push in due_messages(OutboundPush, limit) if claim(push)]
+        if not batch:
+            break
+        sent += send_batch(batch)
+
+    schedule_retries(OutboundPush, "push:send", send_pending_pushes)
+    schedule_receipts()
+    return sent
+
+def send_batch(batch):
+    try:
+        tickets = post(settings.EXPO_PUSH_URL, [push.message for push in batch])
+        if len(tickets) != len(batch):
+            raise ValueError(f"Expo returned {len(tickets)} tickets for {len(batch)} messages")
+    except (requests.RequestException, ExpoRetryableError, KeyError, TypeError, ValueError) as e:
+        logger.warning("Failed to send %d push notifications: %s", len(batch), e)
+        for push in batch:
+            mark_failed(push, e)
+        return 0
+
+    sent = 0
+    check_at = timezone.now() + timedelta(seconds=settings.PUSH_RECEIPT_DELAY_SECONDS)
+    for push, ticket in zip(batch, tickets):
+        if ticket.get('status') == 'ok':
+            mark_sent(push, ticket_id=ticket['id'], receipt_check_at=check_at)
+            sent += 1
+        else:
+            error, retryable = push_error(push, ticket)
+            mark_failed(push, error, retry=retryable)
+    return sent
+
+def check_push_receipts(limit=EXPO_RECEIPTS_BATCH_SIZE):
+    """
+    Ask Expo for the receipts of sent messages that are due. Returns the number of receipts settled.
+    """
+    pushes = list(
+        OutboundPush.objects
+        .filter(status=OutboundPush.Status.SENT, receipt_check_at__lte=timezone.now())
+        .order_by('receipt_check_at')[:limit]
+    )
+    if not pushes:
+        schedule_receipts()
+        return 0
+
+    check_again_at = timezone.now() + timedelta(seconds=settings.PUSH_RECEIPT_DELAY_SECONDS)
+    try:
+        receipts = post(settings.EXPO_RECEIPTS_URL, {'ids': [push.ticket_id for push in pushes]})
+    except (requests.RequestException, ExpoRetryableError, KeyError, TypeError, ValueError) as e:
+        logger.warning("Failed to fetch %d push receipts: %s", len(pushes), e)
+        OutboundPush.objects.filter(id__in=[push.id for push in pushes]).update(receipt_check_at=check_again_at)
+        schedule_receipts()
+        return 0
+
+    delivered, pending = [], []
+    for push in pushes:
+        receipt = receipts.get(push.ticket_id)
+        if receipt is None:
+            pending.append(push.id)
+        elif receipt.get('status') == 'ok':
+            delivered.append(push.id)
+        else:
+            error, _ = push_error(push, receipt)
+            OutboundPush.objects.filter(id=push.id).update(receipt_status='error', last_error=error, receipt_check_at=None)
+    OutboundPush.objects.filter(id__in=delivered).update(receipt_status='ok', receipt_check_at=None)
+
+    # Receipts that are not ready yet are asked for again later, a limited number of times
+    OutboundPush.objects.filter(id__in=pending, receipt_checks__gte=settings.PUSH_RECEIPT_MAX_POLLS - 1).update(
+        receipt_checks=F('receipt_checks') + 1, receipt_check_at=None,
+    )
+    OutboundPush.objects.filter(id__in=pending, receipt_checks__lt=settings.PUSH_RECEIPT_MAX_POLLS - 1).update(
+        receipt_checks=F('receipt_checks') + 1, receipt_check_at=check_again_at,
+    )
+
+    if len(pushes) == limit:
+        task_queue.enqueue("push:receipts", check_push_receipts)
+    else:
+        schedule_receipts()
+    return len(pushes) - len(pending)
+
+def schedule_receipts():
+    """
+    Check receipts again in this process when the next one is due.
+    """
+    if settings.TASKS_ALWAYS_EAGER:
+        return
+
+    check_at = OutboundPush.objects.filter(receipt_check_at__isnull=False).order_by('receipt_check_at').values_list('receipt_check_at', flat=True).first()
+    if check_at is not None:
+        task_queue.enqueue("push:receipts", check_push_receipts, delay=max((check_at - timezone.now()).total_seconds(), 0))
+
+def push_error(push, result):
+    """
+    Handle an error from a push ticket or receipt. Returns the error and whether sending
+    the same message again could succeed.
+    """
+    details = result.get('details') or {}
+    if details.get('error') == 'DeviceNotRegistered':
+        # The app was uninstalled or the token expired; stop sending to it
+        PushToken.objects.filter(token=push.token).delete()
+
+    error = f"{result.get('message')} {details}"
+    logger.warning("Push notification to %s failed: %s", push.token, error)
+    return error, details.get('error') == 'MessageRateExceeded'
+
+def notify_customer(customer_id, build_message):
+    """
+    Queue one message per registered device of a customer; returns the number of devices.
+    """
+    tokens = list(PushToken.objects.filter(customer_id=customer_id).values_list('token', flat=True).distinct())
+    for token in tokens:
+        queue_push(build_message(token))
+    return len(tokens)
+
+def point_gift_message(token, customer, restaurant):
+    restaurant_dict = {
+        'id': restaurant.id,
+        'name': restaurant.name,
+        'address': restaurant.address,
+        'restaurant_image': restaurant.restaurant_image.url if restaurant.restaurant_image else None
+    }
+
+    customer_dict = {
+        'first_name': customer.first_name,
+        'last_name': customer.last_name,
+    }
+
+    return {
+        'to': token,
+        'title': 'PunchMe',
+        'body': f'{customer.first_name} {customer.last_name} sent you a gift!',
+        'data': {
+            'screen': 'Rewards',
+            'restaurant': json.dumps(restaurant_dict),
+            'sender': json.dumps(customer_dict)
+        },
+    }
+
+def friend_request_message(token, customer):
+    customer_dict = {
+        'first_name': customer.first_name,
+        'last_name': customer.last_name,
+    }
+
+    return {
+        'to': token,
+        'title': 'PunchMe',
+        'body': f'{customer.first_name} {customer.last_name} friended you!',
+        'data': {
+            'screen': 'Friends',
+            'sender': json.dumps(customer_dict)
+        },
+    }
@@ -0,0 +1,177 @@
+import json
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from users.models import User, Customer, Manager, Restaurant, Item, CustomerPoints, RestaurantQR, Friendship, Transaction
+from users.models import LedgerEntry
+from users.phone import normalize_phone_number, hash_phone_number
+
+# Restaurants are spread around a few metro areas: (latitude, longitude, spread in degrees)
+METRO_AREAS = [
+    (34.05, -118.25, 0.3),
+    (37.77, -122.42, 0.15),
+    (40.71, -74.01, 0.2),
+    (41.88, -87.63, 0.2),
+    (29.76, -95.37, 0.25),
+    (47.61, -122.33, 0.15),
+    (25.76, -80.19, 0.2),
+]
+
+TRANSACTION_TYPES = ['point', 'point', 'point', 'gift', 'reward']
+
+def seed_manager_email(index):
+    return f'loadmanager{index}@example.com'
+
+def seed_phone_number(index):
+    # 555 numbers are reserved for fiction, so seeded customers never match real contacts
+    return f'+1555{index:07d}'
+
+def batches(items, batch_size):
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+def insert_children(model, objs):
+    """
+    Insert multi-table inherited rows whose parent User rows already exist.
+
+    bulk_create refuses multi-table models, and save() would cost a query or two per row.
+    """
+    fields = model._meta.local_concrete_fields
+    batch_size = max(connection.ops.bulk_batch_size(fields, objs), 1)
+    for batch in batches(objs, batch_size):
+        model._base_manager._insert(batch, fields=fields)
+
+def create_users(usernames, role, first_name):
+    users = User.objects.bulk_create([
+        User(username=username, role=role, first_name=first_name, last_name=str(i), password='!')
+        for i, username in enumerate(usernames)
+    ])
+    if all(user.pk for user in users):
+        return [user.pk for user in users]
+
+    # The database backend doesn't return ids from bulk inserts
+    ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+    return [ids[username] for username in usernames]
+
+def seed_restaurants(rng, count, offset=0, batch_size=2000, items_per_restaurant=3):
+    """
+    Create count managers, each with a restaurant, a QR code and some items.
+    Returns the restaurant ids.
+    """
+    restaurant_ids = []
+    for indexes in batches(range(offset, offset + count), batch_size):
+        emails = [seed_manager_email(index) for index in indexes]
+        manager_ids = create_users(emails, User.Role.MANAGER, 'Manager')
+        insert_children(Manager, [Manager(user_ptr_id=user_id, manager_email=email) for user_id, email in zip(manager_ids, emails)])
+
+        restaurants = []
+        for index, manager_id in zip(indexes, manager_ids):
+            latitude, longitude, spread = rng.choice(METRO_AREAS)
+            restaurants.append(Restaurant(
+                manager_id=manager_id,
+                name=f'Restaurant {index}',
+                address=f'{index} Main St',
+                latitude=round(rng.gauss(latitude, spread), 6),
+                longitude=round(rng.gauss(longitude, spread), 6),
+            ))
+        Restaurant.objects.bulk_create(restaurants)
+        ids = list(Restaurant.objects.filter(manager_id__in=manager_ids).order_by('manager_id').values_list('id', flat=True))
+
+        RestaurantQR.objects.bulk_create([RestaurantQR(restaurant_id=restaurant_id) for restaurant_id in ids])
+        Item.objects.bulk_create([
+            Item(restaurant_id=restaurant_id, name=f'Item {n}', num_points=rng.randint(3, 15))
+            for restaurant_id in ids for n in range(items_per_restaurant)
+        ])
+        restaurant_ids.extend(ids)
+    return restaurant_ids
+
+def seed_customers(rng, count, offset=0, batch_size=2000):
+    """
+    Create count customers with unique 555 phone numbers. Returns the customer ids.
+    """
+    customer_ids = []
+    for indexes in batches(range(offset, offset + count), batch_size):
+        phone_numbers = [seed_phone_number(index) for index in indexes]
+        ids = create_users(phone_numbers, User.Role.CUSTOMER, 'Customer')
+        insert_children(Customer, [
+            Customer(
+                user_ptr_id=user_id,
+                phone_number=phone_number,
+                phone_e164=normalize_phone_number(phone_number),
+                phone_hash=hash_phone_number(normalize_phone_number(phone_number)),
+            )
+            for user_id, phone_number in zip(ids, phone_numbers)
+        ])
+        customer_ids.extend(ids)
+    return customer_ids
+
+def seed_friendships(rng, customer_ids, max_friends=300, batch_size=2000):
+    """
+    Give every customer a power-law number of friends: most have a few, some have hundreds.
+    Returns the number of friendships created.
+    """
+    created = 0
+    pending = []
+    for customer_id in customer_ids:
+        degree = min(int(rng.paretovariate(1.2)), max_friends, len(customer_ids) - 1)
+        pending.extend(
+            Friendship(customer_id=customer_id, friend_id=friend_id)
+            for friend_id in set(rng.sample(customer_ids, degree + 1)) - {customer_id}
+        )
+        if len(pending) >= batch_size:
+            Friendship.objects.bulk_create(pending)
+            created += len(pending)
+            pending = []
+
+    Friendship.objects.bulk_create(pending)
+    return created + len(pending)
+
+def seed_points(rng, customer_ids, restaurant_ids, max_restaurants=30, batch_size=2000):
+    """
+    Join every customer to a power-law number of restaurants with a random balance.
+    Returns the (customer id, restaurant id) pairs.
+    """
+    pairs = []
+    pending = []
+    for customer_id in customer_ids:
+        joined = rng.sample(restaurant_ids, min(int(rng.paretovariate(1.5)), max_restaurants, len(restaurant_ids)))
+        for restaurant_id in joined:
+            pending.append(CustomerPoints(customer_id=customer_id, restaurant_id=restaurant_id, num_points=rng.randint(0, 20)))
+            pairs.append((customer_id, restaurant_id))
+        if len(pending) >= batch_size:
+            create_points(pending)
+            pending = []
+
+    create_points(pending)
+    return pairs
+
+def create_points(points):
+    CustomerPoints.objects.bulk_create(points)
+    LedgerEntry.objects.bulk_create([
+        LedgerEntry(customer_id=balance.customer_id, restaurant_id=balance.restaurant_id, delta=balance.num_points, kind=LedgerEntry.Kind.OPENING)
+        for balance in points
+    ])
+
+def seed_transactions(rng, pairs, count, years=3, batch_size=2000):
+    """
+    Create count transactions between the given customer/restaurant pairs, spread over years.
+    """
+    now = timezone.now()
+    span = int(years * 365 * 24 * 3600)
+    for size in batches(range(count), batch_size):
+        transactions = []
+        for _ in size:
+            customer_id, restaurant_id = rng.choice(pairs)
+            transaction_type = rng.choice(TRANSACTION_TYPES)
+            transactions.append(Transaction(
+                restaurant_id=restaurant_id,
+                customer_id=customer_id,
+                customer_string=json.dumps({'first_name': 'Customer', 'last_name': '', 'id': customer_id}),
+                transaction_date=now - timedelta(seconds=rng.randint(0, span)),
+                transaction_type=transaction_type,
+                transaction_reward='Item 0' if transaction_type == 'reward' else None,
+                num_points=rng.randint(3, 15) if transaction_type == 'reward' else 1,
+            ))
+        Transaction.objects.bulk_create(transactions)
@@ -0,0 +1,84 @@
+from datetime import timedelta
+
+import requests
+
+from django.conf import settings
+from django.utils import timezone
+
+from twilio.base.exceptions import TwilioException
+
+from twilio_config import twilio_client, twilio_phone_number
+from users.models import OutboundSMS, SMSSendSlot
+from users.outbox import due_messages, claim, mark_sent, mark_failed, schedule_retries
+from users.tasks import defer, task_queue
+
+def reserve_send_slot(from_number):
+    """
+    Take from_number's next send slot, spacing its sends by 1 / SMS_RATE_PER_SECOND across
+    every process. Returns None if the slot was taken, else the seconds until the next one.
+    """
+    now = timezone.now()
+    slots = SMSSendSlot.objects.filter(from_number=from_number)
+    if slots.filter(next_send_at__lte=now).update(next_send_at=now + timedelta(seconds=1 / settings.SMS_RATE_PER_SECOND)):
+        return None
+
+    next_send_at = slots.values_list('next_send_at', flat=True).first()
+    if next_send_at is None:
+        # First message from this number; a concurrent sender may create the row first
+        created = SMSSendSlot.objects.bulk_create([SMSSendSlot(from_number=from_number, next_send_at=now)], ignore_conflicts=True)
+        return reserve_send_slot(from_number) if created else 1 / settings.SMS_RATE_PER_SECOND
+    return max((next_send_at - now).total_seconds(), 0)
+
+def queue_sms(to, body, from_number=None):
+    """
+    Store a text message and send it from the background worker once the request commits.
+    """
+    sms = OutboundSMS.objects.create(
+        to=str(to),
+        from_number=from_number or twilio_phone_number or '',
+        body=body,
+    )
+    defer("sms:send", send_pending_sms)
+    return sms
+
+def send_pending_sms(limit=100):
+    """
+    Send due text messages. Returns the number of messages Twilio accepted.
+    """
+    sent = 0
+    waits = {}
+    for sms in due_messages(OutboundSMS, limit):
+        # Messages from a number that is sending too fast stay due; they are sent on a later run
+        if sms.from_number in waits:
+            continue
+        wait = reserve_send_slot(sms.from_number)
+        if wait is not None:
+            waits[sms.from_number] = wait
+            continue
+
+        if not claim(sms):
+            continue
+
+        try:
+            message = twilio_client.messages.create(
+                body=sms.body,
+                from_=sms.from_number,
+                to=sms.to,
+                status_callback=settings.TWILIO_STATUS_CALLBACK_URL,
+            )
+        except (TwilioException, requests.RequestException) as e:
+            # Timeouts and connection errors are retried like errors from Twilio
+            mark_failed(sms, e)
+            continue
+
+        mark_sent(sms, sid=message.sid or '', delivery_status=message.status or '')
+        sent += 1
+
+    if waits and not settings.TASKS_ALWAYS_EAGER:
+        task_queue.enqueue("sms:send", send_pending_sms, delay=min(waits.values()))
+    else:
+        schedule_retries(OutboundSMS, "sms:send", send_pending_sms)
+    return sent
+
+def update_delivery_status(sid, status):
+    return OutboundSMS.objects.filter(sid=sid).update(delivery_status=status)
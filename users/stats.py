@@ -0,0 +1,231 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min, Q, Sum, Value
+from django.db.models.functions import TruncDate, TruncDay, TruncHour
+from django.utils import timezone
+
+from users.models import RestaurantStats, RestaurantCustomerDay, RollupWatermark, Transaction
+from users.tasks import defer
+
+WATERMARK = 'restaurant-stats'
+
+def period_start(moment, period):
+    start = moment.replace(minute=0, second=0, microsecond=0)
+    if period == RestaurantStats.Period.DAY:
+        start = start.replace(hour=0)
+    return start
+
+def count_transactions(transactions):
+    """
+    Aggregate transactions into {(restaurant id, period, start, transaction type): [transactions, points]}
+    for both hours and days.
+    """
+    totals = defaultdict(lambda: [0, 0])
+    rows = (
+        transactions
+        .annotate(hour=TruncHour('transaction_date'))
+        .values('restaurant', 'transaction_type', 'hour')
+        .annotate(count=Count('id'), points=Sum('num_points'))
+        .order_by()
+    )
+    for row in rows:
+        for period in RestaurantStats.Period.values:
+            total = totals[(row['restaurant'], period, period_start(row['hour'], period), row['transaction_type'])]
+            total[0] += row['count']
+            total[1] += row['points']
+    return totals
+
+def customer_days(transactions):
+    return (
+        transactions
+        .exclude(customer=None)
+        .annotate(day=TruncDate('transaction_date'))
+        .values_list('restaurant', 'customer', 'day')
+        .order_by()
+        .distinct()
+    )
+
+def save_customer_days(transactions):
+    RestaurantCustomerDay.objects.bulk_create([
+        RestaurantCustomerDay(restaurant_id=restaurant_id, customer_id=customer_id, day=day)
+        for restaurant_id, customer_id, day in customer_days(transactions)
+    ], batch_size=1000, ignore_conflicts=True)
+
+def add_totals(totals):
+    """
+    Add totals to the RestaurantStats rows they belong to, creating the missing rows.
+    """
+    if not totals:
+        return
+
+    starts = [start for _, _, start, _ in totals]
+    existing = RestaurantStats.objects.filter(
+        restaurant_id__in={restaurant_id for restaurant_id, _, _, _ in totals},
+        start__gte=min(starts),
+        start__lte=max(starts),
+    )
+    updated = []
+    for stats in existing:
+        total = totals.pop((stats.restaurant_id, stats.period, stats.start, stats.transaction_type), None)
+        if total:
+            stats.transactions += total[0]
+            stats.points += total[1]
+            updated.append(stats)
+
+    RestaurantStats.objects.bulk_update(updated, ['transactions', 'points'], batch_size=1000)
+    RestaurantStats.objects.bulk_create([
+        RestaurantStats(restaurant_id=restaurant_id, period=period, start=start, transaction_type=transaction_type, transactions=count, points=points)
+        for (restaurant_id, period, start, transaction_type), (count, points) in totals.items()
+    ], batch_size=1000)
+
+def rollup_bound(after_id, batch_size):
+    """
+    Return the last transaction id of the next batch to roll up, and whether the batch stopped
+    early at a transaction younger than RESTAURANT_STATS_LAG_SECONDS. Young transactions wait,
+    since a transaction with an earlier id can still be committing.
+
+    The batch is the next batch_size transactions rather than the next batch_size ids, so a
+    gap in the ids (deleted transactions, skipped sequence values) doesn't stall the rollup.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.RESTAURANT_STATS_LAG_SECONDS)
+    bounds = Transaction.objects.filter(id__gt=after_id).order_by('id')[:batch_size].aggregate(
+        last_id=Max('id'),
+        first_young_id=Min('id', filter=Q(transaction_date__gt=cutoff)),
+    )
+    if bounds['first_young_id'] is not None:
+        return bounds['first_young_id'] - 1, True
+    return bounds['last_id'] or after_id, False
+
+def last_rolled_up_id():
+    return RollupWatermark.objects.filter(name=WATERMARK).values_list('last_id', flat=True).first() or 0
+
+def roll_up_transactions(batch_size=None):
+    """
+    Add the transactions after the watermark to RestaurantStats and RestaurantCustomerDay.
+    Returns the number of transactions rolled up.
+    """
+    batch_size = batch_size or settings.RESTAURANT_STATS_BATCH_SIZE
+
+    # Most runs find nothing old enough yet; find that out without taking the lock
+    after_id = last_rolled_up_id()
+    if rollup_bound(after_id, batch_size)[0] <= after_id:
+        return 0
+
+    with transaction.atomic():
+        # The row lock keeps concurrent runs from rolling up the same transactions twice
+        watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK)
+        last_id, waiting = rollup_bound(watermark.last_id, batch_size)
+        if last_id <= watermark.last_id:
+            return 0
+
+        transactions = Transaction.objects.filter(id__gt=watermark.last_id, id__lte=last_id)
+        totals = count_transactions(transactions)
+        rolled_up = sum(count for (_, period, _, _), (count, _) in totals.items() if period == RestaurantStats.Period.DAY)
+        add_totals(totals)
+        save_customer_days(transactions)
+
+        watermark.last_id = last_id
+        watermark.save(update_fields=['last_id'])
+
+    if Transaction.objects.filter(id__gt=last_id).exists():
+        defer("stats:rollup", roll_up_transactions, delay=settings.RESTAURANT_STATS_LAG_SECONDS if waiting else 0)
+    return rolled_up
+
+def insert_rows(model, rows):
+    """
+    Insert the rows of a values() queryset into model with a single INSERT ... SELECT.
+    The queryset's field and annotation names must be model fields.
+    """
+    query = rows.query
+    names = list(query.values_select) + list(query.annotation_select)
+    columns = ', '.join(connection.ops.quote_name(model._meta.get_field(name).column) for name in names)
+    sql, params = query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({columns}) {sql}', params)
+
+def rebuild_restaurant_stats():
+    """
+    Recompute every rollup from the transactions inside the database.
+    Returns the id of the last transaction rolled up.
+    """
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=WATERMARK)
+        RestaurantStats.objects.all().delete()
+        RestaurantCustomerDay.objects.all().delete()
+
+        # Everything old enough, however many batches that is
+        last_id, _ = rollup_bound(0, Transaction.objects.aggregate(last_id=Max('id'))['last_id'] or 0)
+        transactions = Transaction.objects.filter(id__lte=last_id)
+
+        for period, trunc in ((RestaurantStats.Period.HOUR, TruncHour), (RestaurantStats.Period.DAY, TruncDay)):
+            insert_rows(RestaurantStats, (
+                transactions
+                .annotate(start=trunc('transaction_date'))
+                .values('restaurant', 'transaction_type', 'start')
+                .annotate(period=Value(period), transactions=Count('id'), points=Sum('num_points'))
+                .order_by()
+            ))
+        insert_rows(RestaurantCustomerDay, (
+            transactions
+            .exclude(customer=None)
+            .annotate(day=TruncDate('transaction_date'))
+            .values('restaurant', 'customer', 'day')
+            .order_by()
+            .distinct()
+        ))
+
+        watermark.last_id = last_id
+        watermark.save(update_fields=['last_id'])
+    return last_id
+
+def restaurant_stats(restaurant, period, since, until):
+    """
+    Per-period totals by transaction type for a restaurant, from the rollups plus the
+    transactions not rolled up yet. Days also count their active customers.
+    """
+    since = period_start(since, period)
+    last_id = last_rolled_up_id()
+    while True:
+        stats = read_restaurant_stats(restaurant, period, since, until, last_id)
+        # A rollup that committed during the reads would be counted again in the tail
+        watermark = last_rolled_up_id()
+        if watermark == last_id:
+            return stats
+        last_id = watermark
+
+def read_restaurant_stats(restaurant, period, since, until, last_id):
+    """
+    restaurant_stats with the rollups taken to cover the transactions up to last_id.
+    """
+    totals = defaultdict(dict)
+    rollups = RestaurantStats.objects.filter(restaurant=restaurant, period=period, start__gte=since, start__lt=until)
+    for start, transaction_type, count, points in rollups.values_list('start', 'transaction_type', 'transactions', 'points'):
+        totals[start][transaction_type] = {'count': count, 'points': points}
+
+    tail = Transaction.objects.filter(restaurant=restaurant, id__gt=last_id, transaction_date__gte=since, transaction_date__lt=until)
+    for (_, tail_period, start, transaction_type), (count, points) in count_transactions(tail).items():
+        if tail_period == period:
+            total = totals[start].setdefault(transaction_type, {'count': 0, 'points': 0})
+            total['count'] += count
+            total['points'] += points
+
+    active_customers = {}
+    if period == RestaurantStats.Period.DAY:
+        days = RestaurantCustomerDay.objects.filter(restaurant=restaurant, day__gte=since.date(), day__lt=until.date() + timedelta(days=1))
+        active_customers = dict(days.values('day').annotate(customers=Count('id')).values_list('day', 'customers').order_by())
+
+        tail_days = {(day, customer_id) for _, customer_id, day in customer_days(tail)}
+        known = set(days.filter(customer_id__in={customer_id for _, customer_id in tail_days}).values_list('day', 'customer_id'))
+        for day, _ in tail_days - known:
+            active_customers[day] = active_customers.get(day, 0) + 1
+
+    stats = []
+    for start in sorted(totals):
+        row = {'start': start, 'transactions': totals[start]}
+        if period == RestaurantStats.Period.DAY:
+            row['active_customers'] = active_customers.get(start.date(), 0)
+        stats.append(row)
+    return stats
@@ -0,0 +1,72 @@
+import logging, threading, time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+class TaskQueue:
+    """
+    In-process background worker for work that should not hold up a request.
+
+    Tasks are keyed: enqueueing a key that is already waiting to run does not add another
+    run, so a burst of identical requests (e.g. scans at one restaurant) collapses into one.
+    A task can be delayed by a number of seconds; a waiting task runs at the earliest time
+    any enqueue asked for.
+    """
+    def __init__(self):
+        self._pending = {}
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def enqueue(self, key, func, *args, delay=0, **kwargs):
+        if settings.TASKS_ALWAYS_EAGER:
+            func(*args, **kwargs)
+            return
+
+        run_at = time.monotonic() + delay
+        with self._condition:
+            if key in self._pending and self._pending[key][0] <= run_at:
+                return
+            self._pending[key] = (run_at, func, args, kwargs)
+            self._start_worker()
+            self._condition.notify()
+
+    def _start_worker(self):
+        # Started lazily so each gunicorn worker process gets its own thread after forking
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='punchme-tasks', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._pending:
+                        key = min(self._pending, key=lambda pending_key: self._pending[pending_key][0])
+                        wait = self._pending[key][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                        self._condition.wait(wait)
+                    else:
+                        self._condition.wait()
+                _, func, args, kwargs = self._pending.pop(key)
+
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                logger.exception("Background task %s failed", key)
+            finally:
+                close_old_connections()
+
+task_queue = TaskQueue()
+
+def defer(key, func, *args, delay=0, **kwargs):
+    """
+    Run func in the background once the current database transaction commits.
+    """
+    if settings.TASKS_ALWAYS_EAGER:
+        func(*args, **kwargs)
+        return
+
+    transaction.on_commit(lambda: task_queue.enqueue(key, func, *args, delay=delay, **kwargs))
@@ -1,3 +1,1139 @@
-from django.test import TestCase
+"""
+Query-count and latency regression tests for every route in punchme/urls.py.
 
-# Create your tests here.
+A synthetic dataset with thousands of restaurants, customers, friendships and transactions
+is seeded once, then each route is called through the DRF test client. The number of
+queries must not exceed users/query_baseline.json and the status code must match it.
+
+    UPDATE_QUERY_BASELINE=1 python manage.py test users   rewrite the baseline after an intended change
+    PERF_REPORT=report.json python manage.py test users   also write query counts and latencies
+    PERF_SCALE=5 python manage.py test users              seed five times as much data
+"""
+import json, os, random, threading, time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from smtplib import SMTPRecipientsRefused, SMTPServerDisconnected
+from unittest import mock
+from uuid import uuid4
+
+import jwt, requests
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.models import F, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, resolve
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from punchme import urls
+from twilio_config import TwilioTestClient
+from users import ledger, push, stats
+from users.authentication import tokens_for_user
+from users.geo import restaurant_locations
+from users.geocoding import address_cache
+from users.models import User, Customer, Manager, Restaurant, Item, CustomerPoints, ItemRedemption, RestaurantQR
+from users.models import Friendship, Referral, PushToken, PhoneAuthentication, EmailAuthentication, PointDelta
+from users.models import LedgerEntry, LedgerSnapshot, Transaction, OutboundPush, OutboundSMS, OutboundEmail
+from users.models import SMSSendSlot, RestaurantStats, RestaurantCustomerDay
+from users.mail import queue_email, send_pending_emails
+from users.outbox import mark_failed
+from users.phone import hash_phone_number
+from users.seeding import seed_restaurants, seed_customers, seed_friendships, seed_points, seed_transactions
+from users.sms import queue_sms, send_pending_sms
+from users.stats import rebuild_restaurant_stats, roll_up_transactions, last_rolled_up_id, restaurant_stats
+
+BASELINE_PATH = Path(__file__).resolve().parent / 'query_baseline.json'
+UPDATE_BASELINE = os.environ.get('UPDATE_QUERY_BASELINE') == '1'
+PERF_SCALE = float(os.environ.get('PERF_SCALE', 1))
+
+NUM_RESTAURANTS = int(1500 * PERF_SCALE)
+NUM_CUSTOMERS = int(3000 * PERF_SCALE)
+NUM_TRANSACTIONS = int(30000 * PERF_SCALE)
+
+def seed_dataset(rng):
+    """
+    Returns the seeded restaurant and customer ids in creation order.
+    """
+    restaurant_ids = seed_restaurants(rng, NUM_RESTAURANTS)
+    customer_ids = seed_customers(rng, NUM_CUSTOMERS)
+    seed_friendships(rng, customer_ids)
+    seed_transactions(rng, seed_points(rng, customer_ids, restaurant_ids), NUM_TRANSACTIONS, years=2)
+    return restaurant_ids, customer_ids
+
+class FakeExpoHandler(BaseHTTPRequestHandler):
+    """
+    Answers like Expo's push API. Tests can look at the requests it got and change its answers.
+    """
+    requests = []
+    failures = [] # status codes to answer the next requests with
+    ticket_errors = {} # token -> error for send tickets
+    receipts = None # ticket id -> receipt; None answers every receipt with ok
+
+    @classmethod
+    def reset(cls):
+        cls.requests, cls.failures, cls.ticket_errors, cls.receipts = [], [], {}, None
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.requests.append((self.path, payload))
+        if self.failures:
+            self.send_response(self.failures.pop(0))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.path.endswith('/receipts'):
+            if self.receipts is None:
+                data = {ticket_id: {'status': 'ok'} for ticket_id in payload['ids']}
+            else:
+                data = {ticket_id: self.receipts[ticket_id] for ticket_id in payload['ids'] if ticket_id in self.receipts}
+        else:
+            data = [
+                {'status': 'error', 'message': 'Push failed', 'details': {'error': self.ticket_errors[message['to']]}}
+                if message['to'] in self.ticket_errors else {'status': 'ok', 'id': uuid4().hex}
+                for message in payload
+            ]
+
+        body = json.dumps({'data': data}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fake_expo(test_class):
+    """
+    Serve FakeExpoHandler for the tests of test_class and point the Expo settings at it.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeExpoHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    test_class.addClassCleanup(server.server_close)
+    test_class.addClassCleanup(server.shutdown)
+
+    expo_url = f'http://127.0.0.1:{server.server_port}'
+    expo_settings = override_settings(EXPO_PUSH_URL=expo_url + '/send', EXPO_RECEIPTS_URL=expo_url + '/receipts')
+    expo_settings.enable()
+    test_class.addClassCleanup(expo_settings.disable)
+
+@override_settings(
+    TASKS_ALWAYS_EAGER=True,
+    GEOCODER='stub',
+    SMS_RATE_PER_SECOND=1000,
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+)
+class EndpointPerformanceTests(TestCase):
+    recorded = {}
+
+    @classmethod
+    def setUpClass(cls):
+        start_fake_expo(cls)
+
+        for patch in (
+            mock.patch('users.sms.twilio_client', TwilioTestClient(None, None)),
+            mock.patch('users.function_views.twilio_client', TwilioTestClient(None, None)),
+            mock.patch.dict(os.environ, {'SECRET_KEY_WS': 'test-ws-secret'}),
+        ):
+            patch.start()
+            cls.addClassCleanup(patch.stop)
+
+        cls.baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+
+        if UPDATE_BASELINE and cls.recorded:
+            baseline = dict(cls.baseline)
+            baseline.update({key: {'status': result['status'], 'queries': result['queries']} for key, result in cls.recorded.items()})
+            BASELINE_PATH.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+
+        report_path = os.environ.get('PERF_REPORT')
+        if report_path and cls.recorded:
+            Path(report_path).write_text(json.dumps(cls.recorded, indent=2, sort_keys=True) + '\n')
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(20240101)
+        restaurant_ids, customer_ids = seed_dataset(rng)
+
+        cls.manager = Manager.objects.select_related('restaurant').get(restaurant__id=restaurant_ids[0])
+        cls.restaurant = cls.manager.restaurant
+        cls.item = Item.objects.filter(restaurant=cls.restaurant).first()
+        cls.qr = RestaurantQR.objects.get(restaurant=cls.restaurant)
+
+        cls.customer = Customer.objects.get(id=customer_ids[0])
+        cls.friend = Customer.objects.get(id=customer_ids[1])
+        Friendship.objects.get_or_create(customer=cls.customer, friend=cls.friend)
+        cls.stranger = Customer.objects.exclude(friend_set__customer=cls.customer).exclude(id=cls.customer.id).first()
+        CustomerPoints.objects.filter(customer=cls.customer, restaurant=cls.restaurant).delete()
+        LedgerEntry.objects.filter(customer=cls.customer, restaurant=cls.restaurant).delete()
+        ledger.grant_bonus(cls.customer, cls.restaurant, 50)
+        CustomerPoints.objects.filter(customer=cls.customer, restaurant=cls.restaurant).update(give_point_eligible=True)
+        cls.redemption = ItemRedemption.objects.create(customer=cls.customer, item=cls.item)
+        Referral.objects.create(customer=cls.friend, restaurant=cls.restaurant, phone_number=cls.customer.phone_number)
+        PushToken.objects.create(customer=cls.friend, token='ExponentPushToken[friend]')
+
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+
+        # Managers' stats start out rolled up, so requests only roll up their own transactions
+        rebuild_restaurant_stats()
+
+    def setUp(self):
+        # Process-level caches would make counts depend on test order
+        restaurant_locations.invalidate()
+        address_cache.clear()
+        cache.clear()
+        FakeExpoHandler.reset()
+
+        self.customer_client = self.client_for(self.customer)
+        self.manager_client = self.client_for(self.manager)
+        self.staff_client = APIClient()
+        self.staff_client.credentials(HTTP_AUTHORIZATION='Bearer ' + str(RefreshToken.for_user(self.staff).access_token))
+        self.anonymous_client = APIClient()
+
+    def points(self, customer, restaurant=None):
+        points = CustomerPoints.objects.filter(customer=customer, restaurant=restaurant or self.restaurant).first()
+        return points.num_points if points else 0
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer ' + tokens_for_user(user)['access'])
+        return client
+
+    def measure(self, route, client, method, path, data=None, format='json'):
+        """
+        Call path, record its query count and latency, and compare them with the baseline for route.
+        """
+        key = f'{method.upper()} {route}'
+        request = getattr(client, method)
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = request(path, data, format=format) if data is not None else request(path)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            latency = time.perf_counter() - start
+
+        self.recorded[key] = {
+            'status': response.status_code,
+            'queries': len(queries),
+            'latency_ms': round(latency * 1000, 1),
+        }
+        if UPDATE_BASELINE:
+            return response
+
+        self.assertIn(key, self.baseline, f"No baseline for {key}; run with UPDATE_QUERY_BASELINE=1")
+        expected = self.baseline[key]
+        self.assertEqual(response.status_code, expected['status'], f"{key} returned {response.status_code}")
+        self.assertLessEqual(
+            len(queries), expected['queries'],
+            f"{key} ran {len(queries)} queries, baseline is {expected['queries']}:\n" +
+            '\n'.join(query['sql'] for query in queries.captured_queries),
+        )
+        return response
+
+    def test_every_route_has_a_baseline(self):
+        if UPDATE_BASELINE:
+            self.skipTest("Updating the baseline")
+
+        routes = {str(pattern.pattern) for pattern in urls.urlpatterns if isinstance(pattern, URLPattern)}
+        routes -= {str(pattern.pattern) for pattern in urls.router.urls}
+        routes |= {prefix + '/' for prefix, _, _ in urls.router.registry}
+        measured = {key.split(' ', 1)[1] for key in self.baseline}
+        self.assertEqual(routes - measured, set())
+
+    def test_get_friends_query_count_does_not_grow_with_friends(self):
+        few, many = Customer.objects.exclude(id=self.customer.id)[:2]
+        Friendship.objects.filter(customer__in=[few, many]).delete()
+        others = list(Customer.objects.exclude(id__in=[few.id, many.id])[:200])
+        Friendship.objects.bulk_create([Friendship(customer=few, friend=friend) for friend in others[:3]])
+        Friendship.objects.bulk_create([Friendship(customer=many, friend=friend) for friend in others])
+
+        counts = []
+        for customer in (few, many):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client_for(customer).get('/get-friends?mutual_restaurants=true')
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    # LOGIN / REGISTER
+
+    def test_token_refresh(self):
+        refresh = tokens_for_user(self.customer)['refresh']
+        self.measure('api/token/refresh/', self.anonymous_client, 'post', '/api/token/refresh/', {'refresh': refresh})
+
+    def test_token_refresh_reloads_the_user(self):
+        # A refresh token from before the claims were added picks them up on refresh
+        response = self.anonymous_client.post('/api/token/refresh/', {'refresh': str(RefreshToken.for_user(self.customer))})
+        self.assertEqual(response.status_code, 200)
+        access = AccessToken(response.data['access'])
+        self.assertEqual((access['role'], access['is_active'], access['customer_id']), (self.customer.role, True, self.customer.id))
+
+        User.objects.filter(id=self.customer.id).update(is_active=False)
+        response = self.anonymous_client.post('/api/token/refresh/', {'refresh': response.data['refresh']})
+        self.assertEqual(response.status_code, 401)
+
+    def test_send_phone_code(self):
+        self.measure('send-phone-code/', self.anonymous_client, 'post', '/send-phone-code/', {'phone_number': '+15559990001', 'is_register': True})
+        phone_auth = PhoneAuthentication.objects.get(phone_number='+15559990001')
+        self.assertEqual(OutboundSMS.objects.get(to='+15559990001').body, f"Your code for Punchme is {phone_auth.code}")
+
+    def test_register_verify_phone_code(self):
+        phone_auth = PhoneAuthentication.objects.create(phone_number='+15559990002')
+        with override_settings(SIGNUP_BONUS_RESTAURANT_ID=self.restaurant.id):
+            self.measure('register-verify-phone-code/', self.anonymous_client, 'put', '/register-verify-phone-code/', {
+                'phone_number': phone_auth.phone_number,
+                'code': phone_auth.code,
+                'proxy_uuid': str(phone_auth.proxy_uuid),
+            })
+        customer = Customer.objects.get(username=phone_auth.phone_number)
+        self.assertEqual(self.points(customer), 3)
+        self.assertFalse(PhoneAuthentication.objects.filter(phone_number=phone_auth.phone_number).exists())
+
+    def test_login_verify_phone_code(self):
+        phone_auth = PhoneAuthentication.objects.create(phone_number=self.customer.phone_number)
+        response = self.measure('login-verify-phone-code/', self.anonymous_client, 'put', '/login-verify-phone-code/', {
+            'phone_number': phone_auth.phone_number,
+            'code': phone_auth.code,
+        })
+        self.assertEqual(response.data['user']['id'], self.customer.id)
+        self.assertFalse(PhoneAuthentication.objects.filter(phone_number=phone_auth.phone_number).exists())
+
+    def test_send_email_code(self):
+        self.measure('send-email-code/', self.anonymous_client, 'post', '/send-email-code/', {'email': 'new@example.com', 'is_register': True})
+        email_auth = EmailAuthentication.objects.get(email='new@example.com')
+        self.assertEqual([(email.to, email.body) for email in mail.outbox], [(['new@example.com'], f"Your code for Punchme is {email_auth.code}")])
+
+    def test_register_verify_email_code(self):
+        email_auth = EmailAuthentication.objects.create(email='new@example.com')
+        self.measure('register-verify-email-code/', self.anonymous_client, 'put', '/register-verify-email-code/', {
+            'email': email_auth.email,
+            'code': email_auth.code,
+            'proxy_uuid': str(email_auth.proxy_uuid),
+            'first_name': 'New',
+            'last_name': 'Manager',
+        })
+        manager = Manager.objects.get(username='new@example.com')
+        self.assertEqual((manager.first_name, manager.last_name), ('New', 'Manager'))
+        self.assertTrue(RestaurantQR.objects.filter(restaurant__manager=manager).exists())
+
+    def test_login_verify_email_code(self):
+        email_auth = EmailAuthentication.objects.create(email=self.manager.manager_email)
+        response = self.measure('login-verify-email-code/', self.anonymous_client, 'put', '/login-verify-email-code/', {
+            'email': email_auth.email,
+            'code': email_auth.code,
+        })
+        self.assertEqual(response.data['user']['id'], self.manager.id)
+        self.assertFalse(EmailAuthentication.objects.filter(email=email_auth.email).exists())
+
+    # CUSTOMER
+
+    def test_get_customer(self):
+        self.measure('get-customer', self.customer_client, 'get', '/get-customer')
+
+    def test_update_customer(self):
+        self.measure('update-customer/', self.customer_client, 'patch', '/update-customer/', {'first_name': 'Updated'})
+        self.assertEqual(Customer.objects.get(id=self.customer.id).first_name, 'Updated')
+
+    def test_delete_customer(self):
+        self.measure('delete-customer/', self.client_for(self.stranger), 'delete', '/delete-customer/')
+        self.assertFalse(User.objects.filter(id=self.stranger.id).exists())
+
+    def test_create_redemption(self):
+        response = self.measure('create-redemption/', self.customer_client, 'post', '/create-redemption/', {'item_id': self.item.id})
+        redemption = ItemRedemption.objects.get(id=response.data['data']['id'])
+        self.assertEqual((redemption.customer_id, redemption.item_id), (self.customer.id, self.item.id))
+
+    def test_delete_redemption(self):
+        self.measure('delete-redemption/<int:redemption_id>/', self.customer_client, 'delete', f'/delete-redemption/{self.redemption.id}/')
+        self.assertFalse(ItemRedemption.objects.filter(id=self.redemption.id).exists())
+
+    def test_award_point(self):
+        self.measure('award-point/', self.customer_client, 'patch', '/award-point/', {'code': str(self.qr.code)})
+        self.assertEqual(self.points(self.customer), 51)
+        self.assertEqual(ledger.ledger_balance(self.customer, self.restaurant), 51)
+        # Each scan rotates the restaurant's QR code
+        self.assertNotEqual(RestaurantQR.objects.get(id=self.qr.id).code, self.qr.code)
+
+    @override_settings(POINTS_BUFFERED_SCANS=True, TASKS_ALWAYS_EAGER=False)
+    def test_award_point_buffered(self):
+        points = CustomerPoints.objects.get(customer=self.customer, restaurant=self.restaurant)
+        for _ in range(2):
+            response = self.customer_client.patch('/award-point/', {'code': str(self.qr.code)}, format='json')
+            self.assertEqual(response.status_code, 200)
+
+        # The scans are only appended as deltas, but reads already count them
+        points.refresh_from_db()
+        self.assertEqual(points.num_points, 50)
+        response = self.customer_client.get(f'/get-customer-points-by-restaurant/{self.restaurant.id}')
+        self.assertEqual(response.data['num_points'], 52)
+
+        self.assertEqual(ledger.compact_point_deltas(), 2)
+        points.refresh_from_db()
+        self.assertEqual(points.num_points, 52)
+        self.assertFalse(PointDelta.objects.exists())
+
+    @override_settings(LEDGER_SNAPSHOT_LAG_SECONDS=0)
+    def test_verify_ledger(self):
+        call_command('verify_ledger', '--snapshot', stdout=StringIO())
+        self.assertTrue(LedgerSnapshot.objects.exists())
+
+        # New entries are replayed from the snapshot as a tail
+        self.customer_client.patch('/award-point/', {'code': str(self.qr.code)}, format='json')
+        self.manager_client.patch('/validate-redemption/', {'code': str(self.redemption.code)}, format='json')
+        self.assertEqual(ledger.ledger_balance(self.customer, self.restaurant), 51 - self.item.num_points)
+        call_command('verify_ledger', stdout=StringIO())
+
+        CustomerPoints.objects.filter(customer=self.customer, restaurant=self.restaurant).update(num_points=0)
+        with self.assertRaisesMessage(CommandError, "1 balances do not match the ledger"):
+            call_command('verify_ledger', '--full', stdout=StringIO())
+
+    def test_send_point(self):
+        friend_points = self.points(self.friend)
+        self.measure('send-point/', self.customer_client, 'post', '/send-point/', {
+            'phone_number': self.friend.phone_number,
+            'restaurant_id': self.restaurant.id,
+        })
+        self.assertEqual(self.points(self.friend), friend_points + 1)
+        self.assertFalse(CustomerPoints.objects.get(customer=self.customer, restaurant=self.restaurant).give_point_eligible)
+
+    def test_add_friend(self):
+        self.measure('add-friend/', self.customer_client, 'post', '/add-friend/', {'phone_number': self.stranger.phone_number})
+        self.assertTrue(Friendship.objects.filter(customer=self.customer, friend=self.stranger).exists())
+
+    def test_send_point_twilio(self):
+        self.measure('send-point-twilio/', self.customer_client, 'post', '/send-point-twilio/', {
+            'phone_number': '+15559990003',
+            'name': 'Pat',
+            'restaurant_id': self.restaurant.id,
+        })
+        sms = OutboundSMS.objects.get(to='+15559990003')
+        self.assertEqual(sms.status, OutboundSMS.Status.SENT)
+        self.assertIn(self.restaurant.name, sms.body)
+
+    def test_create_referral(self):
+        self.measure('create-referral/', self.customer_client, 'post', '/create-referral/', {
+            'phone_number': '+15559990004',
+            'restaurant_id': self.restaurant.id,
+        })
+        referral = Referral.objects.get(phone_number='+15559990004')
+        self.assertEqual((referral.customer_id, referral.restaurant_id), (self.customer.id, self.restaurant.id))
+
+    def test_use_referral(self):
+        response = self.measure('use-referral/', self.customer_client, 'post', '/use-referral/', {})
+        self.assertEqual(response.data['first_name'], self.friend.first_name)
+        self.assertEqual(self.points(self.customer), 51)
+        self.assertFalse(Referral.objects.filter(phone_number=self.customer.phone_number).exists())
+
+    def test_set_push_token(self):
+        self.measure('set-push-token/', self.customer_client, 'post', '/set-push-token/', {'token': 'ExponentPushToken[customer]'})
+        self.assertTrue(PushToken.objects.filter(customer=self.customer, token='ExponentPushToken[customer]').exists())
+
+    # MANAGER
+
+    def test_get_manager(self):
+        self.measure('get-manager', self.manager_client, 'get', '/get-manager')
+
+    def test_update_manager(self):
+        self.measure('update-manager/', self.manager_client, 'patch', '/update-manager/', {'first_name': 'Updated'})
+        self.assertEqual(Manager.objects.get(id=self.manager.id).first_name, 'Updated')
+
+    def test_delete_manager(self):
+        self.measure('delete-manager/', self.manager_client, 'delete', '/delete-manager/')
+        self.assertFalse(User.objects.filter(id=self.manager.id).exists())
+
+    def test_delete_manager_request(self):
+        self.measure('delete-manager-request/', self.manager_client, 'post', '/delete-manager-request/', {})
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn(f"Account ID: {self.manager.id}", mail.outbox[0].body)
+
+    def test_update_restaurant(self):
+        self.measure('update-restaurant/', self.manager_client, 'patch', '/update-restaurant/', {'address': '1 New Address Rd'})
+        self.assertEqual(Restaurant.objects.get(id=self.restaurant.id).address, '1 New Address Rd')
+
+    def test_create_item(self):
+        self.measure('create-item/', self.manager_client, 'post', '/create-item/', {'name': 'Boba', 'num_points': 5})
+        self.assertTrue(Item.objects.filter(restaurant=self.restaurant, name='Boba', num_points=5).exists())
+
+    def test_update_item(self):
+        self.measure('update-item/', self.manager_client, 'patch', '/update-item/', {'item_id': self.item.id, 'num_points': 7})
+        self.assertEqual(Item.objects.get(id=self.item.id).num_points, 7)
+
+    def test_delete_item(self):
+        self.measure('delete-item/<int:item_id>/', self.manager_client, 'delete', f'/delete-item/{self.item.id}/')
+        self.assertFalse(Item.objects.filter(id=self.item.id).exists())
+
+    def test_generate_qr(self):
+        response = self.measure('generate-qr/', self.manager_client, 'patch', '/generate-qr/', {})
+        code = RestaurantQR.objects.get(id=self.qr.id).code
+        self.assertNotEqual(code, self.qr.code)
+        self.assertEqual(response.data['code'], str(code))
+
+    def test_get_qr(self):
+        self.measure('get-qr', self.manager_client, 'get', '/get-qr')
+
+    def test_validate_redemption(self):
+        response = self.measure('validate-redemption/', self.manager_client, 'patch', '/validate-redemption/', {'code': str(self.redemption.code)})
+        self.assertEqual(response.data['updated_points'], 50 - self.item.num_points)
+        self.assertEqual(self.points(self.customer), 50 - self.item.num_points)
+        self.assertFalse(ItemRedemption.objects.filter(id=self.redemption.id).exists())
+
+    def test_get_transactions_by_customer(self):
+        self.measure('get-transactions-by-customer/<int:customer_id>', self.manager_client, 'get', f'/get-transactions-by-customer/{self.customer.id}')
+
+    def test_transactions_by_customer_order(self):
+        for _ in range(3):
+            ledger.credit_point(self.customer, self.restaurant)
+        path = f'/get-transactions-by-customer/{self.customer.id}'
+
+        unpaginated = [transaction['id'] for transaction in self.manager_client.get(path).data]
+        paginated = []
+        url = path + '?page_size=2'
+        while url:
+            response = self.manager_client.get(url)
+            paginated += [transaction['id'] for transaction in response.data['results']]
+            url = response.data['next']
+
+        # Without pagination parameters the list is oldest first, pages are newest first
+        transactions = Transaction.objects.filter(restaurant=self.restaurant, customer=self.customer)
+        self.assertGreaterEqual(len(unpaginated), 3)
+        self.assertEqual(unpaginated, list(transactions.order_by('transaction_date', 'id').values_list('id', flat=True)))
+        self.assertEqual(paginated, unpaginated[::-1])
+
+    def test_export_transactions(self):
+        self.measure('export-transactions/<str:file_format>', self.manager_client, 'get', '/export-transactions/csv')
+
+    def test_get_restaurant_stats(self):
+        # A transaction too recent to be rolled up is counted from the tail
+        self.customer_client.patch('/award-point/', {'code': str(self.qr.code)}, format='json')
+
+        response = self.measure('get-restaurant-stats', self.manager_client, 'get', '/get-restaurant-stats?since=2000-01-01')
+        transactions = Transaction.objects.filter(restaurant=self.restaurant)
+        self.assertEqual(
+            sum(row['transactions'].get('point', {}).get('count', 0) for row in response.data['stats']),
+            transactions.filter(transaction_type='point').count(),
+        )
+        self.assertEqual(
+            sum(row['active_customers'] for row in response.data['stats']),
+            len(set(transactions.exclude(customer=None).annotate(day=TruncDate('transaction_date')).values_list('day', 'customer'))),
+        )
+
+        response = self.manager_client.get('/get-restaurant-stats?period=hour&since=2000-01-01')
+        self.assertEqual(response.status_code, 400)
+
+    # GET ENDPOINTS
+
+    def test_get_restaurant(self):
+        self.measure('get-restaurant/<int:restaurant_id>', self.customer_client, 'get', f'/get-restaurant/{self.restaurant.id}')
+
+    def test_get_all_restaurants(self):
+        self.measure('get-all-restaurants', self.customer_client, 'get', '/get-all-restaurants')
+
+    def test_get_restaurants_by_location(self):
+        self.measure('get-restaurants-by-location/', self.customer_client, 'post', '/get-restaurants-by-location/', {
+            'latitude': 34.05,
+            'longitude': -118.25,
+            'radius': 10,
+        })
+
+    def test_get_customer_points(self):
+        self.measure('get-customer-points-by-restaurant/<int:restaurant_id>', self.customer_client, 'get', f'/get-customer-points-by-restaurant/{self.restaurant.id}')
+
+    def test_get_customer_points_list(self):
+        self.measure('get-customer-points-list', self.customer_client, 'get', '/get-customer-points-list')
+
+    def test_get_customer_points_manager_view(self):
+        self.measure('get-customer-points-manager-view', self.manager_client, 'get', '/get-customer-points-manager-view')
+
+    def test_get_items_by_restaurant(self):
+        self.measure('get-items-by-restaurant/<int:restaurant_id>', self.customer_client, 'get', f'/get-items-by-restaurant/{self.restaurant.id}')
+
+    def test_restaurant_and_items_are_cached(self):
+        for path in (f'/get-restaurant/{self.restaurant.id}', f'/get-items-by-restaurant/{self.restaurant.id}'):
+            with self.subTest(path=path):
+                etag = self.customer_client.get(path)['ETag']
+                with self.assertNumQueries(0):
+                    response = self.customer_client.get(path, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertFalse(response.content)
+
+        # Editing the menu drops the cached items
+        items_path = f'/get-items-by-restaurant/{self.restaurant.id}'
+        etag = self.customer_client.get(items_path)['ETag']
+        self.manager_client.patch('/update-item/', {'item_id': self.item.id, 'name': 'Renamed'}, format='json')
+        response = self.customer_client.get(items_path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Renamed', [item['name'] for item in response.data])
+
+    def test_conditional_get_customer_points_list_and_friends(self):
+        changes = {
+            '/get-customer-points-list': lambda: ledger.buffer_point(self.customer, self.restaurant),
+            '/get-friends': lambda: Customer.objects.get(id=self.friend.id).save(),
+        }
+        for path, change in changes.items():
+            with self.subTest(path=path):
+                with CaptureQueriesContext(connection) as full:
+                    response = self.customer_client.get(path)
+                etag = response['ETag']
+                self.assertIn('Last-Modified', response)
+
+                # The 304 stops after the version aggregate
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.customer_client.get(path, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertFalse(response.content)
+                self.assertEqual(response['ETag'], etag)
+                self.assertEqual(len(queries), len(full) - 1)
+
+                change()
+                response = self.customer_client.get(path, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+    def test_etags_change_when_an_older_change_commits_last(self):
+        other_restaurant = Restaurant.objects.exclude(id=self.restaurant.id).first()
+        other_friend = Customer.objects.exclude(id__in=[self.customer.id, self.friend.id, self.stranger.id]).first()
+        Friendship.objects.get_or_create(customer=self.customer, friend=other_friend)
+
+        # Each pair of updates overlaps: the first one commits last with the older timestamp
+        earlier = timezone.now() - timedelta(minutes=1)
+        updates = {
+            '/get-customer-points-list': (
+                lambda: ledger.credit_point(self.customer, other_restaurant),
+                lambda: CustomerPoints.objects.filter(customer=self.customer, restaurant=self.restaurant).update(
+                    num_points=F('num_points') + 1, updated_at=earlier,
+                ),
+            ),
+            '/get-friends': (
+                lambda: Customer.objects.get(id=other_friend.id).save(),
+                lambda: Customer.objects.filter(id=self.friend.id).update(first_name='Late', updated_at=earlier),
+            ),
+        }
+        for path, changes in updates.items():
+            with self.subTest(path=path):
+                etag = self.customer_client.get(path)['ETag']
+                for change in changes:
+                    change()
+                    response = self.customer_client.get(path, HTTP_IF_NONE_MATCH=etag)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertNotEqual(response['ETag'], etag)
+                    etag = response['ETag']
+
+    def test_get_customer_manager_view(self):
+        self.measure('get-customer-manager-view/<int:customer_id>', self.manager_client, 'get', f'/get-customer-manager-view/{self.customer.id}')
+
+    def test_get_friends(self):
+        self.measure('get-friends', self.customer_client, 'get', '/get-friends')
+
+    def test_get_push_tokens(self):
+        self.measure('get-push-tokens/<str:phone_number>', self.customer_client, 'get', f'/get-push-tokens/{self.friend.phone_number}')
+
+    # PUSH NOTIFICATION
+
+    def test_has_accounts(self):
+        contacts = [
+            {'name': f'Contact {i}', 'phoneNumbers': [{'number': f'(555) {i:03d}-{i:04d}'}, {'digits': f'+1555{i:07d}'}]}
+            for i in range(500)
+        ]
+        self.measure('has-accounts/', self.customer_client, 'post', '/has-accounts/', {'contacts': contacts})
+
+    def test_has_accounts_skips_malformed_contacts(self):
+        contacts = [
+            'not a contact',
+            {'name': 'No list', 'phoneNumbers': '(555) 000-0000'},
+            {'name': 'Bad entries', 'phoneNumbers': [None, 'x', {'number': 5551234567}, {'digits': ['+15551234567']}]},
+            {'name': 'Stranger', 'phoneNumbers': [{'number': 42}, {'number': self.stranger.phone_number}]},
+        ]
+        response = self.customer_client.post('/has-accounts/', {'contacts': contacts}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([contact['name'] for contact in response.data['account_list']], ['Stranger'])
+        self.assertEqual(response.data['no_account_list'], [])
+
+    def test_match_contacts(self):
+        hashes = [hash_phone_number(f'+1555{i:07d}') for i in range(500)]
+        self.measure('match-contacts/', self.customer_client, 'post', '/match-contacts/', {'hashes': hashes})
+
+    def test_match_contacts_only_shows_friends_profiles(self):
+        response = self.customer_client.post('/match-contacts/', {'hashes': [self.friend.phone_hash, self.stranger.phone_hash]}, format='json')
+        matches = {match['id']: match for match in response.data['matches']}
+        self.assertEqual(matches[self.friend.id]['first_name'], self.friend.first_name)
+        self.assertEqual(set(matches[self.stranger.id]), {'hash', 'id', 'is_friend'})
+
+    @override_settings(MATCH_CONTACTS_RATE='2/day')
+    def test_match_contacts_is_throttled(self):
+        statuses = [self.customer_client.post('/match-contacts/', {'hashes': []}, format='json').status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_send_point_push_notification(self):
+        self.measure('send-point-push-notification/', self.customer_client, 'post', '/send-point-push-notification/', {
+            'push_token': 'ExponentPushToken[friend]',
+            'restaurant_id': self.restaurant.id,
+        })
+        push = OutboundPush.objects.get()
+        self.assertEqual((push.token, push.status), ('ExponentPushToken[friend]', OutboundPush.Status.SENT))
+
+    def test_send_friend_request_push_notification(self):
+        self.measure('send-friend-request-push-notification/', self.customer_client, 'post', '/send-friend-request-push-notification/', {
+            'push_token': 'ExponentPushToken[friend]',
+        })
+        push = OutboundPush.objects.get()
+        self.assertEqual((push.token, push.status), ('ExponentPushToken[friend]', OutboundPush.Status.SENT))
+
+    def test_send_push_notification(self):
+        response = self.measure('send-push-notification/', self.customer_client, 'post', '/send-push-notification/', {
+            'customer_id': self.friend.id,
+            'event': 'point_gift',
+            'restaurant_id': self.restaurant.id,
+        })
+        self.assertEqual(response.data['devices'], 1)
+        self.assertEqual(list(OutboundPush.objects.values_list('token', flat=True)), ['ExponentPushToken[friend]'])
+
+    def test_send_push_notification_to_a_stranger(self):
+        response = self.customer_client.post('/send-push-notification/', {'customer_id': self.stranger.id, 'event': 'friend_request'}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(OutboundPush.objects.exists())
+
+    def test_generate_ws_access_token(self):
+        response = self.measure('generate-ws-access-token/', self.customer_client, 'post', '/generate-ws-access-token/', {
+            'id': self.customer.id,
+            'role': 'CUSTOMER',
+        })
+        payload = jwt.decode(response.data['token'], 'test-ws-secret', algorithms=['HS256'])
+        self.assertEqual((payload['id'], payload['role']), (self.customer.id, 'CUSTOMER'))
+
+    def test_twilio_status_callback(self):
+        sms = queue_sms('+15559990005', 'Hello')
+        sms.refresh_from_db()
+        self.measure('twilio-status-callback/', self.anonymous_client, 'post', '/twilio-status-callback/', {
+            'MessageSid': sms.sid,
+            'MessageStatus': 'delivered',
+        }, format='multipart')
+        sms.refresh_from_db()
+        self.assertEqual(sms.delivery_status, 'delivered')
+
+    def test_dummy(self):
+        self.measure('dummy/', self.anonymous_client, 'patch', '/dummy/', {'data': 'x'})
+
+    # STAFF
+
+    def test_router_lists(self):
+        for prefix, _, _ in urls.router.registry:
+            with self.subTest(prefix=prefix):
+                # Transactions are paginated so the list doesn't serialize the whole history
+                path = f'/{prefix}/?page_size=50' if prefix == 'transactions' else f'/{prefix}/'
+                self.measure(prefix + '/', self.staff_client, 'get', path)
+
+@override_settings(
+    TASKS_ALWAYS_EAGER=True,
+    SMS_RATE_PER_SECOND=1000,
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+)
+class OutboxTests(TestCase):
+    """
+    Delivery failures of queued text messages and emails are retried instead of losing the batch.
+    """
+    def setUp(self):
+        self.twilio = TwilioTestClient(None, None)
+        for patch in (mock.patch('users.sms.twilio_client', self.twilio), mock.patch('users.sms.defer'), mock.patch('users.mail.defer')):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_sms_connection_errors_are_retried(self):
+        # Different sending numbers, so the rate limit can't hold the second message back
+        failing = queue_sms('+15550000001', 'one', from_number='+15559999999')
+        sent = queue_sms('+15550000002', 'two', from_number='+15558888888')
+        create = self.twilio.messages.create
+
+        def create_or_time_out(to, **kwargs):
+            if to == failing.to:
+                raise requests.ConnectionError("Read timed out")
+            return create(to=to, **kwargs)
+
+        with mock.patch.object(self.twilio.messages, 'create', side_effect=create_or_time_out):
+            self.assertEqual(send_pending_sms(), 1)
+
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, OutboundSMS.Status.PENDING)
+        self.assertEqual(failing.attempts, 1)
+        self.assertIn('timed out', failing.last_error)
+        sent.refresh_from_db()
+        self.assertEqual(sent.status, OutboundSMS.Status.SENT)
+
+    @override_settings(SMS_RATE_PER_SECOND=1)
+    def test_sms_rate_limit_holds_messages_back(self):
+        queue_sms('+15550000001', 'one', from_number='+15559999999')
+        queue_sms('+15550000002', 'two', from_number='+15559999999')
+        queue_sms('+15550000003', 'three', from_number='+15558888888')
+
+        # One message per sending number; the other one waits for its number's next slot
+        self.assertEqual(send_pending_sms(), 2)
+        waiting = OutboundSMS.objects.get(status=OutboundSMS.Status.PENDING)
+        self.assertEqual((waiting.body, waiting.attempts), ('two', 0))
+
+        SMSSendSlot.objects.update(next_send_at=timezone.now())
+        self.assertEqual(send_pending_sms(), 1)
+
+    def test_emails_go_out_over_one_connection(self):
+        count = 500
+        for i in range(count):
+            queue_email('Subject', f'Body {i}', [f'customer{i}@example.com'])
+
+        with mock.patch('users.mail.get_connection', wraps=get_connection) as connections:
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                self.assertEqual(send_pending_emails(limit=count), count)
+                elapsed = time.perf_counter() - started
+
+        self.assertEqual(len(mail.outbox), count)
+        connections.assert_called_once()
+        # Claiming and marking each email, plus finding the due ones
+        self.assertLessEqual(len(queries), 2 * count + 2, f"{count} emails in {elapsed:.2f}s")
+
+    def test_email_connection_failure_only_retries_unhandled_emails(self):
+        sent, rejected, unsent = [queue_email('Subject', 'Body', [f'customer{i}@example.com']) for i in range(3)]
+        messages = []
+
+        def build_message(**kwargs):
+            # Failing on the third email breaks out of the loop like a lost connection
+            if len(messages) == 2:
+                raise SMTPServerDisconnected("Connection unexpectedly closed")
+            messages.append(EmailMessage(**kwargs))
+            return messages[-1]
+
+        def send_messages(backend, batch):
+            if batch[0].to == rejected.recipients:
+                raise SMTPRecipientsRefused({rejected.recipients[0]: (550, b'No such user')})
+            mail.outbox.extend(batch)
+            return len(batch)
+
+        with mock.patch('users.mail.EmailMessage', side_effect=build_message), \
+                mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', send_messages), \
+                mock.patch('users.mail.mark_failed', wraps=mark_failed) as failed, \
+                self.assertLogs('users.mail', 'ERROR'):
+            self.assertEqual(send_pending_emails(), 1)
+
+        self.assertEqual([call.args[0].id for call in failed.call_args_list], [rejected.id, unsent.id])
+        sent.refresh_from_db()
+        self.assertEqual(sent.status, OutboundEmail.Status.SENT)
+        rejected.refresh_from_db()
+        self.assertEqual(rejected.status, OutboundEmail.Status.PENDING)
+        self.assertIn('No such user', rejected.last_error)
+        unsent.refresh_from_db()
+        self.assertEqual((unsent.status, unsent.last_error), (OutboundEmail.Status.PENDING, "Connection unexpectedly closed"))
+
+    def test_worker_survives_a_failing_step(self):
+        queue_sms('+15550000001', 'one')
+        queue_email('Subject', 'Body', ['someone@example.com'])
+
+        with mock.patch.object(self.twilio.messages, 'create', side_effect=RuntimeError("unexpected")):
+            with self.assertLogs('users.management.commands.run_worker', 'ERROR'):
+                call_command('run_worker', '--once', stdout=StringIO())
+
+        self.assertEqual(OutboundEmail.objects.get().status, OutboundEmail.Status.SENT)
+
+@override_settings(TASKS_ALWAYS_EAGER=True, PUSH_RECEIPT_MAX_POLLS=2)
+class PushOutboxTests(TestCase):
+    """
+    Push messages are stored, sent to Expo in batches, retried from the outbox and
+    followed up with receipts.
+    """
+    @classmethod
+    def setUpClass(cls):
+        start_fake_expo(cls)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.get(id=seed_customers(random.Random(0), 1)[0])
+
+    def setUp(self):
+        FakeExpoHandler.reset()
+        # Send explicitly instead of once per queued message
+        patch = mock.patch('users.push.defer')
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def queue(self, count, prefix='ExponentPushToken'):
+        tokens = [f'{prefix}[{i}]' for i in range(count)]
+        PushToken.objects.bulk_create([PushToken(customer=self.customer, token=token) for token in tokens])
+        for token in tokens:
+            push.queue_push(push.friend_request_message(token, self.customer))
+        return tokens
+
+    def sends(self):
+        return [payload for path, payload in FakeExpoHandler.requests if path.endswith('/send')]
+
+    def test_messages_are_sent_in_batches(self):
+        self.queue(150)
+        self.assertEqual(push.send_pending_pushes(), 150)
+
+        self.assertEqual([len(payload) for payload in self.sends()], [100, 50])
+        self.assertFalse(OutboundPush.objects.exclude(status=OutboundPush.Status.SENT).exists())
+        self.assertFalse(OutboundPush.objects.filter(Q(ticket_id='') | Q(receipt_check_at=None)).exists())
+
+    def test_server_errors_are_retried_later(self):
+        self.queue(1)
+        FakeExpoHandler.failures = [503]
+
+        self.assertEqual(push.send_pending_pushes(), 0)
+        message = OutboundPush.objects.get()
+        self.assertEqual(message.status, OutboundPush.Status.PENDING)
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('503', message.last_error)
+        self.assertGreater(message.next_attempt_at, timezone.now())
+
+        # Nothing is sent before the retry is due
+        self.assertEqual(push.send_pending_pushes(), 0)
+        self.assertEqual(len(self.sends()), 1)
+
+        OutboundPush.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(push.send_pending_pushes(), 1)
+        self.assertEqual(OutboundPush.objects.get().status, OutboundPush.Status.SENT)
+
+    def test_unregistered_devices_are_dropped(self):
+        tokens = self.queue(2)
+        FakeExpoHandler.ticket_errors = {tokens[0]: 'DeviceNotRegistered'}
+
+        self.assertEqual(push.send_pending_pushes(), 1)
+        failed = OutboundPush.objects.get(token=tokens[0])
+        self.assertEqual(failed.status, OutboundPush.Status.FAILED)
+        self.assertFalse(PushToken.objects.filter(token=tokens[0]).exists())
+        self.assertTrue(PushToken.objects.filter(token=tokens[1]).exists())
+
+    def test_receipts(self):
+        delivered, unregistered, late = self.queue(3)
+        push.send_pending_pushes()
+        tickets = dict(OutboundPush.objects.values_list('token', 'ticket_id'))
+        FakeExpoHandler.receipts = {
+            tickets[delivered]: {'status': 'ok'},
+            tickets[unregistered]: {'status': 'error', 'message': 'Gone', 'details': {'error': 'DeviceNotRegistered'}},
+        }
+
+        # Receipts are only asked for once they are due
+        self.assertEqual(push.check_push_receipts(), 0)
+        OutboundPush.objects.update(receipt_check_at=timezone.now())
+        self.assertEqual(push.check_push_receipts(), 2)
+
+        receipts = {message.token: message for message in OutboundPush.objects.all()}
+        self.assertEqual(receipts[delivered].receipt_status, 'ok')
+        self.assertIsNone(receipts[delivered].receipt_check_at)
+        self.assertEqual(receipts[unregistered].receipt_status, 'error')
+        self.assertFalse(PushToken.objects.filter(token=unregistered).exists())
+
+        # A receipt that is not ready is asked for again, up to PUSH_RECEIPT_MAX_POLLS times
+        self.assertEqual(receipts[late].receipt_checks, 1)
+        self.assertGreater(receipts[late].receipt_check_at, timezone.now())
+        OutboundPush.objects.filter(token=late).update(receipt_check_at=timezone.now())
+        self.assertEqual(push.check_push_receipts(), 0)
+        self.assertIsNone(OutboundPush.objects.get(token=late).receipt_check_at)
+        self.assertEqual(len(FakeExpoHandler.requests), 3)
+
+@override_settings(TASKS_ALWAYS_EAGER=False)
+class RestaurantStatsTests(TestCase):
+    """
+    Rolling transactions up in batches gives the same rows as a rebuild, and stats read
+    while a rollup commits count every transaction once.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        restaurant_ids = seed_restaurants(rng, 3, items_per_restaurant=0)
+        cls.pairs = seed_points(rng, seed_customers(rng, 20), restaurant_ids)
+        seed_transactions(rng, cls.pairs, 500, years=1)
+        cls.restaurant = Restaurant.objects.get(id=restaurant_ids[0])
+
+    def rollup_rows(self):
+        return (
+            sorted(RestaurantStats.objects.values_list('restaurant', 'period', 'start', 'transaction_type', 'transactions', 'points')),
+            sorted(RestaurantCustomerDay.objects.values_list('restaurant', 'customer', 'day')),
+        )
+
+    def roll_up_all(self, batch_size):
+        while roll_up_transactions(batch_size=batch_size):
+            pass
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        self.roll_up_all(37)
+        seed_transactions(random.Random(1), self.pairs, 100, years=1)
+        self.roll_up_all(37)
+
+        self.assertEqual(last_rolled_up_id(), Transaction.objects.aggregate(last_id=Max('id'))['last_id'])
+        incremental = self.rollup_rows()
+        rebuild_restaurant_stats()
+        self.assertEqual(self.rollup_rows(), incremental)
+
+    def test_rollup_skips_id_gaps(self):
+        self.roll_up_all(10)
+        last_id = last_rolled_up_id()
+        transaction = Transaction.objects.create(
+            id=last_id + 100,
+            restaurant=self.restaurant,
+            customer_string='',
+            transaction_type='point',
+            num_points=1,
+            transaction_date=timezone.now() - timedelta(days=1),
+        )
+
+        self.assertEqual(roll_up_transactions(batch_size=10), 1)
+        self.assertEqual(last_rolled_up_id(), transaction.id)
+
+    def test_stats_read_during_a_rollup(self):
+        rebuild_restaurant_stats()
+        seed_transactions(random.Random(1), self.pairs, 100, years=1)
+
+        read = stats.read_restaurant_stats
+        def roll_up_then_read(*args):
+            # The first read starts from the old watermark, then a rollup commits before the rollups are read
+            if not roll_up_then_read.rolled_up:
+                roll_up_then_read.rolled_up = True
+                self.roll_up_all(1000)
+            return read(*args)
+        roll_up_then_read.rolled_up = False
+
+        since, until = timezone.now() - timedelta(days=2 * 365), timezone.now()
+        with mock.patch('users.stats.read_restaurant_stats', side_effect=roll_up_then_read) as reads:
+            rows = restaurant_stats(self.restaurant, RestaurantStats.Period.DAY, since, until)
+
+        self.assertEqual(reads.call_count, 2)
+        transactions = Transaction.objects.filter(restaurant=self.restaurant)
+        self.assertEqual(sum(sum(total['count'] for total in row['transactions'].values()) for row in rows), transactions.count())
+        self.assertEqual(
+            sum(row['active_customers'] for row in rows),
+            len(set(transactions.annotate(day=TruncDate('transaction_date')).values_list('day', 'customer'))),
+        )
+
+@override_settings(TASKS_ALWAYS_EAGER=True)
+class AwardPointConcurrencyTests(TransactionTestCase):
+    """
+    Many threads scanning at one restaurant through award-point/ must not lose points: every
+    successful scan shows up once in the balance and once as a transaction.
+    """
+    THREADS = 8
+    SCANS_PER_THREAD = 25
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.restaurant = Restaurant.objects.get(id=seed_restaurants(rng, 1)[0])
+        self.customer = Customer.objects.get(id=seed_customers(rng, 1)[0])
+        # Start from an existing row so every thread updates the same one
+        ledger.grant_bonus(self.customer, self.restaurant, 0)
+
+    def retry_locked(self, func):
+        # sqlite locks the whole database for a writer; work that could not get the lock
+        # rolled back completely, so it is safe to run again
+        while True:
+            try:
+                return func()
+            except OperationalError as error:
+                if 'locked' not in str(error):
+                    raise
+
+    def start_threads(self, targets):
+        errors = []
+
+        def run(target):
+            try:
+                target()
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+        for thread in threads:
+            thread.start()
+
+        def join():
+            for thread in threads:
+                thread.join()
+            self.assertEqual(errors, [])
+        return join
+
+    def scan_concurrently(self):
+        """
+        Scan the restaurant's QR code from every thread. Returns the number of scans answered
+        with 200; the others found the code already rotated by another thread's scan.
+        """
+        barrier = threading.Barrier(self.THREADS)
+        authorization = 'Bearer ' + tokens_for_user(self.customer)['access']
+        view = resolve('/award-point/').func
+        request_factory = APIRequestFactory()
+        statuses = []
+
+        def request():
+            code = RestaurantQR.objects.get(restaurant=self.restaurant).code
+            return view(request_factory.patch('/award-point/', {'code': str(code)}, format='json', HTTP_AUTHORIZATION=authorization))
+
+        def scan():
+            # The test client keeps request exceptions in state shared by all clients, so the
+            # threads call the view through the URL conf themselves
+            barrier.wait()
+            for _ in range(self.SCANS_PER_THREAD):
+                statuses.append(self.retry_locked(request).status_code)
+
+        def rotate_qr(key, func, *args, **kwargs):
+            # The rotation runs once the scan has committed; retry only the rotation, since
+            # replaying the whole request would award the point twice
+            self.retry_locked(lambda: func(*args, **kwargs))
+
+        with mock.patch('users.function_views.defer', rotate_qr):
+            self.start_threads([scan] * self.THREADS)()
+        self.assertEqual(set(statuses) - {200, 404}, set())
+        return statuses.count(200)
+
+    def assert_scanned(self, scans):
+        self.assertGreater(scans, 0)
+        points = CustomerPoints.objects.get(customer=self.customer, restaurant=self.restaurant)
+        self.assertEqual(points.num_points, scans)
+        self.assertTrue(points.give_point_eligible)
+        self.assertEqual(Transaction.objects.filter(customer=self.customer, restaurant=self.restaurant, transaction_type='point').count(), scans)
+        self.assertEqual(LedgerEntry.objects.filter(customer=self.customer, restaurant=self.restaurant).aggregate(total=Sum('delta'))['total'], scans)
+
+    def test_award_point(self):
+        self.assert_scanned(self.scan_concurrently())
+
+    def test_ledger_award_point(self):
+        barrier = threading.Barrier(self.THREADS)
+
+        def scan():
+            barrier.wait()
+            for _ in range(self.SCANS_PER_THREAD):
+                self.retry_locked(lambda: ledger.award_point(self.customer, self.restaurant))
+
+        self.start_threads([scan] * self.THREADS)()
+        self.assert_scanned(self.THREADS * self.SCANS_PER_THREAD)
+
+    @override_settings(POINTS_BUFFERED_SCANS=True)
+    def test_award_point_buffered(self):
+        scanned = threading.Event()
+
+        def compact():
+            while not scanned.is_set():
+                self.retry_locked(lambda: ledger.compact_point_deltas(limit=10))
+
+        # Compactors race the scans and each other instead of running inside the scans
+        with mock.patch('users.ledger.defer'):
+            join_compactors = self.start_threads([compact] * 2)
+            scans = self.scan_concurrently()
+            scanned.set()
+            join_compactors()
+
+        while ledger.compact_point_deltas():
+            pass
+        self.assertFalse(PointDelta.objects.exists())
+        self.assert_scanned(scans)
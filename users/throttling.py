@@ -0,0 +1,12 @@
+from django.conf import settings
+from rest_framework.throttling import UserRateThrottle
+
+class ContactMatchThrottle(UserRateThrottle):
+    """
+    Limits how often a customer can match contacts. Phone numbers are few enough to hash
+    them all, so without a limit match-contacts/ would look up whose numbers they are in bulk.
+    """
+    scope = 'match_contacts'
+
+    def get_rate(self):
+        return settings.MATCH_CONTACTS_RATE
@@ -2,30 +2,44 @@
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework import viewsets
 from rest_framework.serializers import ModelSerializer, SerializerMethodField
 from users.models import Customer, Manager, Restaurant, Item, CustomerPoints, ItemRedemption, RestaurantQR, Friendship, Referral
 from users.models import PushToken, Transaction
 from users.permissions import StaffPermissions
+from users.authentication import tokens_for_user
+from users.pagination import TransactionPagination
 
 from twilio_config import twilio_client, twilio_phone_number
 
 
 class CustomerSerializer(ModelSerializer):
+    """
+    A customer's own profile.
+    """
+    class Meta:
+        model = Customer
+        fields = ['id', 'first_name', 'last_name', 'email', 'username', 'phone_number', 'profile_picture']
+
+class CustomerPublicSerializer(ModelSerializer):
+    """
+    What other customers and managers see of a customer.
+    """
+    class Meta:
+        model = Customer
+        fields = ['id', 'first_name', 'last_name', 'username', 'phone_number', 'profile_picture']
+
+class CustomerAuthSerializer(CustomerSerializer):
+    """
+    The profile returned on login and registration, with a new token pair.
+    """
     token = SerializerMethodField()
 
     def get_token(self, user):
-        refresh = RefreshToken.for_user(user)
+        return tokens_for_user(user)
 
-        return {
-            'refresh': str(refresh),
-            'access': str(refresh.access_token),
-        }
-    
-    class Meta:
-        model = Customer
-        fields = ['id', 'first_name', 'last_name', 'email', 'username', 'token', 'phone_number', 'profile_picture']
+    class Meta(CustomerSerializer.Meta):
+        fields = CustomerSerializer.Meta.fields + ['token']
 
 class CustomerViewSet(viewsets.ModelViewSet):
     serializer_class = CustomerSerializer
@@ -59,8 +73,10 @@ class TransactionSerializer(ModelSerializer):
 
 class TransactionViewSet(viewsets.ModelViewSet):
     serializer_class = TransactionSerializer
-    queryset = Transaction.objects.all()
+    # The whole list stays oldest first as it always was; pages come newest first
+    queryset = Transaction.objects.order_by('id')
     permission_classes = [StaffPermissions]
+    pagination_class = TransactionPagination
 
 class ReferralSerializer(ModelSerializer):
     class Meta:
@@ -93,7 +109,6 @@ class ItemViewSet(viewsets.ModelViewSet):
     permission_classes = [StaffPermissions]
 
 class ManagerSerializer(ModelSerializer):
-    token = SerializerMethodField()
     restaurant = RestaurantSerializer(required=True)
 
     def create(self, validated_data):
@@ -101,21 +116,25 @@ class ManagerSerializer(ModelSerializer):
         manager = Manager.objects.create_user(**validated_data)
         Restaurant.objects.create(manager=manager, **restaurant_data)
         return manager
-    
-    def get_token(self, user):
-        refresh = RefreshToken.for_user(user)
-
-        return {
-            'refresh': str(refresh),
-            'access': str(refresh.access_token),
-        }
 
     class Meta:
         model = Manager
-        fields = ['id', 'first_name', 'last_name', 'manager_email', 'username', 'token', 'restaurant', 'employee_code']
+        fields = ['id', 'first_name', 'last_name', 'manager_email', 'username', 'restaurant', 'employee_code']
+
+class ManagerAuthSerializer(ManagerSerializer):
+    """
+    The profile returned on login and registration, with a new token pair.
+    """
+    token = SerializerMethodField()
+
+    def get_token(self, user):
+        return tokens_for_user(user)
+
+    class Meta(ManagerSerializer.Meta):
+        fields = ManagerSerializer.Meta.fields + ['token']
 
 class ManagerViewSet(viewsets.ModelViewSet):
-    queryset = Manager.objects.all()
+    queryset = Manager.objects.select_related('restaurant')
     serializer_class = ManagerSerializer
     permission_classes = [StaffPermissions]
 